@@ -0,0 +1,137 @@
+import os
+import sys
+import json
+import glob
+import shutil
+import platform
+import tempfile
+import statistics
+import time
+from argparse import ArgumentParser
+
+sys.path.append("./libs")
+from libs import config, data, build_table, common, storage, synthetic
+from excel import table
+
+# 計測する処理(実行する順)
+PHASES = ["read_data_store", "read_config_file", "read_data_file", "update", "save_json", "aggregate", "build_business_books", "create_pl_book"]
+
+
+def _parser():
+    usage = 'python {} [-d directory] [-r repeat] [-o output] [--baseline file] [--help]'.format(os.path.basename(__file__))
+    argparser = ArgumentParser(usage=usage)
+    argparser.add_argument('-d', '--directory', type=str, default="../bench", help='directory of the dataset made by generate_dataset_cmd.py')
+    argparser.add_argument('-r', '--repeat', type=int, default=3, help='number of runs')
+    argparser.add_argument('-s', '--start', type=str, help='start month (YYYYMM) of the books (default: whole dataset)')
+    argparser.add_argument('-e', '--end', type=str, help='end month (YYYYMM) of the books (default: whole dataset)')
+    argparser.add_argument('--write-only', action="store_true", default=False, help='write excel files in streaming (write-only) mode')
+    argparser.add_argument('--totals', type=str, choices=table.TOTALS, default=table.TOTALS_FORMULA, help='how to write totals')
+    argparser.add_argument('-o', '--output', type=str, help='write the result (JSON) to this file instead of stdout')
+    argparser.add_argument('--baseline', type=str, help='result (JSON) of a previous run to compare with')
+    argparser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown of the median against the baseline (0.2 = 20%%)')
+    argparser.add_argument('--min-delta', type=float, default=0.05, help='ignore slowdowns smaller than this many seconds')
+    return argparser.parse_args()
+
+
+def run_once(src: str, start: str, end: str, write_only: bool, totals: str) -> dict:
+    """データを一時ディレクトリにコピーし、pl_planner_cmd.pyと同じ順に処理して、処理ごとの時間(秒)を返す"""
+    result = dict()
+    with tempfile.TemporaryDirectory() as directory:
+        for path in glob.glob(os.path.join(src, "*")):
+            if os.path.isfile(path):
+                shutil.copy2(path, directory)
+
+        t = time.perf_counter()
+
+        def lap(name: str):
+            nonlocal t
+            now = time.perf_counter()
+            result[name] = now - t
+            t = now
+
+        store, label_mgr = storage.read_data_store(directory)
+        lap("read_data_store")
+        config.read_config_file(os.path.join(directory, "設定.xlsx"), store, label_mgr)
+        lap("read_config_file")
+        for business in store["definition"].keys():
+            fp = os.path.join(directory, f"{business}.xlsx")
+            if os.path.exists(fp):
+                data.read_data_file(fp, store, label_mgr)
+        lap("read_data_file")
+        data.update(store)
+        lap("update")
+        storage.JsonStorage(directory).save(store)
+        lap("save_json")
+        start_dt = common.get_term_start_month(common.convert_from_yyyymm(start), store["config"].get("決算月", 3))
+        end_dt = common.get_term_end_month(common.convert_from_yyyymm(end), store["config"].get("決算月", 3))
+        header_row = common.create_header_labels(start_dt, end_dt, store["config"].get("決算月", 3))
+        aggregation = data.aggregate(store, header_row)
+        lap("aggregate")
+        build_table.build_business_books(directory, store, start_dt, end_dt, aggregation, write_only=write_only, totals=totals)
+        lap("build_business_books")
+        build_table.create_pl_book(directory, store, start_dt, end_dt, aggregation, write_only=write_only, totals=totals)
+        lap("create_pl_book")
+    return result
+
+
+def summarize(runs: list[dict]) -> dict:
+    phases = dict()
+    for name in PHASES + ["total"]:
+        values = [r[name] for r in runs]
+        phases[name] = {"min": round(min(values), 6), "median": round(statistics.median(values), 6), "runs": [round(v, 6) for v in values]}
+    return phases
+
+
+def compare(result: dict, baseline: dict, tolerance: float, min_delta: float) -> list[str]:
+    """ベースラインより中央値が遅くなった処理を列挙する"""
+    regressions = list()
+    for name, current in result["phases"].items():
+        base = baseline.get("phases", {}).get(name)
+        if base is None: continue
+        if current["median"] > base["median"] * (1 + tolerance) and current["median"] - base["median"] > min_delta:
+            regressions.append(f"{name}: {base['median']:.3f}s -> {current['median']:.3f}s")
+    return regressions
+
+
+if __name__ == '__main__':
+    args = _parser()
+
+    manifest = synthetic.read_manifest(args.directory)
+    if manifest is None:
+        print("XXX no dataset in the directory (run generate_dataset_cmd.py first):", args.directory)
+        sys.exit(-1)
+    if args.repeat < 1:
+        print("XXX --repeat must be 1 or more:", args.repeat)
+        sys.exit(-1)
+    start = args.start or manifest["start"]
+    end = args.end or manifest["end"]
+
+    # 処理中のメッセージはstderrに出して、結果のJSONだけをstdoutに出す
+    runs = list()
+    stdout = sys.stdout
+    sys.stdout = sys.stderr
+    try:
+        for i in range(args.repeat):
+            r = run_once(args.directory, start, end, args.write_only, args.totals)
+            r["total"] = sum(r.values())
+            runs.append(r)
+    finally:
+        sys.stdout = stdout
+
+    result = {"dataset": manifest, "python": platform.python_version(), "repeat": args.repeat,
+              "options": {"start": start, "end": end, "write_only": args.write_only, "totals": args.totals},
+              "phases": summarize(runs)}
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            regressions = compare(result, json.load(f), args.tolerance, args.min_delta)
+        for r in regressions:
+            print("XXX 遅くなりました:", r, file=sys.stderr)
+        if len(regressions) > 0:
+            sys.exit(1)
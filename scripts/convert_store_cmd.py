@@ -0,0 +1,37 @@
+import os
+import sys
+from argparse import ArgumentParser
+
+sys.path.append("./libs")
+from libs import snapshot
+import storage
+
+
+def _parser():
+    usage = 'python {} [-d directory] (--to-snapshot | --to-json | --to-v1 | --to-v2) [--help]'.format(os.path.basename(__file__))
+    argparser = ArgumentParser(usage=usage)
+    argparser.add_argument('-d', '--directory', type=str, default="../data", help='directory where the data store is located')
+    group = argparser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--to-snapshot', action="store_true", default=False, help='convert store.json to store.plsnap')
+    group.add_argument('--to-json', action="store_true", default=False, help='convert store.plsnap to store.json')
+    group.add_argument('--to-v1', action="store_true", default=False, help='rewrite store.json in the old format (v1) for older versions of this tool')
+    group.add_argument('--to-v2', action="store_true", default=False, help='rewrite store.json in the current format (v2) without running pl_planner_cmd.py')
+    return argparser.parse_args()
+
+
+if __name__ == '__main__':
+    args = _parser()
+
+    if args.to_snapshot:
+        src, dst, convert = snapshot.STORE_FILE, snapshot.SNAPSHOT_FILE, snapshot.json_to_snapshot
+    elif args.to_v1 or args.to_v2:
+        version = 1 if args.to_v1 else 2
+        src, dst, convert = storage.STORE_FILE, f"{storage.STORE_FILE}(v{version})", lambda directory: storage.convert_store(directory, version)
+    else:
+        src, dst, convert = snapshot.SNAPSHOT_FILE, snapshot.STORE_FILE, snapshot.snapshot_to_json
+    if not os.path.exists(os.path.join(args.directory, src)):
+        print("XXX no such file:", os.path.join(args.directory, src))
+        sys.exit(-1)
+
+    convert(args.directory)
+    print(f"*** {src} を {dst} に変換しました")
@@ -0,0 +1,35 @@
+import os
+import sys
+from argparse import ArgumentParser
+
+sys.path.append("./libs")
+from libs import synthetic
+
+
+def _parser():
+    usage = 'python {} [-d directory] [-b businesses] [-p profit_labels] [-l loss_labels] [-y years] [--help]'.format(os.path.basename(__file__))
+    argparser = ArgumentParser(usage=usage)
+    argparser.add_argument('-d', '--directory', type=str, default="../bench", help='directory to write the dataset to')
+    argparser.add_argument('-b', '--businesses', type=int, default=10, help='number of businesses')
+    argparser.add_argument('-p', '--profit-labels', type=int, default=5, help='number of profit labels per business')
+    argparser.add_argument('-l', '--loss-labels', type=int, default=20, help='number of loss labels per business')
+    argparser.add_argument('-y', '--years', type=int, default=3, help='number of fiscal years of history')
+    argparser.add_argument('--common-share', type=float, default=0.5, help='share of common expense accounts to allocate to businesses (0-1)')
+    argparser.add_argument('-e', '--end', type=str, help='a month (YYYYMM) in the last fiscal year (default: this month)')
+    argparser.add_argument('--seed', type=int, default=0, help='random seed')
+    return argparser.parse_args()
+
+
+if __name__ == '__main__':
+    args = _parser()
+
+    if os.path.exists(os.path.join(args.directory, "設定.xlsx")):
+        print("XXX the directory already contains a dataset:", args.directory)
+        sys.exit(-1)
+    if args.businesses < 1 or args.profit_labels < 1 or args.loss_labels < 1 or args.years < 1 or not 0 <= args.common_share <= 1:
+        print("XXX invalid scale parameters")
+        sys.exit(-1)
+
+    manifest = synthetic.generate_dataset(args.directory, args.businesses, args.profit_labels, args.loss_labels, args.years,
+                                          args.common_share, args.end, args.seed)
+    print(f"*** {args.directory} にデータを作成しました: {manifest}")
@@ -0,0 +1,119 @@
+from typing import Union, Dict
+
+from columnar import SCENARIOS, to_value, is_number
+
+
+class Aggregation:
+    """表に出す集計値(売上項目別、経費グループ別、変動費・固定費別、カテゴリ別、利益)をまとめて計算する
+    事業ごとに、表の期間の月のMonthlyDataの行を一行ずつ一度だけ見て、全ての集計値に足す(配列での一括計算はしない)
+    表ごとにデータストアを集計し直さないように、build_business_booksとcreate_pl_bookで同じインスタンスを共有して使う
+    """
+
+    def __init__(self, data_store: Union[dict, None], header_row: list[str]):
+        """
+        Args:
+            data_store (Union[dict, None]): データストア。Noneなら空の集計結果を作る(集計値は呼び出し元で設定する)
+            header_row (list[str]): 表のヘッダ(年月と決算の列)
+        """
+        self.header_row = header_row
+        self.months = list(filter(lambda x: "決算" not in x, header_row))
+
+        # 事業ごとの集計値 key = [typ][business][yyyymm]
+        self.sales = {}            # type: Dict[str, Dict[str, Dict[str, float]]]  # 売上の合計
+        self.fixval = {}           # type: Dict[str, Dict[str, Dict[str, Dict[str, float]]]]  # 変動費・固定費ごとの合計
+        self.category = {}         # type: Dict[str, Dict[str, Dict[str, Dict[str, float]]]]  # 経費カテゴリごとの合計
+        self.variable_ratio = {}   # type: Dict[str, Dict[str, Dict[str, float]]]  # 変動比率
+        # 全事業の集計値 key = [typ][yyyymm]
+        self.profit = {}           # type: Dict[str, Dict[str, Dict[str, float]]]  # 売上項目ごとの合計
+        self.group = {}            # type: Dict[str, Dict[str, Dict[str, float]]]  # 経費グループごとの合計(全社共通は按分の残り)
+        self.earnings = {}         # type: Dict[str, Dict[str, float]]             # 利益
+
+        if data_store is None:
+            return
+        for typ in SCENARIOS:
+            for business, data in data_store.get(typ, {}).items():
+                self._add_business(typ, business, data.get("profit", {}), data.get("loss", {}))
+        self.calculate_variable_ratio()
+
+    def _add_business(self, typ: str, business: str, profit_months: dict, loss_months: dict):
+        """一つの事業の月ごとの行を、行のループで一度ずつ見て全ての集計値に足す
+        利益は月ごとに売上の行、経費の行の順に足す(事業の順番と合わせて、SqliteStorage.aggregateと同じ順番にする)
+        """
+        sales = self.sales.setdefault(typ, {}).setdefault(business, {})
+        fixval = self.fixval.setdefault(typ, {}).setdefault(business, {})
+        category = self.category.setdefault(typ, {}).setdefault(business, {})
+        profit = self.profit.setdefault(typ, {})
+        group = self.group.setdefault(typ, {})
+        earnings = self.earnings.setdefault(typ, {})
+        for yyyymm in self.months:
+            monthly = profit_months.get(yyyymm)
+            if hasattr(monthly, "rows"):
+                for r in monthly.rows:
+                    if r.label is None or not is_number(r.value): continue
+                    sales[yyyymm] = sales.get(yyyymm, 0) + r.value
+                    p = profit.setdefault(yyyymm, {})
+                    p[r.label.name] = p.get(r.label.name, 0) + r.value
+                    earnings[yyyymm] = earnings.get(yyyymm, 0) + r.value
+
+            monthly = loss_months.get(yyyymm)
+            if hasattr(monthly, "rows"):
+                for r in monthly.rows:
+                    if r.label is None or not is_number(r.value): continue
+                    f = fixval.setdefault(yyyymm, {})
+                    f[r.label.fixval] = f.get(r.label.fixval, 0) + r.value
+                    c = category.setdefault(yyyymm, {})
+                    c[r.label.category] = c.get(r.label.category, 0) + r.value
+
+                    # 全社統合版では、按分済みの経費は按分の残りだけを計上する
+                    val = r.value if r.rest_value is None else r.rest_value
+                    g = group.setdefault(yyyymm, {})
+                    g[r.label.group] = g.get(r.label.group, 0) + val
+                    earnings[yyyymm] = earnings.get(yyyymm, 0) - val
+
+    def calculate_variable_ratio(self):
+        """売上の合計と変動費の合計から変動比率を計算する"""
+        for typ, businesses in self.fixval.items():
+            for business, months in businesses.items():
+                total_sales = self.sales.get(typ, {}).get(business, {})
+                for yyyymm, values in months.items():
+                    if "変動費" in values and yyyymm in total_sales and total_sales[yyyymm] > 0:
+                        ratio = int(values["変動費"]/total_sales[yyyymm] * 10000)/10000
+                        self.variable_ratio.setdefault(typ, {}).setdefault(business, {})[yyyymm] = ratio
+
+    def for_business(self, business: str) -> 'Aggregation':
+        """一つの事業の集計値(事業別ファイルに出すもの)だけを持つAggregationを作る"""
+        result = Aggregation(None, self.header_row)
+        for name in ["sales", "fixval", "category", "variable_ratio"]:
+            for typ, businesses in getattr(self, name).items():
+                if business in businesses:
+                    getattr(result, name).setdefault(typ, {})[business] = businesses[business]
+        return result
+
+    def get_fixval(self, typ: str, business: str) -> Dict[str, Dict[str, Union[int, float]]]:
+        """変動費・固定費ごとの合計 key = [yyyymm][変動費/固定費]"""
+        return _copy_values(self.fixval.get(typ, {}).get(business, {}))
+
+    def get_category(self, typ: str, business: str) -> Dict[str, Dict[str, Union[int, float]]]:
+        """経費カテゴリごとの合計 key = [yyyymm][カテゴリ]"""
+        return _copy_values(self.category.get(typ, {}).get(business, {}))
+
+    def get_variable_ratio(self, typ: str, business: str) -> Dict[str, float]:
+        """変動比率 key = [yyyymm]"""
+        return dict(self.variable_ratio.get(typ, {}).get(business, {}))
+
+    def get_profit(self, typ: str) -> Dict[str, Dict[str, Union[int, float]]]:
+        """全事業の売上項目ごとの合計 key = [yyyymm][売上項目]"""
+        return _copy_values(self.profit.get(typ, {}))
+
+    def get_group(self, typ: str) -> Dict[str, Dict[str, Union[int, float]]]:
+        """全事業の経費グループごとの合計 key = [yyyymm][経費グループ]"""
+        return _copy_values(self.group.get(typ, {}))
+
+    def get_earnings(self, typ: str) -> Dict[str, Union[int, float]]:
+        """全事業の利益 key = [yyyymm]"""
+        return {yyyymm: to_value(v) for yyyymm, v in self.earnings.get(typ, {}).items()}
+
+
+def _copy_values(result: Dict[str, Dict[str, float]]) -> Dict[str, Dict[str, Union[int, float]]]:
+    """呼び出し元で書き換えても共有している集計結果が変わらないように、コピーして返す"""
+    return {yyyymm: {label: to_value(v) for label, v in values.items()} for yyyymm, values in result.items()}
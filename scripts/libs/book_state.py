@@ -0,0 +1,68 @@
+import os
+import json
+import hashlib
+
+from pldata import convert_proc
+from common import write_atomically
+
+
+STATE_FILE = "build_state.json"
+LAYOUT_VERSION = 1  # 表のレイアウトや書式を変えたら上げる(前回のフィンガープリントを全て無効にする)
+
+
+class BookState:
+    """書き出したエクセルファイルごとに、書き出した内容のフィンガープリントと書き出した直後のファイルの状態を覚えておく
+    フィンガープリントが同じで、ファイルが書き出した時のまま(サイズと更新日時が同じ)なら、書き直す必要はない
+    """
+
+    def __init__(self, directory: str, force=False):
+        """
+        Args:
+            directory (str): エクセルファイルと状態ファイルを置くディレクトリ
+            force (bool): Trueなら全てのファイルを書き直す
+        """
+        self.directory = directory
+        self.path = os.path.join(directory, STATE_FILE)
+        self.force = force
+        self.entries = {}  # key = ファイル名
+        self.changed = False
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                self.entries = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            print(f"XXX {self.path}が読み込めないので無視します")
+
+    def is_dirty(self, file_name: str, fingerprint: str) -> bool:
+        if self.force:
+            return True
+        entry = self.entries.get(file_name)
+        path = os.path.join(self.directory, file_name)
+        if entry is None or entry["fingerprint"] != fingerprint or not os.path.exists(path):
+            return True
+        # 書き出した後に手で編集されたファイルは、書き直して元に戻す
+        st = os.stat(path)
+        return entry["size"] != st.st_size or entry["mtime"] != st.st_mtime_ns
+
+    def written(self, file_name: str, fingerprint: str):
+        """ファイルを書き出した後に呼ぶ"""
+        st = os.stat(os.path.join(self.directory, file_name))
+        self.entries[file_name] = {"fingerprint": fingerprint, "size": st.st_size, "mtime": st.st_mtime_ns}
+        self.changed = True
+
+    def save(self):
+        if not self.changed:
+            return
+        write_atomically(self.path, self._write)
+        self.changed = False
+
+    def _write(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.entries, f, ensure_ascii=False)
+
+
+def fingerprint(payload: any) -> str:
+    """表に書き出す内容(MonthlyDataなどを含んでよい)のハッシュ値"""
+    text = json.dumps([LAYOUT_VERSION, payload], default=convert_proc, ensure_ascii=False)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
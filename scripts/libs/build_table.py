@@ -1,64 +1,187 @@
-from typing import Union, Dict
+from typing import Union, Dict, Tuple, Callable
 import os
 import datetime
+from concurrent.futures import ProcessPoolExecutor, Future
 
 from . import common, data
 from pldata import ProfitData, LossData, ProfitDataItem, LossDataItem, LabelManager, MonthlyData
 from excel import utils, styles, table
+from excel.cached_values import inject_cached_values
+from aggregate import Aggregation
+from book_state import BookState, fingerprint
+from profiler import Profiler, measure
 
 
-def build_business_books(directory: str, data_store: Union[dict, None], start_dt: datetime.datetime, end_dt: datetime.datetime):
+class BookWriter:
+    """ワークブックの作成と保存を、その場で、またはプロセスプールで行う
+    jobs > 1なら、事業別ファイルと全社統合版を別々のプロセスで同時に作る(wait()で全て書き出されるのを待つ)
+    profilerを渡すと、ワークブックごとにかかった時間と書き込んだセルの数などを記録する
+    """
+
+    def __init__(self, state: Union[BookState, None] = None, jobs=1, profiler: Union[Profiler, None] = None):
+        self.state = state
+        self.executor = ProcessPoolExecutor(max_workers=jobs) if jobs > 1 else None
+        self.profiler = profiler
+        self.pending = []  # type: list[Tuple[str, Union[str, None], Future]]  # (ファイル名, フィンガープリント, 実行中の処理)
+
+    @property
+    def parallel(self) -> bool:
+        return self.executor is not None
+
+    def submit(self, file_name: str, fp: Union[str, None], func: Callable, *args):
+        """func(*args)でfile_nameのワークブックを書き出す。fpは書き出した後にstateに記録するフィンガープリント"""
+        if self.profiler is not None:
+            # 別のプロセスで作る時も、時間と回数はそのプロセスで計測して返してもらう
+            func, args = measure, (self.profiler.memory, self.profiler.count, file_name, func) + args
+        if self.executor is None:
+            self._written(file_name, fp, func(*args))
+        else:
+            self.pending.append((file_name, fp, self.executor.submit(func, *args)))
+
+    def wait(self):
+        """プロセスプールに渡したワークブックが全て書き出されるのを待つ(途中で失敗したら、その例外を投げる)"""
+        if self.executor is None:
+            return
+        try:
+            for file_name, fp, future in self.pending:
+                self._written(file_name, fp, future.result())
+        finally:
+            self.pending = []
+            self.executor.shutdown(cancel_futures=True)
+
+    def _written(self, file_name: str, fp: Union[str, None], stats: Union[dict, None] = None):
+        if self.profiler is not None:
+            self.profiler.add_book(file_name, stats, self.parallel)
+        if self.state is not None and fp is not None:
+            self.state.written(file_name, fp)
+
+
+def build_business_books(directory: str, data_store: Union[dict, None], start_dt: datetime.datetime, end_dt: datetime.datetime,
+                         aggregation: Union[Aggregation, None] = None, state: Union[BookState, None] = None, write_only=False,
+                         writer: Union[BookWriter, None] = None, totals=table.TOTALS_FORMULA):
     """事業別ファイルを作成する
     保存済みのデータが存在するならそのデータで埋め、なければ空白にしてスタイルだけを設定する
+    stateを渡すと、前回書き出した時から内容が変わっていない事業のファイルは書き直さない
+    write_only=Trueなら、書き出し専用のワークブックで書き出す
+    writerを渡すと、ワークブックの作成と保存をwriterに任せる(書き出されるのを待つのは呼び出し元でwriter.wait()する)
+    totalsで集計行と決算列の書き出し方(SUMの式、計算した値、その両方)を選ぶ
     """
     settlement_month = data_store["config"].get("決算月", 3)  # type: int
     header_row = common.create_header_labels(start_dt, end_dt, settlement_month)
+    if aggregation is None:
+        aggregation = data.aggregate(data_store, header_row)
 
-    workbooks = dict()
     for typ in ["plan", "performance"]:
         for business, data_def in data_store["definition"].items():
             data_store.setdefault(typ, {}).setdefault(business, {}).setdefault("profit", {})
             data_store.setdefault(typ, {}).setdefault(business, {}).setdefault("loss", {})
             data_store.setdefault(typ, {}).setdefault(business, {}).setdefault("earnings", {})
 
-            # ワークブック、ワークシートの作成
-            if business not in workbooks:
-                workbooks[business] = utils.create_new_workbook()
-            workbooks[business].create_sheet(title=common.MAPPING1[typ])
-            ws = workbooks[business][common.MAPPING1[typ]]
+    own_writer = writer is None
+    if own_writer:
+        writer = BookWriter(state)
+
+    # 一度に一つのワークブックだけを作って保存する
+    for business in data_store["definition"].keys():
+        fp = None
+        if state is not None:
+            fp = _business_fingerprint(data_store, business, header_row, aggregation, totals)
+            if not state.is_dirty(f"{business}.xlsx", fp):
+                continue
+
+        if writer.parallel:
+            # 別のプロセスには、その事業の表示期間の分だけを渡す
+            writer.submit(f"{business}.xlsx", fp, _write_business_book, directory, business, header_row,
+                          _business_store(data_store, business, header_row), aggregation.for_business(business), write_only, totals)
+        else:
+            writer.submit(f"{business}.xlsx", fp, _write_business_book, directory, business, header_row,
+                          data_store, aggregation, write_only, totals)
+
+    if own_writer:
+        writer.wait()
+
+
+def _write_business_book(directory: str, business: str, header_row: list[str], data_store: dict, aggregation: Aggregation, write_only: bool,
+                         totals: str):
+    """事業別ファイルを一つ作って保存する"""
+    # ワークブック、ワークシートの作成
+    wb = utils.create_new_workbook(write_only)
+    cached = dict()  # key = シート名
+    for typ in ["plan", "performance"]:
+        wb.create_sheet(title=common.MAPPING1[typ])
+        ws = wb[common.MAPPING1[typ]]
+
+        tbl = create_main_table(ws, typ, business, header_row, data_store)
+        create_fixval_table(tbl, typ, business, header_row, data_store, aggregation)
+
+        # ヘッダ、ラベル部分を出力する
+        tbl.create_frame()
 
-            tbl = create_main_table(ws, typ, business, header_row, data_store)
-            create_fixval_table(tbl, typ, business, header_row, data_store)
+        # 集計行と決算列のSUMの式(または計算した値)を書き込む
+        cached[ws.title] = tbl.write_formulas(totals)
 
-            # ヘッダ、ラベル部分を出力する
-            tbl.create_frame()
+        # シート全体に渡って幅を自動調整する
+        utils.auto_adjust_column_width(ws)
+
+        # シートの行と列の表示を固定する
+        ws.freeze_panes = "D3"
 
-            # シート全体に渡って幅を自動調整する
-            utils.auto_adjust_column_width(ws)
+    wb.remove(wb["Sheet"])  # 最初から存在するシートは不要なので削除する
+    wb.save(os.path.join(directory, f"{business}.xlsx"))
+    if totals == table.TOTALS_BOTH:
+        inject_cached_values(os.path.join(directory, f"{business}.xlsx"), cached)
 
-            # シートの行と列の表示を固定する
-            ws.freeze_panes = "D3"
 
-            if "Sheet" in workbooks[business]:
-                workbooks[business].remove(workbooks[business]["Sheet"])  # 最初から存在するシートは不要なので削除する
-            workbooks[business].save(os.path.join(directory, f"{business}.xlsx"))
+def _business_store(data_store: dict, business: str, header_row: list[str]) -> dict:
+    """事業別ファイルを作るのに必要なデータストアの一部(その事業の表定義と、表示期間の月の値)"""
+    result = {"config": data_store["config"], "definition": {business: data_store["definition"][business]}}
+    for typ in ["plan", "performance"]:
+        data = data_store[typ][business]
+        result[typ] = {business: {kind: {yyyymm: data[kind][yyyymm] for yyyymm in header_row if yyyymm in data[kind]}
+                                  for kind in ["profit", "loss", "earnings"]}}
+    return result
 
 
-def create_pl_book(directory: str, data_store: dict, start_dt: datetime.datetime, end_dt: datetime.datetime):
-    """全社統合版のP/L表を作る"""
+def create_pl_book(directory: str, data_store: dict, start_dt: datetime.datetime, end_dt: datetime.datetime,
+                   aggregation: Union[Aggregation, None] = None, state: Union[BookState, None] = None, write_only=False,
+                   writer: Union[BookWriter, None] = None, totals=table.TOTALS_FORMULA):
+    """全社統合版のP/L表を作る
+    stateを渡すと、前回書き出した時から内容が変わっていなければ書き直さない
+    write_only=Trueなら、書き出し専用のワークブックで書き出す
+    writerを渡すと、ワークブックの作成と保存をwriterに任せる(集計はここで行い、その結果だけを渡す)
+    totalsで集計行と決算列の書き出し方(SUMの式、計算した値、その両方)を選ぶ
+    """
     settlement_month = data_store["config"].get("決算月", 3)  # type: int
     header_row = common.create_header_labels(start_dt, end_dt, settlement_month)
 
-    result, sales_list, expense_list = data.aggregate_all_business(data_store, header_row)
+    result, sales_list, expense_list = data.aggregate_all_business(data_store, header_row, aggregation)
+    fp = None
+    if state is not None:
+        # 経費グループの並びは実行ごとに変わりうる(setから作っている)ので、並べ替えてから比べる
+        fp = fingerprint([header_row, result, sales_list, sorted(expense_list, key=str), totals])
+        if not state.is_dirty("事業計画.xlsx", fp):
+            return
+
+    if writer is None:
+        BookWriter(state).submit("事業計画.xlsx", fp, _write_pl_book, directory, header_row, result, sales_list, expense_list, write_only, totals)
+    else:
+        writer.submit("事業計画.xlsx", fp, _write_pl_book, directory, header_row, result, sales_list, expense_list, write_only, totals)
+
 
+def _write_pl_book(directory: str, header_row: list[str], result: dict, sales_list: list, expense_list: list, write_only: bool, totals: str):
+    """全社統合版のP/L表を作って保存する"""
     # ワークブック、ワークシートの作成
-    wb = utils.create_new_workbook()
+    wb = utils.create_new_workbook(write_only)
+    cached = dict()  # key = シート名
     for typ in ["plan", "performance"]:
         wb.create_sheet(title=common.MAPPING1[typ])
         ws = wb[common.MAPPING1[typ]]
 
         # テーブルを作成する
-        create_aggregated_pl_tables(ws, result[typ], header_row, sales_list, expense_list)
+        tbl = create_aggregated_pl_tables(ws, result[typ], header_row, sales_list, expense_list)
+
+        # 集計行と決算列のSUMの式(または計算した値)を書き込む
+        cached[ws.title] = tbl.write_formulas(totals)
 
         # シート全体に渡って幅を自動調整する
         utils.auto_adjust_column_width(ws)
@@ -68,6 +191,19 @@ def create_pl_book(directory: str, data_store: dict, start_dt: datetime.datetime
 
     wb.remove(wb["Sheet"])  # 最初から存在するシートは不要なので削除する
     wb.save(os.path.join(directory, "事業計画.xlsx"))
+    if totals == table.TOTALS_BOTH:
+        inject_cached_values(os.path.join(directory, "事業計画.xlsx"), cached)
+
+
+def _business_fingerprint(data_store: dict, business: str, header_row: list[str], aggregation: Aggregation, totals: str) -> str:
+    """事業別ファイルに書き出す内容(表定義、表示期間の値と按分後の経費、集計値、ヘッダ、集計の書き出し方)のフィンガープリント"""
+    payload = [header_row, data_store["definition"][business], totals]
+    for typ in ["plan", "performance"]:
+        data = data_store[typ][business]
+        for kind in ["profit", "loss", "earnings"]:
+            payload.append([(yyyymm, data[kind].get(yyyymm)) for yyyymm in header_row])
+        payload.append([aggregation.get_fixval(typ, business), aggregation.get_category(typ, business), aggregation.get_variable_ratio(typ, business)])
+    return fingerprint(payload)
 
 
 def create_main_table(ws: any, ws_type: str, business: str, header_row: list[str], data_store: dict) -> table.SingleTable:
@@ -108,7 +244,8 @@ def create_main_table(ws: any, ws_type: str, business: str, header_row: list[str
     return tbl
 
 
-def create_fixval_table(tbl: table.SingleTable, ws_type: str, business: str, header_row: list[str], data_store: dict):
+def create_fixval_table(tbl: table.SingleTable, ws_type: str, business: str, header_row: list[str], data_store: dict,
+                        aggregation: Union[Aggregation, None] = None):
     """変動費・固定費の集計結果を表にする"""
     data_def = data_store["definition"][business]
     ws = tbl.ws
@@ -121,8 +258,10 @@ def create_fixval_table(tbl: table.SingleTable, ws_type: str, business: str, hea
                               "変動費・固定費/カテゴリ別分析",
                               {"style": styles.table_main2_style, "border": styles.border_hair_box})
 
-    fixval_result, expense_list = data.aggregate_fixval(ws_type, business, header_row, data_store)
-    category_result, expense_category_list = data.aggregate_category(ws_type, business, header_row, data_store)
+    if aggregation is None:
+        aggregation = data.aggregate(data_store, header_row)
+    fixval_result, expense_list = data.aggregate_fixval(ws_type, business, header_row, data_store, aggregation)
+    category_result, expense_category_list = data.aggregate_category(ws_type, business, header_row, data_store, aggregation)
 
     # 売上のサブテーブル
     tbl1 = tbl.add_sub_table("fixval_sales")
@@ -202,6 +341,8 @@ def _create_table_body(tbl: table.SubTable, data: Dict[str, MonthlyData], style_
     else:
         style_def_main = style_main
 
+    column_nums = list()
+    columns = list()  # type: list[Union[Dict[tuple, any], None]]  # 月ごとの{行ラベル: 値}
     for i, yyyymm in enumerate(tbl.parent.headers):
         if "決算" in yyyymm:
             # 集計列を入れる(その会計年度のデータのSUMの式を入れる）
@@ -213,9 +354,17 @@ def _create_table_body(tbl: table.SubTable, data: Dict[str, MonthlyData], style_
         else:
             # データがあればデータを入れる（data[yyyymm]がNoneならスタイルだけ設定する）
             values = data.get(yyyymm)
+            column = None
             if values is not None:
-                values = list(map(lambda x: {"value": x.value, "label": x.label.tuple()}, filter(lambda x: x.label is not None, values.rows)))
-            tbl.put_data_in_column(i, values, style_def_main)
+                column = dict()
+                for x in values.rows:
+                    if x.label is not None:
+                        column.setdefault(x.label.tuple(), x.value)  # 同じラベルがあれば最初のものを使う
+            column_nums.append(i)
+            columns.append(column)
+
+    # 月の列は、[行][月]の表にしてまとめて記入する
+    tbl.put_data_block(column_nums, tbl.to_matrix(columns), style_def_main)
 
 
 def _fill_color_for_divided_entries(data_store: dict, tables: list[table.SingleTable]):
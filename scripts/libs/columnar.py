@@ -0,0 +1,161 @@
+from typing import Union, Dict, Tuple, Iterable, Iterator
+from array import array
+
+from pldata import ProfitDataItem, LossDataItem, MonthlyData
+
+
+SCENARIOS = ["plan", "performance"]
+KINDS = ["profit", "loss", "earnings"]
+
+# セルの状態(maskの値)
+EMPTY = 0   # 行がない
+NUMBER = 1  # 数値がvaluesに入っている
+NULL = 2    # 行はあるが値がNone
+OBJECT = 3  # 数値以外の値がobjectsに入っている
+
+
+def to_value(x: Union[int, float]) -> Union[int, float]:
+    """配列から取り出した値をPythonの数値に戻す（整数値ならintにする）"""
+    if isinstance(x, float) and x.is_integer():
+        return int(x)
+    return x
+
+
+def is_number(value: any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class ColumnarTable:
+    """一つの事業の一つの種類(profit/loss/earnings)の、読み込んだ時点の値を[label_id, month_index]の密な配列で保持する
+    journalとsqliteの保存で、今のデータストアと比べて変わったセルを見つけるためだけに使う(読み出し専用)
+    年月を繰り返すと値のある月を返し、inで月があるかを調べられる
+    """
+
+    def __init__(self, kind: str, labels: Iterable[Union[ProfitDataItem, LossDataItem]] = (), months: Iterable[str] = ()):
+        self.kind = kind
+        self.labels = []      # type: list[Union[ProfitDataItem, LossDataItem]]  # index = label_id
+        self.label_ids = {}   # type: Dict[tuple, int]  # key = 行ラベルのタプル
+        self.months = []      # type: list[str]  # index = month_index
+        self.month_ids = {}   # type: Dict[str, int]
+        self.values = array("d")
+        self.mask = bytearray()
+        self.rest = {}        # type: Dict[int, any]  # key = セル位置, value = rest_value（全社共通の按分の残り）
+        self.objects = {}     # type: Dict[int, any]  # key = セル位置, value = 数値以外の値
+        for label in labels:
+            self._add_label(label)
+        for yyyymm in months:
+            self.month_ids.setdefault(yyyymm, len(self.months))
+            if len(self.month_ids) > len(self.months):
+                self.months.append(yyyymm)
+
+    @classmethod
+    def from_monthly(cls, kind: str, monthly: Dict[str, MonthlyData],
+                     labels: Iterable[Union[ProfitDataItem, LossDataItem]] = ()) -> 'ColumnarTable':
+        """MonthlyDataの辞書から作る
+        Args:
+            kind (str): profit/loss/earnings
+            monthly (Dict[str, MonthlyData]): key=yyyymm
+            labels (Iterable): 先に登録しておく行ラベル（表定義の順番にしたいときに与える）
+        """
+        target = [m for m in monthly.keys() if "決算" not in m and hasattr(monthly[m], "rows")]
+
+        # 先にラベルと月を全部集めて、配列を一度だけ確保する
+        tbl = cls(kind, labels, target)
+        for yyyymm in target:
+            for r in monthly[yyyymm].rows:
+                if r.label is not None and r.label.tuple() not in tbl.label_ids:
+                    tbl._add_label(r.label)
+        size = len(tbl.labels) * len(tbl.months)
+        tbl.values = array("d", bytes(8 * size))
+        tbl.mask = bytearray(size)
+
+        for yyyymm in target:
+            for r in monthly[yyyymm].rows:
+                if r.label is None:
+                    continue
+                tbl._put(tbl._pos(tbl.label_ids[r.label.tuple()], tbl.month_ids[yyyymm]), r.value, getattr(r, "rest_value", None))
+        return tbl
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.months)
+
+    def __contains__(self, yyyymm: any) -> bool:
+        return yyyymm in self.month_ids
+
+    def get_cell(self, label: tuple, yyyymm: str) -> Union[Tuple[any, any], None]:
+        """行ラベルと年月を指定して(値, rest_value)を得る。その行がなければNone"""
+        label_id = self.label_ids.get(tuple(label))
+        month_idx = self.month_ids.get(yyyymm)
+        if label_id is None or month_idx is None:
+            return None
+        pos = self._pos(label_id, month_idx)
+        if self.mask[pos] == EMPTY:
+            return None
+        return self._get(pos), self.rest.get(pos)
+
+    def month_labels(self, yyyymm: str) -> list[tuple]:
+        """指定した月に行がある行ラベルのタプルのリストを返す"""
+        month_idx = self.month_ids[yyyymm]
+        return [label.tuple() for label_id, label in enumerate(self.labels) if self.mask[self._pos(label_id, month_idx)] != EMPTY]
+
+    def _pos(self, label_id: int, month_idx: int) -> int:
+        return label_id * len(self.months) + month_idx
+
+    def _get(self, pos: int) -> any:
+        state = self.mask[pos]
+        if state == NUMBER:
+            return to_value(self.values[pos])
+        if state == OBJECT:
+            return self.objects[pos]
+        return None
+
+    def _put(self, pos: int, value: any, rest_value: any = None):
+        if value is None:
+            self.mask[pos] = NULL
+        elif is_number(value):
+            self.mask[pos] = NUMBER
+            self.values[pos] = value
+        else:
+            # 数値以外の値(文字列など)はそのまま保持する
+            self.mask[pos] = OBJECT
+            self.objects[pos] = value
+        if rest_value is not None:
+            self.rest[pos] = rest_value
+
+    def _add_label(self, label: Union[ProfitDataItem, LossDataItem]):
+        self.label_ids.setdefault(label.tuple(), len(self.labels))
+        if len(self.label_ids) > len(self.labels):
+            self.labels.append(label)
+
+
+def _is_label(label: Union[ProfitDataItem, LossDataItem]) -> bool:
+    """表定義の中の空のラベル(設定がないときに入れているダミー)でなければTrue"""
+    if hasattr(label, "account"):
+        return label.account is not None
+    return label.name is not None
+
+
+class ColumnarStore:
+    """計画/実績、事業、種類(profit/loss/earnings)ごとのColumnarTableをまとめた、変更を見つけるための基準の値
+    データストアとは別の写しなので、MonthlyDataの行オブジェクトの代わりに数値の配列で持って小さくしている
+    """
+
+    def __init__(self):
+        self.tables = dict()  # type: Dict[Tuple[str, str, str], ColumnarTable]  # key = (scenario, business, kind)
+
+    @classmethod
+    def from_data_store(cls, data_store: dict) -> 'ColumnarStore':
+        """データストア(MonthlyDataの入れ子の辞書)の今の値から作る"""
+        store = cls()
+        for scenario in SCENARIOS:
+            if scenario not in data_store: continue
+            for business, data in data_store[scenario].items():
+                definition = data_store.get("definition", {}).get(business, {})
+                for kind in KINDS:
+                    if kind not in data: continue
+                    labels = filter(_is_label, definition.get(kind, []))
+                    store.tables[(scenario, business, kind)] = ColumnarTable.from_monthly(kind, data[kind], labels)
+        return store
+
+    def table(self, scenario: str, business: str, kind: str) -> Union[ColumnarTable, None]:
+        return self.tables.get((scenario, business, kind))
@@ -1,4 +1,5 @@
-from typing import Tuple
+from typing import Tuple, Callable
+import os
 import datetime
 from dateutil.relativedelta import relativedelta
 
@@ -7,6 +8,20 @@ MAPPING1 = {"plan": "計画", "performance": "実績"}
 MAPPING2 = {"計画": "plan", "実績": "performance"}
 
 
+def write_atomically(path: str, write: Callable[[str], None]):
+    """write(一時ファイルのパス)で書き出してから、pathと置き換える
+    途中で失敗しても元のファイルは壊さず、書きかけの一時ファイルも残さない
+    """
+    tmp_path = path + ".tmp"
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
 def get_yyyymm(dt: datetime.datetime) -> str:
     return f"{dt.year}/{dt.month}"
 
@@ -5,76 +5,118 @@ import openpyxl
 
 from pldata import ProfitDataItem, LossDataItem, LabelManager
 from excel import utils
+from parse_cache import ParseCache
 
 
-def read_config_file(file_path: str, data_store: Union[dict, None], label_mgr: LabelManager):
+HEADER_ROWS = 5  # 売上項目、経費グループの見出しを探す範囲(先頭からの行数)。見出しは1行目にある前提
+
+
+def read_config_file(file_path: str, data_store: Union[dict, None], label_mgr: LabelManager, cache: Union[ParseCache, None] = None):
     if not os.path.exists(file_path):
         print(f"XXX {file_path}が存在しません。ディレクトリを確認してください")
         sys.exit(1)
     filename = os.path.splitext(os.path.basename(file_path))[0]
-    print(f"* reading: {filename}.xlsx")
-    workbook = openpyxl.load_workbook(file_path)
-    _parse_config(data_store, label_mgr, workbook)
+    sheets = cache.get(file_path, []) if cache is not None else None
+    if sheets is None:
+        print(f"* reading: {filename}.xlsx")
+        workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+        sheets = _read_sheets(workbook)
+        workbook.close()
+        if cache is not None:
+            cache.put(file_path, [], sheets)
+    else:
+        print(f"* reading: {filename}.xlsx (cached)")
+    _parse_config(data_store, label_mgr, sheets)
 
 
-def _parse_config(store: dict, label_mgr: LabelManager, wb: any):
+def _read_sheets(wb: any) -> list[dict]:
+    """各シートから設定の値を取り出す(キャッシュできるように値だけにする)"""
+    result = list()
     for ws_name in wb.sheetnames:
+        ws = utils.ValueGrid(wb[ws_name])  # 設定のシートは小さいので全体を読み込む
+        if ws_name == "設定":
+            result.append({"name": ws_name, "config": _read_misc_config(ws)})
+        else:
+            result.append({"name": ws_name, "items": _read_pl_items(ws, ws_name)})
+    return result
+
+
+def _parse_config(store: dict, label_mgr: LabelManager, sheets: list[dict]):
+    for sheet in sheets:
+        ws_name = sheet["name"]
         if ws_name == "設定":
             store.setdefault("config", {})
-            _read_misc_config(store["config"], wb, ws_name)
+            if sheet["config"] is None:
+                print(f"XXX {ws_name}は不正なシートです")
+                continue
+            for key, value in sheet["config"]:
+                store["config"][key] = value
         else:
             input_data = store.setdefault("definition", {}).setdefault(ws_name, {})  # ファイルを読み込むたびにdefinitionは刷新する（古い設定は消してから作り直す）
             input_data.setdefault("profit", [])
             input_data.setdefault("loss", [])
-            _read_pl_items(input_data, label_mgr, wb, ws_name)
+            if sheet["items"] is None:
+                print(f"XXX 設定.xlsxの{ws_name}は不正なシートです")
+                continue
+            _update_pl_items(input_data, label_mgr, ws_name, sheet["items"])
 
 
-def _read_misc_config(conf: dict, wb: any, ws_name: str):
-    """各種全体設定を読み込む"""
-    ws = wb[ws_name]
+def _read_misc_config(ws: any) -> Union[list[list], None]:
+    """各種全体設定を[設定項目, 値]のリストで読み込む。シートが不正ならNoneを返す"""
     # 売上に関する設定と、経費に関する設定がそれぞれ何カラム目から始まっているかを見つける
     r = utils.find_column_numbers(["設定項目"], ws)
     if "設定項目" not in r:
-        print(f"XXX {ws_name}は不正なシートです")
-        return
+        return None
     conf_col = r["設定項目"][0]       # type: int
     conf_row = r["設定項目"][1]       # type: int
 
+    result = list()
     for row in ws.iter_rows(min_row=conf_row+1):
         if conf_col > -1 and row[conf_col].value is not None:
             if row[conf_col+1].value is not None and row[conf_col+1].value != "":
-                conf[row[conf_col].value] = row[conf_col+1].value
+                result.append([row[conf_col].value, row[conf_col+1].value])
+    return result
 
 
-def _read_pl_items(input_data: dict, label_mgr: LabelManager, wb: any, business: str):
-    """売上項目と経費項目を列挙したシートを読み込む"""
-    ws = wb[business]
+def _read_pl_items(ws: any, business: str) -> Union[list[list], None]:
+    """売上項目と経費項目を列挙したシートを読み込み、["profit"または"loss", [項目の値...]]のリストにする
+    シートが不正ならNoneを返す
+    """
     # 売上に関する設定と、経費に関する設定がそれぞれ何カラム目から始まっているかを見つける
-    r = utils.find_column_numbers(["売上項目", "経費グループ"], ws)
+    r = utils.find_column_numbers(["売上項目", "経費グループ"], ws, max_row=HEADER_ROWS)
     if "売上項目" not in r or "経費グループ" not in r:
-        print(f"XXX 設定.xlsxの{business}は不正なシートです")
-        return
+        return None
 
     sales_col = r["売上項目"][0]       # type: int
     expense_col = r["経費グループ"][0]  # type: int
 
     # １行目にタイトルラベルが入っている前提で考える
     # 一行ずつ設定を読み込む(最初の行はヘッダ行なのでスキップする)
+    result = list()
     for row in ws.iter_rows(min_row=2):
         if sales_col > -1 and row[sales_col].value is not None:
+            result.append(["profit", [row[sales_col].value, row[sales_col+1].value]])
+        if expense_col > -1 and row[expense_col].value is not None:
+            result.append(["loss", [row[expense_col+i].value for i in range(6)]])
+    return result
+
+
+def _update_pl_items(input_data: dict, label_mgr: LabelManager, business: str, items: list[list]):
+    """シートから読み込んだ売上項目と経費項目を表定義に反映する"""
+    for kind, values in items:
+        if kind == "profit":
             # 売上に関する設定情報を読み込む(すでに同じ名称があれば上書きする)
-            idx = next((i for i, d in enumerate(input_data["profit"]) if d.name == row[sales_col].value), None)
-            item = ProfitDataItem(row[sales_col].value, row[sales_col+1].value)
+            idx = next((i for i, d in enumerate(input_data["profit"]) if d.name == values[0]), None)
+            item = ProfitDataItem(*values)
             if idx is None:
                 input_data["profit"].append(item)
             else:
                 input_data["profit"][idx] = item
             label_mgr.add(business, "profit", item)
-
-        if expense_col > -1 and row[expense_col].value is not None:
+        else:
             # 経費に関する設定情報を読み込む(すでに同じ名称があれば上書きする)
-            idx = next((i for i, d in enumerate(input_data["loss"]) if d.group == row[expense_col].value and d.account == row[expense_col+1].value and d.category == row[expense_col+2].value), None)
-            item = LossDataItem(row[expense_col].value, row[expense_col+1].value, row[expense_col+2].value, row[expense_col+3].value, row[expense_col+4].value, row[expense_col+5].value)
+            idx = next((i for i, d in enumerate(input_data["loss"]) if d.group == values[0] and d.account == values[1] and d.category == values[2]), None)
+            item = LossDataItem(*values)
             if idx is None:
                 input_data["loss"].append(item)
             else:
@@ -3,97 +3,156 @@ import os
 import sys
 import datetime
 import openpyxl
+from concurrent.futures import ProcessPoolExecutor
 
 from . import common
-from pldata import ProfitData, LossData, ProfitDataItem, LabelManager, MonthlyData
+from pldata import ProfitData, LossData, ProfitDataItem, LabelManager, MonthlyData, merge_monthly_data
 from excel import utils, table
+from aggregate import Aggregation
+from parse_cache import ParseCache
 
 
-def read_data_file(file_path: str, data_store: Union[dict, None], label_mgr: LabelManager) -> Tuple[datetime.datetime, datetime.datetime]:
+def read_data_file(file_path: str, data_store: Union[dict, None], label_mgr: LabelManager, cache: Union[ParseCache, None] = None) -> Tuple[datetime.datetime, datetime.datetime]:
+    return read_data_files([file_path], data_store, label_mgr, cache)
+
+
+def read_data_files(file_paths: list[str], data_store: Union[dict, None], label_mgr: LabelManager, cache: Union[ParseCache, None] = None,
+                    jobs=1) -> Tuple[datetime.datetime, datetime.datetime]:
+    """事業別ファイル、全社共通ファイルを読み込んでデータストアに入れる
+    jobs > 1なら、キャッシュにないファイルのセルの値の取り出しを複数のプロセスで同時に行う
+    データストアとLabelManagerへの反映は、ファイルの順番にこのプロセスで行うので、結果は並列に読んでも同じになる
+
+    Returns:
+        全てのファイルに含まれているデータの期間(最初の月と最後の月)
+    """
+    # 表の行数は設定ファイルの項目数で決まるので、変わっていたらキャッシュは使えない
+    targets = list()  # type: list[Tuple[str, str, list[int]]]  # (ファイルのパス, 事業名, 表の行数)
+    for file_path in file_paths:
+        business = os.path.splitext(os.path.basename(file_path))[0]
+        if business not in data_store["definition"]:
+            # 設定ファイルに定義されていないものは無視する
+            continue
+        targets.append((file_path, business, [label_mgr.count(business, "profit"), label_mgr.count(business, "loss")]))
+
+    sheets_list = [cache.get(file_path, params) if cache is not None else None for file_path, _, params in targets]
+    missing = [i for i, sheets in enumerate(sheets_list) if sheets is None]
+    if jobs > 1 and len(missing) > 1:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(missing))) as executor:
+            futures = {i: executor.submit(_read_sheets, targets[i][0], targets[i][1], *targets[i][2]) for i in missing}
+            for i in missing:
+                sheets_list[i] = futures[i].result()
+    else:
+        for i in missing:
+            sheets_list[i] = _read_sheets(targets[i][0], targets[i][1], *targets[i][2])
+
     start_dt = None
     end_dt = None
-    business = os.path.splitext(os.path.basename(file_path))[0]
-    if business not in data_store["definition"]:
-        # 設定ファイルに定義されていないものは無視する
-        return start_dt, end_dt
+    for i, ((file_path, business, params), sheets) in enumerate(zip(targets, sheets_list)):
+        if i in missing:
+            print(f" - reading: {business}.xlsx")
+            if cache is not None:
+                cache.put(file_path, params, sheets)
+        else:
+            print(f" - reading: {business}.xlsx (cached)")
+
+        for sheet in sheets:  # 計画,実績
+            ws_name = sheet["name"]
+            data_store.setdefault(common.MAPPING2[ws_name], {}).setdefault(business, {}).setdefault("profit", {})
+            data_store.setdefault(common.MAPPING2[ws_name], {}).setdefault(business, {}).setdefault("loss", {})
+            if sheet["headers"] is None:
+                print(f"XXX ファイル:{business}.xlsxの{ws_name}シートが不正です")
+                continue
+            # 期間は全てのシートを合わせたものにする
+            s, e = _parse_data(sheet, data_store, business, ws_name, label_mgr)
+            if s is not None and (start_dt is None or s < start_dt):
+                start_dt = s
+            if e is not None and (end_dt is None or e > end_dt):
+                end_dt = e
 
-    print(f" - reading: {business}.xlsx")
-    workbook = openpyxl.load_workbook(file_path)
-    for ws_name in workbook.sheetnames:  # 計画,実績
-        ws = workbook[ws_name]
+    return start_dt, end_dt
 
-        data_store.setdefault(common.MAPPING2[ws_name], {}).setdefault(business, {}).setdefault("profit", {})
-        data_store.setdefault(common.MAPPING2[ws_name], {}).setdefault(business, {}).setdefault("loss", {})
+
+def _read_sheets(file_path: str, business: str, profit_label_num: int, loss_label_num: int) -> list[dict]:
+    """エクセルファイルの各シートから、ヘッダと売上・経費の表の値を取り出す(キャッシュできるように値だけにする)"""
+    result = list()
+    # 表の位置は行ラベルの数で決まるので、その範囲の行の値だけを読み込む
+    # タイトル、ヘッダ、売上(集計行を含む)、空行、経費(集計行を含む)、空行
+    max_row = 2 + (profit_label_num + 1) + 1 + (loss_label_num + 1) + 1
+    workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    for ws_name in workbook.sheetnames:  # 計画,実績
+        ws = utils.ValueGrid(workbook[ws_name], max_row)
 
         # 一番上の表を読み込む
         pos = utils.find_column_numbers([business], ws)
         if business not in pos:
-            print(f"XXX ファイル:{business}.xlsxの{ws_name}シートが不正です")
+            result.append({"name": ws_name, "headers": None})
             continue
-        start_dt, end_dt = _parse_data(ws, data_store, business, ws_name, label_mgr)
 
-    return start_dt, end_dt
+        tbl = table.SingleTable(ws, (1, 2), 3)  # テーブルの起点(左上がA2のセル)、3セルを行ラベル用に使う
+
+        # ヘッダ行を読む
+        tbl.read_as_header()  # 1行目をヘッダとして読む
+
+        # 売上サブテーブルを読む
+        sales_tbl = tbl.add_sub_table("sales")
+        sales_tbl.setup_dummy_aggregate_row()
+        sales_tbl.read_as_row_labels(row_size=profit_label_num+1)  # 集計行を含めるため+1
+        sales = _pack_rows(sales_tbl)
+
+        tbl.add_blank_row()
+
+        # 経費サブテーブルを読む
+        expense_tbl = tbl.add_sub_table("expense")
+        expense_tbl.setup_dummy_aggregate_row()
+        expense_tbl.read_as_row_labels(row_size=loss_label_num+1)  # 集計行を含めるため+1
+        expense = _pack_rows(expense_tbl)
+        tbl.add_blank_row()
+
+        result.append({"name": ws_name, "headers": tbl.headers, "sales": sales, "expense": expense})
+    workbook.close()
+    return result
+
+
+def _pack_rows(sub_table: table.SubTable) -> dict:
+    """サブテーブルの値を、行ラベルのリストと月ごとの値のリスト(行ラベルと同じ順番)にする
+    行ラベルは全ての月で同じなので一度だけ持つ。決算列は読み込まないので含めない
+    """
+    values = dict()
+    for yyyymm, data in sub_table.get_all_data().items():
+        if "決算" in yyyymm: continue
+        values[yyyymm] = list(map(lambda x: x["value"], data))
+    return {"labels": list(map(list, sub_table.row_labels)), "values": values}
 
 
-def _parse_data(ws: any, ds: dict, business: str, ws_name: str, label_mgr: LabelManager) -> Tuple[datetime.datetime, datetime.datetime]:
-    """表を読み込む"""
+def _parse_data(sheet: dict, ds: dict, business: str, ws_name: str, label_mgr: LabelManager) -> Tuple[datetime.datetime, datetime.datetime]:
+    """シートから取り出した表の値をデータストアに入れる"""
     data_store = ds[common.MAPPING2[ws_name]][business]
-    profit_label_num = len(label_mgr.get_all(business, "profit"))
-    loss_label_num = len(label_mgr.get_all(business, "loss"))
     start_dt = None
     end_dt = None
 
-    tbl = table.SingleTable(ws, (1, 2), 3)  # テーブルの起点(左上がA2のセル)、3セルを行ラベル用に使う
-
-    # ヘッダ行を読む
-    tbl.read_as_header()  # 1行目をヘッダとして読む
-    for hdr in tbl.headers:
+    # ヘッダ行
+    for hdr in sheet["headers"]:
         if "決算" in hdr: continue
         end_dt = common.convert_from_yyyymm(hdr)
         if start_dt is None:
             start_dt = common.convert_from_yyyymm(hdr)
 
-    # 売上サブテーブルを読む
-    sales_tbl = tbl.add_sub_table("sales")
-    sales_tbl.setup_dummy_aggregate_row()
-    sales_tbl.read_as_row_labels(row_size=profit_label_num+1)  # 集計行を含めるため+1
-    data_cols = sales_tbl.get_all_data()
-    # -- 数値データを読み込む
-    for yyyymm, data in data_cols.items():
-        if "決算" in yyyymm: continue  # 決算列は無視して良い
+    # 売上サブテーブル
+    # -- 数値データを読み込む(行ラベルは全ての月で同じなので、一度だけ解決する)
+    row_labels = label_mgr.resolve_many(business, "profit", sheet["sales"]["labels"])
+    for yyyymm, values in sheet["sales"]["values"].items():
         if start_dt is None:
             start_dt = common.convert_from_yyyymm(yyyymm)
         end_dt = common.convert_from_yyyymm(yyyymm)
-        monthly_data = list()  # type: list[ProfitData]
-        for dat in data:
-            row_label = label_mgr.get(business, "profit", name=dat["label"][0])
-            monthly_data.append(ProfitData(row_label, dat["value"]))
-
-        if yyyymm not in data_store["profit"]:
-            data_store["profit"][yyyymm] = MonthlyData(yyyymm, monthly_data)
-        else:
-            data_store["profit"][yyyymm].merge(monthly_data)
-
-    tbl.add_blank_row()
+        monthly_data = list(map(ProfitData, row_labels, values))  # type: list[ProfitData]
+        merge_monthly_data(data_store["profit"], yyyymm, monthly_data)
 
-    # 経費サブテーブルを読む
-    expense_tbl = tbl.add_sub_table("expense")
-    expense_tbl.setup_dummy_aggregate_row()
-    expense_tbl.read_as_row_labels(row_size=loss_label_num+1)  # 集計行を含めるため+1
-    data_cols = expense_tbl.get_all_data()
+    # 経費サブテーブル
     # -- 数値データを読み込む
-    for yyyymm, data in data_cols.items():
-        if "決算" in yyyymm: continue  # 決算列は無視して良い
-        monthly_data = list()  # type: list[LossData]
-        for dat in data:
-            row_label = label_mgr.get(business, "loss", group=dat["label"][0], account=dat["label"][1], category=dat["label"][2])
-            monthly_data.append(LossData(row_label, dat["value"]))
-
-        if yyyymm not in data_store["loss"]:
-            data_store["loss"][yyyymm] = MonthlyData(yyyymm, monthly_data)
-        else:
-            data_store["loss"][yyyymm].merge(monthly_data)
-    tbl.add_blank_row()
+    row_labels = label_mgr.resolve_many(business, "loss", sheet["expense"]["labels"])
+    for yyyymm, values in sheet["expense"]["values"].items():
+        monthly_data = list(map(LossData, row_labels, values))  # type: list[LossData]
+        merge_monthly_data(data_store["loss"], yyyymm, monthly_data)
 
     return start_dt, end_dt
 
@@ -105,13 +164,20 @@ def update(data_store: dict):
 
 
 def _make_monthly_data(store: dict, label: Union[str, None]=None):
+    items = dict()  # 同じ行ラベルのItemは全ての月で一つのオブジェクトを使う
+
+    def item(name: str) -> ProfitDataItem:
+        if name not in items:
+            items[name] = ProfitDataItem(name)
+        return items[name]
+
     for yyyymm, data in store.items():
         if isinstance(data, list):
-            store[yyyymm] = MonthlyData(yyyymm, list(map(lambda x: ProfitData(ProfitDataItem(label), x), data)))
+            store[yyyymm] = MonthlyData(yyyymm, list(map(lambda x: ProfitData(item(label), x), data)))
         elif isinstance(data, dict):
-            store[yyyymm] = MonthlyData(yyyymm, list(map(lambda x: ProfitData(ProfitDataItem(x[0]), x[1]), data.items())))
+            store[yyyymm] = MonthlyData(yyyymm, list(map(lambda x: ProfitData(item(x[0]), x[1]), data.items())))
         else:
-            store[yyyymm] = MonthlyData(yyyymm, [ProfitData(ProfitDataItem(label), data)])
+            store[yyyymm] = MonthlyData(yyyymm, [ProfitData(item(label), data)])
 
 
 def _sum_all_rows(data: MonthlyData):
@@ -172,7 +238,12 @@ def _calculate_all_earnings(data_store: dict):
     for typ in ["plan", "performance"]:
         if typ not in data_store: continue
         for business, data in data_store[typ].items():
-            data_store[typ][business]["earnings"] = dict()
+            old = data.get("earnings")
+            if hasattr(old, "unloaded"):
+                # 読み込んでいない期間の月の利益は計算し直さないので、保存されていた値をそのまま残す
+                data_store[typ][business]["earnings"] = old.unloaded(exclude=list(data["profit"].keys()) + list(data["loss"].keys()))
+            else:
+                data_store[typ][business]["earnings"] = dict()
             for yyyymm, monthly_data in data["profit"].items():
                 if "決算" in yyyymm: continue
                 for d in monthly_data.rows:
@@ -192,38 +263,19 @@ def _calculate_all_earnings(data_store: dict):
             _make_monthly_data(data_store[typ][business]["earnings"], "利益")
 
 
-def aggregate_fixval(ws_type: str, business: str, header_row: list[str], data_store: dict):
+def aggregate(data_store: dict, header_row: list[str]) -> Aggregation:
+    """表に出す集計値をまとめて計算する(結果はaggregate_fixval/aggregate_category/aggregate_all_businessで共有できる)"""
+    return Aggregation(data_store, header_row)
+
+
+def aggregate_fixval(ws_type: str, business: str, header_row: list[str], data_store: dict, aggregation: Union[Aggregation, None] = None):
     """変動費・固定費の集計結果を表にする"""
     expense = ["固定費", "変動費"]
-    #expense_categories = list(set(map(lambda x: x.category, data_store["definition"][business]["loss"])))
-
-    # 出力データの形を作る
-    result = {"loss": {}, "variable_ratio": {}}
-    total_sales = {}
+    if aggregation is None:
+        aggregation = aggregate(data_store, header_row)
 
     # 売上は事業の売上項目ごと、経費は変動費・固定費で集約する
-    for yyyymm in header_row:
-        if "決算" in yyyymm:
-            continue
-        if yyyymm in data_store[ws_type][business]["loss"]:
-            for row in data_store[ws_type][business]["loss"][yyyymm].rows:
-                if row.value is None: continue
-                # 変動費・固定費 (あとで形式をProfitData型に変更する必要がある）
-                result["loss"].setdefault(yyyymm, {}).setdefault(row.label.fixval, 0)
-                result["loss"][yyyymm][row.label.fixval] += row.value
-
-        if yyyymm in data_store[ws_type][business]["profit"]:
-            for m in data_store[ws_type][business]["profit"][yyyymm].rows:
-                if m.value is not None:
-                    total_sales.setdefault(yyyymm, 0)
-                    total_sales[yyyymm] += m.value
-
-    # 変動費・固定費の情報の型をProfitData型に変更。変動比率の計算
-    for yyyymm, dat in result["loss"].items():
-        for label, value in result["loss"][yyyymm].items():
-            if label == "変動費" and yyyymm in total_sales and total_sales[yyyymm] > 0:
-                ratio = int(value/total_sales[yyyymm] * 10000)/10000
-                result["variable_ratio"][yyyymm] = ratio
+    result = {"loss": aggregation.get_fixval(ws_type, business), "variable_ratio": aggregation.get_variable_ratio(ws_type, business)}
 
     # 月ごとのデータはMonthlyDataオブジェクト出なければならないので変換する
     _make_monthly_data(result["loss"])  # 与えたデータ(result["loss"]の中身が(label, value)のタプルになっている場合は、第２引数を指定しない
@@ -231,23 +283,14 @@ def aggregate_fixval(ws_type: str, business: str, header_row: list[str], data_st
     return result, expense
 
 
-def aggregate_category(ws_type: str, business: str, header_row: list[str], data_store: dict):
+def aggregate_category(ws_type: str, business: str, header_row: list[str], data_store: dict, aggregation: Union[Aggregation, None] = None):
     """経費カテゴリ別の集計結果を表にする"""
     expense = list(set(map(lambda x: x.category, data_store["definition"][business]["loss"])))
-
-    # 出力データの形を作る
-    result = {"profit": {}, "loss": {}}
+    if aggregation is None:
+        aggregation = aggregate(data_store, header_row)
 
     # 売上は、変動費・固定費の表のところで計算済みなので、ここでは経費カテゴリのみ集約する
-    for yyyymm in header_row:
-        if "決算" in yyyymm:
-            continue
-        if yyyymm in data_store[ws_type][business]["loss"]:
-            for row in data_store[ws_type][business]["loss"][yyyymm].rows:
-                if row.value is None: continue
-                # 変動費・固定費 (あとで形式をProfitData型に変更する必要がある）
-                result["loss"].setdefault(yyyymm, {}).setdefault(row.label.category, 0)
-                result["loss"][yyyymm][row.label.category] += row.value
+    result = {"profit": {}, "loss": aggregation.get_category(ws_type, business)}
 
     # 月ごとのデータはMonthlyDataオブジェクト出なければならないので変換する
     _make_monthly_data(result["loss"])  # 与えたデータ(result["loss"]の中身が(label, value)のタプルになっている場合は、第２引数を指定しない
@@ -255,7 +298,7 @@ def aggregate_category(ws_type: str, business: str, header_row: list[str], data_
     return result, expense
 
 
-def aggregate_all_business(data_store: dict, header_row: list[str]):
+def aggregate_all_business(data_store: dict, header_row: list[str], aggregation: Union[Aggregation, None] = None):
     """全事業のprofit/lossを結合して一つにまとめる
     経費は経費グループごとにまとめる
     """
@@ -266,37 +309,15 @@ def aggregate_all_business(data_store: dict, header_row: list[str]):
         sales_list.extend(filter(lambda y: y is not None, map(lambda x: x.name, conf["profit"])))
         expense_group.extend(map(lambda x: x.group, conf["loss"]))
     expense_group = list(set(expense_group))
-
-    # 出力データの形を作る
-    result = dict()
+    if aggregation is None:
+        aggregation = aggregate(data_store, header_row)
 
     # 売上はそれぞれの事業の売上項目ごと、経費は経費グループで集約する
+    result = dict()
     for typ in ["plan", "performance"]:
-        result.setdefault(typ, {"profit": {}, "loss": {}, "earnings": {}})
-        if typ not in data_store: continue
-        for yyyymm in header_row:
-            if "決算" in yyyymm:
-                continue
-            for business, dat in data_store[typ].items():
-                if yyyymm in dat["profit"]:
-                    for row in dat["profit"][yyyymm].rows:
-                        if row.value is None: continue
-                        result[typ]["profit"].setdefault(yyyymm, {}).setdefault(row.label.name, 0)
-                        result[typ]["profit"][yyyymm][row.label.name] += row.value
-                        result[typ]["earnings"].setdefault(yyyymm, 0)
-                        result[typ]["earnings"][yyyymm] += row.value
-                if yyyymm in dat["loss"]:
-                    for row in dat["loss"][yyyymm].rows:
-                        if row.value is None: continue
-                        val = row.value if row.rest_value is None else row.rest_value
-                        result[typ]["loss"].setdefault(yyyymm, {}).setdefault(row.label.group, 0)
-                        result[typ]["loss"][yyyymm][row.label.group] += val
-                        result[typ]["earnings"].setdefault(yyyymm, 0)
-                        result[typ]["earnings"][yyyymm] -= val
-
+        result[typ] = {"profit": aggregation.get_profit(typ), "loss": aggregation.get_group(typ), "earnings": aggregation.get_earnings(typ)}
         _make_monthly_data(result[typ]["profit"])
         _make_monthly_data(result[typ]["loss"])
         _make_monthly_data(result[typ]["earnings"], "利益")
 
     return result, sales_list, expense_group
-
@@ -0,0 +1,307 @@
+from typing import Union, Dict, Tuple
+
+import openpyxl
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Border, NamedStyle
+from openpyxl.styles.borders import DEFAULT_BORDER  # ワークブックの既定の罫線(セルに罫線を設定していない時の値)
+from openpyxl.utils import get_column_letter
+from openpyxl.worksheet.cell_range import CellRange
+
+
+class BufferedCell:
+    """BufferedSheetのセルを読み書きするためのオブジェクト。値とスタイルIDはシートの行のリストにある
+    スタイルの扱いはopenpyxlのセルと同じで、名前付きスタイルを設定すると罫線と表示形式はそのスタイルのものに戻る
+    """
+    __slots__ = ("parent", "row", "column", "_entry")
+
+    def __init__(self, parent: 'BufferedSheet', row: int, column: int, entry: list):
+        self.parent = parent
+        self.row = row
+        self.column = column
+        self._entry = entry  # [値, スタイルID]
+
+    @property
+    def value(self) -> any:
+        return self._entry[0]
+
+    @value.setter
+    def value(self, value: any):
+        self._entry[0] = value
+
+    @property
+    def coordinate(self) -> str:
+        return f"{get_column_letter(self.column)}{self.row}"
+
+    @property
+    def column_letter(self) -> str:
+        return get_column_letter(self.column)
+
+    @property
+    def style(self) -> str:
+        named_style = self.parent.parent.styles[self._entry[1]][0]
+        return "Normal" if named_style is None else named_style.name
+
+    @style.setter
+    def style(self, style: Union[NamedStyle, str]):
+        self.set_named_style(style)
+
+    @property
+    def border(self) -> Border:
+        named_style, border, _ = self.parent.parent.styles[self._entry[1]]
+        if border is not None:
+            return border
+        return DEFAULT_BORDER if named_style is None else named_style.border
+
+    @border.setter
+    def border(self, border: Border):
+        wb = self.parent.parent
+        named_style, _, number_format = wb.styles[self._entry[1]]
+        self._entry[1] = wb.style_id(named_style, border, number_format)
+
+    @property
+    def number_format(self) -> str:
+        named_style, _, number_format = self.parent.parent.styles[self._entry[1]]
+        if number_format is not None:
+            return number_format
+        return "General" if named_style is None else named_style.number_format
+
+    @number_format.setter
+    def number_format(self, number_format: str):
+        wb = self.parent.parent
+        named_style, border, _ = wb.styles[self._entry[1]]
+        self._entry[1] = wb.style_id(named_style, border, number_format)
+
+    def set_named_style(self, style: Union[NamedStyle, str], border: Union[Border, None] = None, number_format: Union[str, None] = None):
+        """名前付きスタイルと罫線、表示形式を一度に設定する(罫線と表示形式はNoneならスタイルのもの)"""
+        wb = self.parent.parent
+        self._entry[1] = wb.style_id(wb.add_named_style(style), border, number_format)
+
+
+class BufferedMergedCell(BufferedCell):
+    """結合されたセルの左上以外のセル。openpyxlのMergedCellと同じく、値は書き込めずcolumn_letterも持たない"""
+    __slots__ = ()
+
+    @property
+    def value(self) -> any:
+        return None
+
+    @value.setter
+    def value(self, value: any):
+        raise AttributeError(f"{self.coordinate}は結合されたセルなので値を書き込めません")
+
+    @property
+    def column_letter(self) -> str:
+        raise AttributeError("column_letter")
+
+
+class ColumnDimension:
+    __slots__ = ("width",)
+
+    def __init__(self):
+        self.width = None
+
+
+class ColumnDimensions(dict):
+    """ws.column_dimensions[列名].width = ... で列の幅を設定できるようにする"""
+
+    def __missing__(self, column: str) -> ColumnDimension:
+        self[column] = ColumnDimension()
+        return self[column]
+
+
+class BufferedSheet:
+    """ワークシートの代わりに使い、セルの値とスタイル、セルの結合、固定する位置、列の幅をためておく
+    openpyxlのワークシートと同じように使え(cell, merge_cells, columns, column_dimensions, freeze_panes)、
+    保存するときに書き出し専用のシートに行ごとに書き出す
+    """
+
+    def __init__(self, parent: 'BufferedWorkbook', title: str):
+        self.parent = parent
+        self.title = title
+        self._rows = {}  # type: Dict[int, list[Union[list, None]]]  # key = row。列の順に[値, スタイルID](まだないセルはNone)
+        self._merged = set()  # type: set[Tuple[int, int]]  # 結合されたセル(左上以外)の(row, column)
+        self._max_row = 1
+        self._max_column = 1
+        self.merged_cells = []  # type: list[str]  # 結合するセルの範囲(A1:C1の形)
+        self.column_dimensions = ColumnDimensions()
+        self.freeze_panes = None  # type: Union[str, None]
+
+    def cell(self, row: int, column: int, value: any = None) -> BufferedCell:
+        entry = self._get_entry(row, column, create=True)
+        cell_class = BufferedMergedCell if (row, column) in self._merged else BufferedCell
+        cell = cell_class(self, row, column, entry)
+        if value is not None:
+            cell.value = value
+        return cell
+
+    def _get_entry(self, row: int, column: int, create: bool = False) -> Union[list, None]:
+        cells = self._rows.get(row)
+        if cells is None:
+            if not create:
+                return None
+            cells = self._rows[row] = []
+            self._max_row = max(self._max_row, row)
+        if len(cells) < column:
+            if not create:
+                return None
+            cells.extend([None] * (column - len(cells)))
+            self._max_column = max(self._max_column, column)
+        entry = cells[column-1]
+        if entry is None and create:
+            entry = cells[column-1] = [None, 0]
+        return entry
+
+    @property
+    def max_row(self) -> int:
+        return self._max_row
+
+    @property
+    def max_column(self) -> int:
+        return self._max_column
+
+    @property
+    def columns(self):
+        """A1から最後の列まで、列ごとにセルのタプルを返す(openpyxlと同じく、まだないセルは作られる)"""
+        if len(self._rows) == 0:
+            return
+        max_row = self.max_row
+        for column in range(1, self.max_column+1):
+            yield tuple(self.cell(row, column) for row in range(1, max_row+1))
+
+    def merge_cells(self, range_string: Union[str, None] = None, start_row: Union[int, None] = None, start_column: Union[int, None] = None,
+                    end_row: Union[int, None] = None, end_column: Union[int, None] = None):
+        """セルを結合する(罫線の扱いはopenpyxlのMergedCellRangeと同じ)"""
+        cr = CellRange(range_string=range_string, min_col=start_column, min_row=start_row, max_col=end_column, max_row=end_row)
+        self.merged_cells.append(cr.coord)
+        wb = self.parent
+
+        # 左上のセルに、右下のセルの右と下の罫線を引き継ぐ
+        start_cell = self.cell(cr.min_row, cr.min_col)
+        end_entry = self._get_entry(cr.max_row, cr.max_col)
+        if end_entry is not None:
+            end_border = BufferedCell(self, cr.max_row, cr.max_col, end_entry).border
+            start_cell.border = wb.intern_border(start_cell.border + Border(right=end_border.right, bottom=end_border.bottom))
+
+        # 左上以外のセルを結合されたセル(値もスタイルもない)にする
+        cells = cr.cells
+        next(cells)
+        for row, column in cells:
+            entry = self._get_entry(row, column, create=True)
+            entry[0] = None
+            entry[1] = 0
+            self._merged.add((row, column))
+
+        # 範囲の縁のセルに左上のセルの罫線を引く
+        for name in ["top", "left", "right", "bottom"]:
+            side = getattr(start_cell.border, name)
+            if side and side.style is None:
+                continue
+            border = Border(**{name: side})
+            for row, column in getattr(cr, name):
+                cell = self.cell(row, column)
+                cell.border = wb.intern_border(cell.border + border)
+
+    def write_to(self, ws: any, style_arrays: list):
+        """書き出し専用のシートに書き出す(列の幅などは最初の行を書く前に設定しておく必要がある)
+        style_arrays = スタイルIDごとの、書き出すワークブックで解決したスタイル(BufferedWorkbook.saveが作る)
+        """
+        for column, dim in self.column_dimensions.items():
+            ws.column_dimensions[column].width = dim.width
+        if self.freeze_panes is not None:
+            ws.freeze_panes = self.freeze_panes
+        for coord in self.merged_cells:
+            ws.merged_cells.add(coord)
+
+        for row in range(1, self.max_row+1):
+            ws.append([None if entry is None else entry[0] if entry[1] == 0 else _styled_cell(ws, entry[0], style_arrays[entry[1]])
+                       for entry in self._rows.get(row, ())])
+
+
+def _styled_cell(ws: any, value: any, style_array: any) -> any:
+    """解決済みのスタイルを持つ書き出し用のセルを作る(スタイルは書き出すだけなのでコピーせずに共有する)"""
+    cell = WriteOnlyCell(ws, value=value)
+    cell._style = style_array
+    return cell
+
+
+class BufferedWorkbook:
+    """openpyxlのワークブックの代わりに使い、保存するときに書き出し専用(write_only=True)のワークブックで書き出す
+    セルには値とスタイルIDだけを持たせ、スタイルIDは保存するときにワークブックで一度だけ解決する
+    """
+
+    def __init__(self):
+        self.named_styles = []  # type: list[NamedStyle]  # 使われた順
+        # スタイルIDごとの(名前付きスタイル, 罫線, 表示形式)。0はスタイルを設定していないセル
+        # オブジェクトはidで区別し、idが使い回されないようにstylesの中で参照を持っておく
+        self.styles = [(None, None, None)]  # type: list[Tuple[Union[NamedStyle, None], Union[Border, None], Union[str, None]]]
+        self._style_ids = {(id(None), id(None), None): 0}  # type: Dict[Tuple[int, int, Union[str, None]], int]
+        self._borders = {}  # type: Dict[Border, Border]  # セルの結合で作った罫線(同じ罫線は同じオブジェクトにする)
+        self._sheets = []   # type: list[BufferedSheet]
+        self.create_sheet("Sheet")  # openpyxl.Workbook()と同じく、最初からシートが一つある
+
+    def add_named_style(self, style: Union[NamedStyle, str]) -> NamedStyle:
+        for s in self.named_styles:
+            if s.name == (style if isinstance(style, str) else style.name):
+                return s
+        if isinstance(style, str):
+            raise ValueError("{0} is not a known style".format(style))
+        self.named_styles.append(style)
+        return style
+
+    def style_id(self, named_style: Union[NamedStyle, None], border: Union[Border, None], number_format: Union[str, None]) -> int:
+        key = (id(named_style), id(border), number_format)
+        style_id = self._style_ids.get(key)
+        if style_id is None:
+            style_id = self._style_ids[key] = len(self.styles)
+            self.styles.append((named_style, border, number_format))
+        return style_id
+
+    def intern_border(self, border: Border) -> Border:
+        return self._borders.setdefault(border, border)
+
+    def create_sheet(self, title: str) -> BufferedSheet:
+        ws = BufferedSheet(self, title)
+        self._sheets.append(ws)
+        return ws
+
+    @property
+    def sheetnames(self) -> list[str]:
+        return [ws.title for ws in self._sheets]
+
+    def __getitem__(self, title: str) -> BufferedSheet:
+        for ws in self._sheets:
+            if ws.title == title:
+                return ws
+        raise KeyError("Worksheet {0} does not exist.".format(title))
+
+    def __contains__(self, title: str) -> bool:
+        return title in self.sheetnames
+
+    def remove(self, ws: BufferedSheet):
+        self._sheets.remove(ws)
+
+    def save(self, filename: str):
+        wb = openpyxl.Workbook(write_only=True)
+        for style in self.named_styles:
+            wb.add_named_style(style)
+        style_arrays = None
+        for ws in self._sheets:
+            write_only_ws = wb.create_sheet(ws.title)
+            if style_arrays is None:
+                style_arrays = self._resolve_styles(write_only_ws)
+            ws.write_to(write_only_ws, style_arrays)
+        wb.save(filename)
+
+    def _resolve_styles(self, ws: any) -> list:
+        """スタイルIDごとに、書き出すワークブックでのスタイル(StyleArray)を一度だけ解決する"""
+        style_arrays = []
+        for named_style, border, number_format in self.styles:
+            cell = WriteOnlyCell(ws)
+            if named_style is not None:
+                cell.style = named_style
+            if border is not None:
+                cell.border = border
+            if number_format is not None:
+                cell.number_format = number_format
+            style_arrays.append(cell._style)
+        return style_arrays
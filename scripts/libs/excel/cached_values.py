@@ -0,0 +1,69 @@
+from typing import Dict, Tuple, Union
+import re
+import zipfile
+import posixpath
+from xml.etree import ElementTree
+
+from openpyxl.utils import get_column_letter
+
+from common import write_atomically
+
+
+NS_MAIN = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+NS_REL = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+NS_PKG_REL = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+# openpyxlが書き出す式のセル: <c r="D5" s="3"><f>SUM(D6:D8)</f><v /></c>
+FORMULA_CELL = re.compile(rb'<c r="([A-Z]+[0-9]+)"([^>]*)><f>([^<]*)</f><v\s*/></c>')
+
+
+def inject_cached_values(path: str, values: Dict[str, Dict[Tuple[int, int], Union[int, float]]]):
+    """保存したエクセルファイルの式のセルに、計算した値(キャッシュ値)を書き込む
+    openpyxlは式の値を書き出せないので、保存した後にシートのXMLの<v />を書き換える
+    (ファイルはExcelで開くと計算し直す設定のままなので、Excelでは今まで通り式で計算される)
+
+    Args:
+        path (str): エクセルファイルのパス
+        values (Dict[str, Dict[Tuple[int, int], Union[int, float]]]): key = シート名, (row, column)
+    """
+    def write(tmp_path: str):
+        with zipfile.ZipFile(path) as zin, zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_DEFLATED) as zout:
+            parts = _sheet_parts(zin)
+            for info in zin.infolist():
+                body = zin.read(info.filename)
+                sheet_values = values.get(parts.get(info.filename))
+                if sheet_values:
+                    body = _inject(body, {f"{get_column_letter(column)}{row}": value for (row, column), value in sheet_values.items()})
+                zout.writestr(info, body)
+    write_atomically(path, write)
+
+
+def _sheet_parts(z: zipfile.ZipFile) -> Dict[str, str]:
+    """シートのXMLのパス → シート名"""
+    rels = dict()
+    for rel in ElementTree.fromstring(z.read("xl/_rels/workbook.xml.rels")).iter(f"{NS_PKG_REL}Relationship"):
+        target = rel.get("Target")
+        rels[rel.get("Id")] = target.lstrip("/") if target.startswith("/") else posixpath.normpath(posixpath.join("xl", target))
+    result = dict()
+    for sheet in ElementTree.fromstring(z.read("xl/workbook.xml")).iter(f"{NS_MAIN}sheet"):
+        result[rels[sheet.get(f"{NS_REL}id")]] = sheet.get("name")
+    return result
+
+
+def _inject(body: bytes, values: Dict[str, Union[int, float]]) -> bytes:
+    """シートのXMLの式のセルに値を書き込む
+    openpyxlの書き出し方が変わって式のセルが見つからなければ、キャッシュ値のないファイルにならないようにValueErrorにする
+    """
+    injected = set()
+
+    def replace(m: re.Match) -> bytes:
+        coordinate = m.group(1).decode("ascii")
+        if coordinate not in values:
+            return m.group(0)
+        injected.add(coordinate)
+        return b'<c r="%s"%s><f>%s</f><v>%s</v></c>' % (m.group(1), m.group(2), m.group(3), repr(values[coordinate]).encode("ascii"))
+    body = FORMULA_CELL.sub(replace, body)
+    if len(injected) < len(values):
+        missing = sorted(set(values) - injected)
+        raise ValueError(f"計算した値を書き込む式のセルが見つかりません: {', '.join(missing[:10])}" + (" ..." if len(missing) > 10 else ""))
+    return body
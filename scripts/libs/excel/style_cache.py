@@ -0,0 +1,44 @@
+from typing import Union, Dict, Tuple
+from copy import copy
+
+import weakref
+from openpyxl.styles import NamedStyle, Border
+
+
+class StyleRegistry:
+    """ワークブックごとに、(名前付きスタイル, 罫線, 表示形式)の組み合わせを解決したスタイル(StyleArray)を覚えておく
+    openpyxlはセルにスタイル、罫線、表示形式を設定するたびにワークブックのスタイル一覧を検索するので、
+    同じ組み合わせは最初のセルで一度だけ解決して、二つ目からはそのコピーをセルに設定する
+    """
+
+    def __init__(self):
+        # key = (名前付きスタイル, 罫線, 表示形式)。オブジェクトはidで区別し、idが使い回されないように値の中で参照を持っておく
+        self._arrays = {}  # type: Dict[Tuple[any, int, Union[str, None]], Tuple[any, any, any]]
+
+    def apply(self, cell: any, style: Union[NamedStyle, str, None], border: Union[Border, None] = None, number_format: Union[str, None] = None):
+        """セルに名前付きスタイル、罫線、表示形式を設定する(Noneのものは設定しない)
+        名前付きスタイルを設定するとセルのスタイルは全て置き換わるので、結果はセルの元のスタイルによらない
+        名前付きスタイルがNoneの時は、スタイルを設定していないセルにだけ使うこと
+        """
+        key = (style if isinstance(style, str) else id(style), id(border), number_format)
+        entry = self._arrays.get(key)
+        if entry is not None:
+            cell._style = copy(entry[2])
+            return
+        if style is not None:
+            cell.style = style
+        if border is not None:
+            cell.border = border
+        if number_format is not None:
+            cell.number_format = number_format
+        self._arrays[key] = (style, border, copy(cell._style))
+
+
+_registries = weakref.WeakKeyDictionary()  # key = ワークブック
+
+
+def get_registry(wb: any) -> StyleRegistry:
+    registry = _registries.get(wb)
+    if registry is None:
+        registry = _registries[wb] = StyleRegistry()
+    return registry
@@ -1,7 +1,17 @@
-from typing import Tuple, Dict, Union
+from typing import Tuple, Dict, Union, Callable, Counter
+
+from openpyxl.utils import get_column_letter
 
 from . import utils
 
+counters = None  # type: Union[Counter, None]  # sum_formula/sum_valueを数える(pldata.countersと同じく--profileの時だけ)
+
+# 集計行と決算列(SUMの式)の書き出し方
+TOTALS_FORMULA = "formula"  # SUMの式だけを書く(値はExcelで開いた時に計算される)
+TOTALS_VALUES = "values"    # 計算した値だけを書く
+TOTALS_BOTH = "both"        # SUMの式と、計算した値(Excelなしで読むツール向けのキャッシュ値)を書く
+TOTALS = [TOTALS_FORMULA, TOTALS_VALUES, TOTALS_BOTH]
+
 
 def get_data(data_list: list, col_value: any):
     for d in data_list:
@@ -29,6 +39,9 @@ class SingleTable:
         self.sub_tables = {}  # type: Dict[str, SubTable]
         self.table_structure = []  # type: List[Union[str, SubTable]]
 
+        # 集計行と決算列のSUMの式(write_formulasでまとめてワークシートに書き込む)
+        self.formulas = FormulaPlan()
+
     def get_table_cell(self, row: int, column: int):
         """表全体の中の位置を指定して、そのセルを得る。左上のセルをrow=0,column=0とする"""
         return self.ws.cell(row=self.left_top_pos[1]+row, column=self.left_top_pos[0]+column)
@@ -125,10 +138,19 @@ class SingleTable:
             style_defs (Union[dict, None]): {"style": ..., "border": ..., "format": ...}
         """
         for i in range(len(self.headers)):
-            cell = self.ws.cell(row=self.left_top_pos[1]+row_num, column=self.row_label_column_num+i+1)
-            start = utils.get_cell_coordinate(self.ws, row=self.left_top_pos[1]+sum_start_row, column=self.row_label_column_num+i+1)
-            end = utils.get_cell_coordinate(self.ws, row=self.left_top_pos[1]+sum_end_row, column=self.row_label_column_num+i+1)
-            utils.set_style_and_value(cell, f"=SUM({start}:{end})", style_defs)
+            column = self.row_label_column_num+i+1
+            self.formulas.add_sum(self.left_top_pos[1]+row_num, column, (self.left_top_pos[1]+sum_start_row, column),
+                                  (self.left_top_pos[1]+sum_end_row, column), style_defs)
+
+    def write_formulas(self, totals=TOTALS_FORMULA) -> Dict[Tuple[int, int], Union[int, float]]:
+        """put_row_sum、put_column_sumで置いたSUMの式をワークシートに書き込む(表の値を全て入れた後に一度だけ呼ぶ)
+
+        Args:
+            totals (str): TOTALS_FORMULA、TOTALS_VALUES、TOTALS_BOTHのどれか
+        Returns:
+            TOTALS_BOTHの時は、式のセルの計算した値(保存した後にinject_cached_valuesで書き込む)。それ以外は空
+        """
+        return self.formulas.write(self.ws, totals)
 
     def put_data_in_row(self, row_num: int, data: dict, style_defs: Union[dict, None]):
         """指定した行に指定した行にデータを記入する
@@ -177,6 +199,75 @@ class SingleTable:
             col += 1
 
 
+class FormulaPlan:
+    """表に入れるSUMの式の配置。セルごとに式を一つだけ持ち(同じセルに置き直したら後のものにする)、最後にまとめて書き込む
+    ワークシートには触らないので、どのセルにどの式が入るかを書き込む前に調べられる
+    """
+
+    def __init__(self):
+        self.cells = {}  # type: Dict[Tuple[int, int], Tuple[str, Union[dict, None]]]  # key = (row, column), value = (式, スタイル)
+        self._ranges = {}  # type: Dict[Tuple[int, int], Tuple[Tuple[int, int], Tuple[int, int]]]  # key = (row, column), value = SUMの範囲
+
+    def add_sum(self, row: int, column: int, start: Tuple[int, int], end: Tuple[int, int], style_defs: Union[dict, None]):
+        """(row, column)のセルに、start=(row, column)からend=(row, column)までのSUMの式を置く"""
+        formula = f"=SUM({get_column_letter(start[1])}{start[0]}:{get_column_letter(end[1])}{end[0]})"
+        self.cells[(row, column)] = (formula, style_defs)
+        self._ranges[(row, column)] = (start, end)
+
+    def formula_at(self, row: int, column: int) -> Union[str, None]:
+        entry = self.cells.get((row, column))
+        return None if entry is None else entry[0]
+
+    def __len__(self) -> int:
+        return len(self.cells)
+
+    def evaluate(self, values: Callable[[int, int], any]) -> Dict[Tuple[int, int], Union[int, float]]:
+        """全ての式の値を計算する。範囲内の数値だけを足す(文字列や空のセルは無視する、ExcelのSUMと同じ)
+        範囲内に他の式のセルがあれば、先にその式を計算する。式のセルの値は読まないので、まだ書き込まれていなくてよい
+
+        Args:
+            values (Callable[[int, int], any]): values(row, column)で式でないセルの値を返す関数
+        """
+        result = dict()
+        for key in self.cells:
+            self._evaluate(values, key, result, set())
+        return result
+
+    def _evaluate(self, values: Callable[[int, int], any], key: Tuple[int, int], result: dict, visiting: set) -> Union[int, float]:
+        if key in result:
+            return result[key]
+        if key in visiting:
+            raise ValueError(f"循環している式があります: {self.cells[key][0]}")
+        visiting.add(key)
+        (start_row, start_column), (end_row, end_column) = self._ranges[key]
+        total = 0
+        for row in range(min(start_row, end_row), max(start_row, end_row)+1):
+            for column in range(min(start_column, end_column), max(start_column, end_column)+1):
+                if (row, column) in self.cells:
+                    total += self._evaluate(values, (row, column), result, visiting)
+                    continue
+                value = values(row, column)
+                if (isinstance(value, int) or isinstance(value, float)) and not isinstance(value, bool):
+                    total += value
+        visiting.discard(key)
+        result[key] = total
+        return total
+
+    def write(self, ws: any, totals=TOTALS_FORMULA) -> Dict[Tuple[int, int], Union[int, float]]:
+        """全ての式を一度ずつ書き込む(書き込んだ式は消す)
+        TOTALS_VALUESなら式の代わりに計算した値を書き込み、TOTALS_BOTHなら計算した値を返す
+        """
+        values = self.evaluate(lambda row, column: ws.cell(row=row, column=column).value) if totals != TOTALS_FORMULA else {}
+        if counters is not None:
+            counters["sum_value" if totals == TOTALS_VALUES else "sum_formula"] += len(self.cells)
+        for (row, column), (formula, style_defs) in self.cells.items():
+            value = values[(row, column)] if totals == TOTALS_VALUES else formula
+            utils.set_style_and_value(ws.cell(row=row, column=column), value, style_defs)
+        self.cells = {}
+        self._ranges = {}
+        return values if totals == TOTALS_BOTH else {}
+
+
 class SubTable:
     """SingleTable内に置くサブテーブルのインスタンス"""
     def __init__(self, worksheet: any, parent: SingleTable, start_row: int, left_pos: int):
@@ -187,6 +278,7 @@ class SubTable:
         self.row_size = 0
 
         self.row_labels = []  # type: list[list]
+        self.row_index = {}   # type: Dict[any, list[int]]  # key = 行ラベル, value = その行ラベルの行番号(0始まり)
         self.row_labels_style = None
         self.merge_row_label_cells = False
 
@@ -198,6 +290,7 @@ class SubTable:
 
     def set_row_labels(self, labels: list[list], style: Union[Dict[str, any], None] = None, merge=False):
         self.row_labels = labels
+        self.row_index = _make_row_index(labels)
         self.row_size = len(labels)
         if self.label_aggregate_row is not None:
             self.row_size += 1
@@ -299,27 +392,53 @@ class SubTable:
             data_list (Union[list, None]): [{"label": (列ラベルのカラムの文字列,,,), "value": 数値}, {...},,,]
             style_defs (Union[dict, None]): {"style": ..., "border": ..., "format": ...}
         """
+        column = None
+        if data_list is not None:
+            column = dict()
+            for d in data_list:
+                column.setdefault(d["label"], d["value"])  # 同じラベルがあれば最初のものを使う
+        self.put_data_block([column_num], self.to_matrix([column]), style_defs)
+
+    def to_matrix(self, columns: list[Union[Dict[any, any], None]]) -> list[list]:
+        """列ごとの{行ラベル: 値}の辞書のリストを、[行][列]の値の表にする
+        行ラベルに対応する値がない(または列の辞書がNone)の所はNoneにする
+        """
+        matrix = [[None] * len(columns) for _ in range(len(self.row_labels))]
+        for k, column in enumerate(columns):
+            if column is None: continue
+            for label, value in column.items():
+                for i in self.row_index.get(label, ()):
+                    matrix[i][k] = value
+        return matrix
+
+    def put_data_block(self, column_nums: list[int], matrix: list[list], style_defs: Union[dict, None]):
+        """[行][列]の値の表をまとめて記入する
+        Args:
+            column_nums (list[int]): 表の各列を記入する列(ボディ部最初の列を0とした時に、何番目の列か)
+            matrix (list[list]): 行ラベルの順に並べた、各行のcolumn_numsの列の値
+            style_defs (Union[dict, None]): {"style": ..., "border": ..., "format": ...}
+        """
+        if len(column_nums) == 0:
+            return
         row_offset, agg_row = self.get_offset()
         if agg_row > -1:
             # 合計行があるときは、そこをセットする
             self.put_row_sum(agg_row, 1, len(self.row_labels), self.style_aggregate_row)
 
-        for i in range(len(self.row_labels)):
-            cell = self.ws.cell(row=self.start_row+row_offset+i, column=self.parent.row_label_column_num+column_num+1)  # +1はヘッダ行の分
-            if data_list is not None:
-                value = get_data(data_list, self.row_labels[i])
+        for i, values in enumerate(matrix):
+            row = self.start_row+row_offset+i
+            for column_num, value in zip(column_nums, values):
+                cell = self.ws.cell(row=row, column=self.parent.row_label_column_num+column_num+1)  # +1はヘッダ行の分
                 utils.set_style_and_value(cell, value, style_defs)
-            else:
-                utils.set_style_and_value(cell, None, style_defs)
 
     def put_column_sum(self, column_num: int, sum_start_column: int, sum_end_column: int, style_defs: Union[dict, None]):
         """指定した列に指定した列(sum_start_column)から列(sum_end_column)までのSUM式を記入する"""
         row_offset, agg_row = self.get_offset()
         for i in range(len(self.row_labels)):
-            cell = self.ws.cell(row=self.start_row+row_offset+i, column=self.parent.row_label_column_num+column_num+1)  # +1はヘッダ行の分
-            start = utils.get_cell_coordinate(self.ws, row=self.start_row+row_offset+i, column=self.parent.row_label_column_num+sum_start_column+1)
-            end = utils.get_cell_coordinate(self.ws, row=self.start_row+row_offset+i, column=self.parent.row_label_column_num+sum_end_column+1)
-            utils.set_style_and_value(cell, f"=SUM({start}:{end})", style_defs)
+            row = self.start_row+row_offset+i
+            self.parent.formulas.add_sum(row, self.parent.row_label_column_num+column_num+1,  # +1はヘッダ行の分
+                                         (row, self.parent.row_label_column_num+sum_start_column+1),
+                                         (row, self.parent.row_label_column_num+sum_end_column+1), style_defs)
 
     def put_data_in_row(self, row_num: int, data_list: list, style_defs: Union[dict, None]):
         """指定した行にデータ列を記入する"""
@@ -364,6 +483,7 @@ class SubTable:
                 cell = self.ws.cell(row=self.start_row+i+row_offset, column=k+1)
                 result.append(cell.value)
             self.row_labels.append(result)
+        self.row_index = _make_row_index(self.row_labels)
 
     def get_all_data(self):
         """サブテーブルのボディ部のデータを読み込む"""
@@ -375,3 +495,14 @@ class SubTable:
                 cell = self.ws.cell(row=self.start_row+i+row_offset, column=k+self.parent.row_label_column_num+self.left_pos)
                 result[yyyymm].append({"label": labels, "value": cell.value})
         return result
+
+
+def _make_row_index(labels: list) -> Dict[any, list[int]]:
+    """行ラベルから行番号(0始まり)を引く辞書を作る。同じラベルの行が複数あれば、その全ての行に同じ値を入れる"""
+    index = dict()
+    for i, label in enumerate(labels):
+        try:
+            index.setdefault(label, []).append(i)
+        except TypeError:
+            continue  # リストなどハッシュできないラベルの行は、データのラベル(タプル)と一致しないので値を入れない
+    return index
@@ -1,15 +1,22 @@
-from typing import Tuple, Dict, Union
+from typing import Tuple, Dict, Union, Counter
 
 import openpyxl
+import weakref
+import functools
 import unicodedata
 from openpyxl.styles import NamedStyle
+from openpyxl.utils import get_column_letter
 
-from . import styles
+from . import styles, buffered, style_cache
 
+counters = None  # type: Union[Counter, None]  # cell_writeを数える(pldata.countersと同じく--profileの時だけ)
 
-def create_new_workbook() -> any:
-    """新しいExcelワークブックを作成してスタイルを適用する"""
-    wb = openpyxl.Workbook()
+
+def create_new_workbook(write_only=False) -> any:
+    """新しいExcelワークブックを作成してスタイルを適用する
+    write_only=Trueなら、シートの内容をためておいて保存する時に書き出し専用のワークブックで書き出すBufferedWorkbookを作る
+    """
+    wb = buffered.BufferedWorkbook() if write_only else openpyxl.Workbook()
     wb.add_named_style(styles.header_date_style)
     wb.add_named_style(styles.column_label_style)
     return wb
@@ -18,10 +25,22 @@ def create_new_workbook() -> any:
 def set_style_and_value(cell: any, value: any, style: Union[Dict[str, any], None] = None):
     set_style(cell, style)
     cell.value = value
+    _get_width_tracker(cell.parent).put(cell.row, cell.column, value)
+    if counters is not None:
+        counters["cell_write"] += 1
 
 
 def set_style(cell: any, style: Union[Dict[str, any], None] = None):
-    if style is not None:
+    """style = {"style": 名前付きスタイル, "border": 罫線, "format": 表示形式}(どれも省略できる)
+    名前付きスタイルがあれば、ワークブックごとに解決済みの組み合わせを使い回して一度に設定する
+    """
+    if style is None:
+        return
+    if "style" in style and hasattr(cell, "_style"):
+        style_cache.get_registry(cell.parent.parent).apply(cell, style["style"], style.get("border"), style.get("format"))
+    elif "style" in style and hasattr(cell, "set_named_style"):
+        cell.set_named_style(style["style"], style.get("border"), style.get("format"))
+    else:
         if "style" in style:
             cell.style = style["style"]
         if "border" in style:
@@ -34,6 +53,9 @@ def merge_cells(ws: any, start_pos: Tuple[int, int], end_pos: Tuple[int, int]):
     """start_pos=(x1, y1), end_pos=(x2, y2)の範囲のセルを結合する"""
     ws.merge_cells(start_row=start_pos[1], start_column=start_pos[0],
                    end_row=end_pos[1], end_column=end_pos[0])
+    tracker = _width_trackers.get(ws)
+    if tracker is not None:
+        tracker.merged(start_pos, end_pos)
 
 
 def get_cell_coordinate(ws: any, row: int, column: int):
@@ -42,7 +64,16 @@ def get_cell_coordinate(ws: any, row: int, column: int):
 
 
 def auto_adjust_column_width(ws: any):
-    """シート内の全ての列の幅を自動調整する"""
+    """シート内の全ての列の幅を自動調整する
+    set_style_and_valueで値を書き込んだシートは、書き込んだ時に覚えておいた値の幅を使う(シートのセルを読み直さない)
+    """
+    tracker = _width_trackers.get(ws)
+    if tracker is not None:
+        widths = tracker.column_widths()
+        for column in range(1, ws.max_column+1):
+            ws.column_dimensions[get_column_letter(column)].width = (widths.get(column, 0) + 2) * 1.3
+        return
+
     target_row = 0
     for col in ws.columns:
         max_length = 0
@@ -52,11 +83,7 @@ def auto_adjust_column_width(ws: any):
 
         for cell in col:
             if cell.value is None: continue
-            if isinstance(cell.value, int) or isinstance(cell.value, float):
-                val = int(cell.value*100)/100   # 有効数字小数第2位まで
-                l = _count_str_length(str(val))
-            else:
-                l = _count_str_length(cell.value)
+            l = _display_width(cell.value)
             if l > max_length:
                 max_length = l
 
@@ -65,12 +92,59 @@ def auto_adjust_column_width(ws: any):
 
 
 def set_styles_to_column(ws: any, column: int, start_row: int, end_row: int, style: NamedStyle, border=None):
+    style_def = {"style": style, "format": styles.number_format}
+    if border is not None:
+        style_def["border"] = border
     for i in range(start_row, end_row):
-        cell = ws.cell(row=i, column=column)
-        cell.style = style
-        cell.number_format = styles.number_format
-        if border is not None:
-            cell.border = border
+        set_style(ws.cell(row=i, column=column), style_def)
+
+
+class ColumnWidthTracker:
+    """シートに書き込んだ値の表示幅をセルごとに覚えておき、列ごとの最大の幅を返す
+    同じセルに書き直したり、セルが結合されて値が消えたりしても、シートのセルの最終的な値と合うようにする
+    """
+
+    def __init__(self):
+        self.widths = {}  # type: Dict[Tuple[int, int], int]  # key = (row, column)
+
+    def put(self, row: int, column: int, value: any):
+        if value is None:
+            self.widths.pop((row, column), None)
+        else:
+            self.widths[(row, column)] = _display_width(value)
+
+    def merged(self, start_pos: Tuple[int, int], end_pos: Tuple[int, int]):
+        """start_pos=(x1, y1), end_pos=(x2, y2)の範囲が結合された（左上以外のセルの値は消える）"""
+        for row in range(start_pos[1], end_pos[1]+1):
+            for column in range(start_pos[0], end_pos[0]+1):
+                if (row, column) != (start_pos[1], start_pos[0]):
+                    self.widths.pop((row, column), None)
+
+    def column_widths(self) -> Dict[int, int]:
+        result = dict()  # key = 列番号
+        for (_, column), width in self.widths.items():
+            if width > result.get(column, 0):
+                result[column] = width
+        return result
+
+
+_width_trackers = weakref.WeakKeyDictionary()  # key = ワークシート
+
+
+def _get_width_tracker(ws: any) -> ColumnWidthTracker:
+    tracker = _width_trackers.get(ws)
+    if tracker is None:
+        tracker = _width_trackers[ws] = ColumnWidthTracker()
+    return tracker
+
+
+@functools.lru_cache(maxsize=65536)
+def _display_width(value: any) -> int:
+    """セルの値を表示した時の幅(全角文字は2)。同じラベルや数値が何度も出てくるので結果を覚えておく"""
+    if isinstance(value, int) or isinstance(value, float):
+        val = int(value*100)/100   # 有効数字小数第2位まで
+        return _count_str_length(str(val))
+    return _count_str_length(value)
 
 
 def _count_str_length(text):
@@ -93,15 +167,71 @@ def _count_str_length(text):
     return text_counter
 
 
-def find_column_numbers(labels: list, ws: any):
-    """与えられたラベルが何行目、何列目にあるか（A1から調べて最初に見つかる場所）を見つける"""
-    result = dict()
-    for i, col in enumerate(ws.columns):
-        for k, cell in enumerate(col):
-            for label in labels:
-                if cell.value == label and label not in result:
-                    result[label] = (i, k)  # 列, 行
-            if len(result.keys()) == len(labels):
+def find_column_numbers(labels: list, ws: any, max_row: Union[int, None] = None, max_col: Union[int, None] = None) -> Dict[any, Tuple[int, int]]:
+    """与えられたラベルが何行目、何列目にあるか（A1から行ごとに調べて最初に見つかる場所）を見つける
+    全てのラベルが見つかったら、そこで調べるのをやめる。読み込み専用のワークシートやValueGridでも使える
+    結果はワークシートごとに覚えておくので、同じシートで同じラベルをもう一度探すときはシートを読まない
+
+    Args:
+        labels (list): 探すラベル
+        ws (any): ワークシート
+        max_row (Union[int, None]): 指定すると、先頭からこの行数の範囲だけを調べる
+        max_col (Union[int, None]): 指定すると、左からこの列数の範囲だけを調べる
+    Returns:
+        Dict[any, Tuple[int, int]]: key = ラベル、value = (列, 行)(どちらも0始まり)。見つからなかったラベルは入らない
+    """
+    try:
+        cache = _anchor_cache.setdefault(ws, {})
+    except TypeError:
+        cache = {}  # 弱参照にできないもの
+    key = (tuple(labels), max_row, max_col)
+    if key not in cache:
+        result = dict()
+        targets = set(labels)
+        for k, row in enumerate(ws.iter_rows(max_row=max_row, max_col=max_col, values_only=True)):
+            for i, value in enumerate(row):
+                if value in targets and value not in result:
+                    result[value] = (i, k)  # 列, 行
+            if len(result) == len(targets):
                 break
-    return result
+        cache[key] = result
+    return dict(cache[key])
+
+
+_anchor_cache = weakref.WeakKeyDictionary()  # key = ワークシート, value = {(ラベル, max_row, max_col): 結果}
+
+
+class GridCell:
+    """ValueGridのセル(値だけを持つ)"""
+    __slots__ = ("value",)
+
+    def __init__(self, value: any):
+        self.value = value
+
+
+EMPTY_CELL = GridCell(None)
+
+
+class ValueGrid:
+    """読み込み専用(read_only=True)で開いたワークシートから、先頭のmax_row行の値だけを一度に読み込んだもの
+    ws.cell(row, column).value、ws.iter_rows()と同じように値を取り出せるので、
+    ワークシートの代わりにSingleTable/SubTableの読み込みやfind_column_numbersに渡せる
+    """
+
+    def __init__(self, ws: any, max_row: Union[int, None] = None):
+        """
+        Args:
+            ws (any): 読み込み専用で開いたワークシート
+            max_row (Union[int, None]): 読み込む行数。Noneならシート全体
+        """
+        self.rows = list(ws.iter_rows(max_row=max_row, values_only=True))  # type: list[tuple]
+
+    def cell(self, row: int, column: int) -> GridCell:
+        if row < 1 or row > len(self.rows) or column < 1 or column > len(self.rows[row-1]):
+            return EMPTY_CELL
+        return GridCell(self.rows[row-1][column-1])
 
+    def iter_rows(self, min_row=1, max_row: Union[int, None] = None, max_col: Union[int, None] = None, values_only=False):
+        for row in self.rows[min_row-1:max_row]:
+            row = row[:max_col]
+            yield row if values_only else tuple(map(GridCell, row))
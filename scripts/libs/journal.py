@@ -0,0 +1,185 @@
+from typing import Union, Tuple
+import os
+import json
+import datetime
+
+from pldata import LabelManager, convert_proc
+from columnar import ColumnarStore, SCENARIOS, KINDS
+from storage import JsonStorage, PeriodFunc, decode_data_store, write_json_atomically, as_v1
+
+
+JOURNAL_FILE = "store.journal"
+COMPACT_RECORDS = 30  # ジャーナルの記録がこの回数分たまったらスナップショット(store.json)にまとめる
+
+
+class JournalStorage(JsonStorage):
+    """store.jsonをスナップショットとして、実行ごとの変更分だけをジャーナル(store.journal)に追記する
+
+    ジャーナルは1行が1回の実行分のJSONで、次の形をしている
+        {"time": "...", "config": {...}, "definition": {...}, "changes": [[操作, scenario, business, kind, yyyymm, ...], ...]}
+    config, definitionは変更があった時だけ記録する。changesの操作は次の通り
+        ["set", scenario, business, kind, yyyymm, label, value, rest_value]  セルの値の設定(行がなければ追加)
+        ["del", scenario, business, kind, yyyymm, label]                     行の削除
+        ["month", scenario, business, kind, yyyymm]                          月の追加(行がない月のため)
+        ["drop", scenario, business, kind, yyyymm]                           月の削除
+    """
+
+    def __init__(self, directory: str, compact=False, until: Union[datetime.datetime, None] = None):
+        """
+        Args:
+            directory (str): store.jsonを置くディレクトリ
+            compact (bool): Trueなら保存する時に必ずスナップショットにまとめる
+            until (Union[datetime.datetime, None]): 指定すると、その時刻までのジャーナルだけを適用して読み込む
+        """
+        super().__init__(directory)
+        self.journal_path = os.path.join(directory, JOURNAL_FILE)
+        self.compact = compact
+        self.until = until
+        self.record_num = 0
+        self.baseline = None  # type: Union[ColumnarStore, None]  # 読み込んだ時点の値
+        self.baseline_meta = {}  # 読み込んだ時点のconfigとdefinition(JSON文字列)
+
+    def load(self, period: PeriodFunc = None) -> Tuple[dict, LabelManager]:
+        raw = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                raw = json.load(f)
+        records = self.read_records()
+        if len(records) > 0:
+            raw = as_v1(raw)  # ジャーナルは行ラベル付きの行のリストに適用する
+        for record in records:
+            if self.until is not None and datetime.datetime.fromisoformat(record["time"]) > self.until:
+                break
+            replay(raw, record)
+            self.record_num += 1
+
+        if "definition" not in raw:
+            data_store, mgr = {}, LabelManager()
+        else:
+            data_store, mgr = decode_data_store(raw, period)
+        self.baseline = ColumnarStore.from_data_store(data_store)
+        self.baseline_meta = _dump_meta(data_store)
+        return data_store, mgr
+
+    def save(self, data_store: dict):
+        if self.compact or not os.path.exists(self.path) or self.record_num + 1 >= COMPACT_RECORDS:
+            self.compact_into_snapshot(data_store)
+            return
+
+        record = {"time": datetime.datetime.now().isoformat(timespec="seconds")}
+        meta = _dump_meta(data_store)
+        for key in ["config", "definition"]:
+            if meta[key] != self.baseline_meta.get(key):
+                record[key] = json.loads(meta[key])
+        record["changes"] = diff(self.baseline, data_store)
+        if len(record) == 2 and len(record["changes"]) == 0:
+            return  # 変更なし
+
+        with open(self.journal_path, "a") as f:
+            f.write(json.dumps(record, default=convert_proc) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.record_num += 1
+
+        # ジャーナルがスナップショットより大きくなったら、読み込みの方が遅くなるのでまとめる
+        if os.path.getsize(self.journal_path) > os.path.getsize(self.path):
+            self.compact_into_snapshot(data_store)
+
+    def compact_into_snapshot(self, data_store: dict):
+        """データストア全体をstore.jsonに書き出して、ジャーナルを空にする"""
+        write_json_atomically(self.path, data_store)
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        self.record_num = 0
+
+    def read_records(self) -> list[dict]:
+        if not os.path.exists(self.journal_path):
+            return []
+        records = list()
+        with open(self.journal_path) as f:
+            for line in f:
+                if line.strip() == "":
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # 書き込み途中で止まった最後の行は捨てる
+                    print(f"XXX {self.journal_path}の壊れた記録を無視します")
+                    break
+        return records
+
+
+def _dump_meta(data_store: dict) -> dict:
+    return {key: json.dumps(data_store.get(key, {}), default=convert_proc, sort_keys=True) for key in ["config", "definition"]}
+
+
+def diff(baseline: ColumnarStore, data_store: dict) -> list[list]:
+    """読み込んだ時点の値(baseline)と今のデータストアを比べて、変更の操作のリストを作る"""
+    changes = list()
+    for scenario in SCENARIOS:
+        for business, data in data_store.get(scenario, {}).items():
+            for kind in KINDS:
+                monthly = data.get(kind, {})
+                base = baseline.table(scenario, business, kind)
+                for yyyymm, monthly_data in monthly.items():
+                    if not hasattr(monthly_data, "rows"):
+                        continue
+                    key = [scenario, business, kind, yyyymm]
+                    if base is None or yyyymm not in base:
+                        changes.append(["month"] + key)
+                    current = set()
+                    for r in monthly_data.rows:
+                        if r.label is None:
+                            continue
+                        label = r.label.tuple()
+                        current.add(label)
+                        rest_value = getattr(r, "rest_value", None)
+                        cell = base.get_cell(label, yyyymm) if base is not None else None
+                        if cell is None or cell[0] != r.value or cell[1] != rest_value:
+                            changes.append(["set"] + key + [list(label), r.value, rest_value])
+                    if base is not None and yyyymm in base:
+                        for label in base.month_labels(yyyymm):
+                            if label not in current:
+                                changes.append(["del"] + key + [list(label)])
+                if base is not None:
+                    for yyyymm in base:
+                        if yyyymm not in monthly:
+                            changes.append(["drop", scenario, business, kind, yyyymm])
+    return changes
+
+
+def replay(raw: dict, record: dict):
+    """ジャーナルの1回分の記録を、JSONから読み込んだままのデータストアに適用する"""
+    for key in ["config", "definition"]:
+        if key in record:
+            raw[key] = record[key]
+
+    indexes = dict()  # 月ごとの行ラベル→行の位置
+    for change in record.get("changes", []):
+        op, scenario, business, kind, yyyymm = change[:5]
+        monthly = raw.setdefault(scenario, {}).setdefault(business, {}).setdefault(kind, {})
+        if op == "drop":
+            monthly.pop(yyyymm, None)
+            indexes.pop((scenario, business, kind, yyyymm), None)
+            continue
+        rows = monthly.setdefault(yyyymm, [])
+        if op == "month":
+            continue
+
+        key = (scenario, business, kind, yyyymm)
+        if key not in indexes:
+            indexes[key] = {tuple(r["label"]): i for i, r in reversed(list(enumerate(rows)))}
+        index = indexes[key]
+        label = tuple(change[5])
+        if op == "set":
+            row = {"label": list(label), "value": change[6]}
+            if kind == "loss":
+                row["rest_value"] = change[7]
+            if label in index:
+                rows[index[label]] = row
+            else:
+                index[label] = len(rows)
+                rows.append(row)
+        elif op == "del" and label in index:
+            del rows[index[label]]
+            indexes.pop(key)
@@ -0,0 +1,97 @@
+from typing import Union
+import os
+import json
+import hashlib
+
+from common import write_atomically
+
+
+CACHE_FILE = "parse_cache.json"
+CACHE_VERSION = 3  # 読み込み方や結果の形を変えたら上げる(前回の結果を全て無効にする)
+
+
+class ParseCache:
+    """入力のエクセルファイルを読み込んだ結果(表の行ラベルと月ごとの値)を保存しておく
+    ファイル名、サイズ、更新日時、内容のハッシュ値が前回と同じなら、ファイルを開かずに前回の結果を使う
+    (サイズと更新日時が変わっていても、内容のハッシュ値が同じなら前回の結果を使う)
+    """
+
+    def __init__(self, directory: str, force=False):
+        """
+        Args:
+            directory (str): キャッシュファイルを置くディレクトリ
+            force (bool): Trueなら保存されている結果を使わずに、全てのファイルを読み込み直す
+        """
+        self.path = os.path.join(directory, CACHE_FILE)
+        self.force = force
+        self.entries = {}  # key = ファイル名
+        self.changed = False
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                cache = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            print(f"XXX {self.path}が読み込めないので無視します")
+            return
+        if cache.get("version") == CACHE_VERSION:
+            self.entries = cache.get("entries", {})
+
+    def get(self, file_path: str, params: list) -> Union[any, None]:
+        """前回の読み込み結果を返す。ファイルが変わっていたり、読み込み方(params)が違えばNoneを返す
+
+        Args:
+            file_path (str): エクセルファイルのパス
+            params (list): 読み込み結果に影響する設定(表の行数など)
+        """
+        if self.force:
+            return None
+        entry = self.entries.get(os.path.basename(file_path))
+        if entry is None or entry["params"] != params:
+            return None
+        st = os.stat(file_path)
+        if entry["size"] == st.st_size and entry["mtime"] == st.st_mtime_ns:
+            return entry["data"]
+        if entry["digest"] != file_digest(file_path):
+            return None
+        # 更新日時だけが変わっていた
+        entry["size"], entry["mtime"] = st.st_size, st.st_mtime_ns
+        self.changed = True
+        return entry["data"]
+
+    def put(self, file_path: str, params: list, data: any):
+        """読み込み結果を保存する。JSONにできない値(日付など)が含まれていたら、save()で保存しない"""
+        st = os.stat(file_path)
+        self.entries[os.path.basename(file_path)] = {"size": st.st_size, "mtime": st.st_mtime_ns, "digest": file_digest(file_path), "params": params, "data": data}
+        self.changed = True
+
+    def save(self):
+        if not self.changed:
+            return
+        try:
+            write_atomically(self.path, self._write)
+        except (TypeError, ValueError):
+            # JSONにできない値のある結果を除いて書き直す(そのファイルは次回も読み込み直す)
+            self.entries = {key: entry for key, entry in self.entries.items() if _serializable(entry)}
+            write_atomically(self.path, self._write)
+        self.changed = False
+
+    def _write(self, path: str):
+        with open(path, "w") as f:
+            json.dump({"version": CACHE_VERSION, "entries": self.entries}, f, ensure_ascii=False)
+
+
+def _serializable(entry: dict) -> bool:
+    try:
+        json.dumps(entry)
+    except (TypeError, ValueError):
+        return False
+    return True
+
+
+def file_digest(file_path: str) -> str:
+    h = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
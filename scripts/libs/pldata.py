@@ -1,9 +1,21 @@
-from typing import Union
+from typing import Union, Dict, Tuple, Iterable, Sequence, Callable, Counter
+import sys
+
+counters = None  # type: Union[Counter, None]  # よく通る処理の回数。--profileの時だけprofiler.enable_counting()がCounterを入れる
+
+# 行ラベルと行は月の数×事業の数だけ作られるので、__slots__にしてインスタンスごとの__dict__を持たせない
+# 行ラベルのItemはLabelManagerで(事業, 種類, ラベル)ごとに一つにまとめ、ラベルの文字列はsys.internで共有する
+
+
+def _intern(value: any) -> any:
+    return sys.intern(value) if type(value) is str else value
 
 
 class ProfitDataItem:
+    __slots__ = ("name", "memo")
+
     def __init__(self, name: str, memo=""):
-        self.name = name
+        self.name = _intern(name)
         self.memo = memo
 
     def __eq__(self, other):
@@ -20,17 +32,21 @@ class ProfitDataItem:
 
 
 class ProfitData:
+    __slots__ = ("label", "value")
+
     def __init__(self, label: ProfitDataItem, value: any):
         self.label = label
         self.value = value
 
 
 class LossDataItem:
+    __slots__ = ("group", "account", "category", "fixval", "ratio", "memo")
+
     def __init__(self, group: str, account: str, category: str, fixval: str, ratio: str, memo=""):
-        self.group = group
-        self.account = account
-        self.category = category
-        self.fixval = fixval
+        self.group = _intern(group)
+        self.account = _intern(account)
+        self.category = _intern(category)
+        self.fixval = _intern(fixval)
         self.ratio = ratio
         self.memo = memo
 
@@ -48,6 +64,8 @@ class LossDataItem:
 
 
 class LossData:
+    __slots__ = ("label", "value", "rest_value")
+
     def __init__(self, label: LossDataItem, value: any):
         self.label = label
         self.value = value
@@ -55,9 +73,16 @@ class LossData:
 
 
 class MonthlyData:
+    __slots__ = ("yyyymm", "rows", "index", "accounts")
+
     def __init__(self, yyyymm: str, rows: list[Union[LossData, ProfitData]]):
         self.yyyymm = yyyymm
         self.rows = rows
+        self.index = dict()     # type: Dict[tuple, int]  # key = 行ラベルのタプル, value = rowsの中の位置
+        self.accounts = dict()  # type: Dict[str, int]    # key = 勘定科目, value = その勘定科目の最初の行の位置
+        for i, r in enumerate(self.rows):
+            if r.label is not None:
+                self._add_index(r.label, i)
 
     def list_monthly_data(self):
         if self.rows is None or len(self.rows) == 0:
@@ -68,25 +93,146 @@ class MonthlyData:
         else:
             return list(map(lambda x: {"label": x.label.tuple() if x.label is not None else "", "value": x.value}, rows))
 
+    def find(self, label: tuple) -> Union[LossData, ProfitData, None]:
+        """行ラベルのタプルに一致する行を返す"""
+        idx = self.index.get(tuple(label))
+        if idx is None:
+            return None
+        return self.rows[idx]
+
     def find_account(self, account: str) -> Union[LossData, ProfitData]:
-        return next((r for r in self.rows if r.label.account == account), None)
+        idx = self.accounts.get(account)
+        if idx is None:
+            return None
+        return self.rows[idx]
+
+    def replace(self, row: Union[LossData, ProfitData]) -> bool:
+        """同じ行ラベルの行を置き換える。置き換える行がなければFalseを返す"""
+        if row.label is None:
+            return False
+        idx = self.index.get(row.label.tuple())
+        if idx is None:
+            return False
+        self.rows[idx] = row
+        return True
 
     def merge(self, new_rows: list[Union[LossData, ProfitData]]):
         """重複を排除しながらマージする"""
+        if counters is not None:
+            counters["merge_compare"] += len(new_rows)
         for r in new_rows:
             if r.label is None:
                 continue
-            idx = next((i for i, d in enumerate(self.rows) if d.label is not None and r.label.tuple() == d.label.tuple()), None)
+            key = r.label.tuple()
+            idx = self.index.get(key)
             if idx is None:
+                self._add_index(r.label, len(self.rows))
                 self.rows.append(r)
             else:
                 self.rows[idx] = r
 
+    def merge_monthly(self, other: 'MonthlyData'):
+        """別のMonthlyDataの行をまとめてマージする"""
+        self.merge(other.rows)
+
+    def _add_index(self, label: Union[LossDataItem, ProfitDataItem], idx: int):
+        # 重複していたら最初の行を使う（mergeの挙動に合わせる）
+        self.index.setdefault(label.tuple(), idx)
+        if hasattr(label, "account"):
+            self.accounts.setdefault(label.account, idx)
+
+
+class LazyMonths(dict):
+    """月ごとのMonthlyDataの辞書で、一部の月をJSONから読み込んだままの形(raw)で持っておくもの
+    rawの月は、[]やgetでアクセスされた時に初めてMonthlyDataに変換する
+    items()やkeys()などで列挙されるのは変換済みの月だけなので、集計や按分の処理はrawの月には及ばない
+    """
+    def __init__(self, decoder: Callable[[str, list], MonthlyData], raw: Dict[str, list], loaded: Callable[[str], bool]):
+        """
+        Args:
+            decoder (Callable[[str, list], MonthlyData]): (yyyymm, JSONの行のリスト)からMonthlyDataを作る関数
+            raw (Dict[str, list]): JSONから読み込んだままの月ごとの行のリスト
+            loaded (Callable[[str], bool]): 最初から変換しておく月ならTrueを返す関数
+        """
+        super().__init__()
+        self.decoder = decoder
+        self.raw = dict()   # type: Dict[str, list]
+        self.order = list(raw.keys())  # 保存するときに元の順番で書き出すため
+        for yyyymm, rows in raw.items():
+            if loaded(yyyymm):
+                dict.__setitem__(self, yyyymm, decoder(yyyymm, rows))
+            else:
+                self.raw[yyyymm] = rows
+
+    def __missing__(self, yyyymm: str) -> MonthlyData:
+        if yyyymm not in self.raw:
+            raise KeyError(yyyymm)
+        monthly = self.decoder(yyyymm, self.raw.pop(yyyymm))
+        dict.__setitem__(self, yyyymm, monthly)
+        return monthly
+
+    def __contains__(self, yyyymm: any) -> bool:
+        return dict.__contains__(self, yyyymm) or yyyymm in self.raw
+
+    def __setitem__(self, yyyymm: str, value: any):
+        self.raw.pop(yyyymm, None)
+        dict.__setitem__(self, yyyymm, value)
+
+    def get(self, yyyymm: str, default: any = None) -> any:
+        if yyyymm in self:
+            return self[yyyymm]
+        return default
+
+    def setdefault(self, yyyymm: str, default: any = None) -> any:
+        if yyyymm in self:
+            return self[yyyymm]
+        dict.__setitem__(self, yyyymm, default)
+        return default
+
+    def pop(self, yyyymm: str, *args) -> any:
+        if yyyymm in self.raw:
+            return self.raw.pop(yyyymm)
+        return dict.pop(self, yyyymm, *args)
+
+    def unloaded(self, exclude: Iterable[str] = ()) -> 'LazyMonths':
+        """変換済みの月を除いて、rawの月だけを持つ新しいインスタンスを作る(excludeの月はrawからも除く)"""
+        exclude = set(exclude)
+        result = LazyMonths(self.decoder, {}, lambda x: False)
+        result.raw = {yyyymm: rows for yyyymm, rows in self.raw.items() if yyyymm not in exclude}
+        result.order = list(filter(lambda x: x in result.raw, self.order))
+        return result
+
+    def all_items(self) -> list[Tuple[str, any]]:
+        """rawの月も含めて、元の順番(新しく追加された月は後ろ)で(yyyymm, MonthlyDataまたはJSONの行のリスト)を返す"""
+        result = list()
+        for yyyymm in self.order:
+            if dict.__contains__(self, yyyymm):
+                result.append((yyyymm, dict.__getitem__(self, yyyymm)))
+            elif yyyymm in self.raw:
+                result.append((yyyymm, self.raw[yyyymm]))
+        order = set(self.order)
+        result.extend(filter(lambda x: x[0] not in order, dict.items(self)))
+        return result
+
+
+def merge_monthly_data(monthly: Dict[str, MonthlyData], yyyymm: str, rows: list[Union[LossData, ProfitData]]):
+    """月ごとのMonthlyDataの辞書に一月分の行をマージする。その月のデータがなければMonthlyDataを作る"""
+    if yyyymm not in monthly:
+        monthly[yyyymm] = MonthlyData(yyyymm, rows)
+    else:
+        monthly[yyyymm].merge(rows)
+
 
 class LabelManager:
     """ProfitDataItemやLossDataItemのリストを管理し、Item解決の問い合わせに答える"""
+    # 行ラベルを一意に決めるキーの項目（profitは売上項目名、lossは経費グループ・勘定科目・カテゴリ）
+    KEY_FIELDS = {"profit": ("name",), "loss": ("group", "account", "category")}
+
     def __init__(self):
         self.items = dict()
+        self.index = dict()  # type: Dict[Tuple[str, str], Dict[tuple, Union[ProfitDataItem, LossDataItem]]]  # key = (business, typ)
+        self.misses = 0      # 解決できなかった問い合わせの回数
+        self.pool = dict()   # type: Dict[Tuple[str, str], Dict[tuple, Union[ProfitDataItem, LossDataItem]]]  # 表定義にない行ラベル(利益など)
 
     def add(self, business: str, typ: str, item: Union[ProfitDataItem, LossDataItem]):
         """行ラベルを登録する
@@ -100,13 +246,65 @@ class LabelManager:
         elif typ == "loss":
             if item.account is None: return
         self.items.setdefault(business, {}).setdefault(typ, set()).add(item)
+        # setと同じく、同じキーのItemがすでにあれば最初に登録されたものを使い続ける
+        self.index.setdefault((business, typ), {}).setdefault(item.tuple(), item)
 
     def get_all(self, business, typ: str):
         return list(self.items[business][typ])
 
+    def count(self, business: str, typ: str) -> int:
+        """登録されている行ラベルの数を返す"""
+        return len(self.items.get(business, {}).get(typ, ()))
+
+    def intern(self, business: str, typ: str, item: Union[ProfitDataItem, LossDataItem]) -> Union[ProfitDataItem, LossDataItem]:
+        """同じ行ラベルのItemがすでにあればそれを返し、なければitemを覚えて返す
+        表定義にない行ラベル(earningsの利益など)も、事業ごとに一つのオブジェクトを全ての月で使い回すためのもの
+        """
+        key = item.tuple()
+        found = self.index.get((business, typ), {}).get(key)
+        if found is not None:
+            return found
+        return self.pool.setdefault((business, typ), {}).setdefault(key, item)
+
     def get(self, business: str, typ: str, **kwargs):
         if typ not in self.items[business]:
             return
+        fields = self.KEY_FIELDS.get(typ)
+        if fields is not None and len(kwargs) == len(fields) and all(k in kwargs for k in fields):
+            item = self.index[(business, typ)].get(tuple(kwargs[k] for k in fields))
+        else:
+            item = self._scan(business, typ, kwargs)
+        if item is None:
+            self.misses += 1
+        return item
+
+    def resolve_many(self, business: str, typ: str, labels: Iterable[Sequence]) -> list:
+        """行ラベル(エクセルやJSONから読んだラベルの並び)をまとめてItemに解決する
+        Args:
+            business (str): 事業名(=エクセルファイル名)
+            typ (str): profit/loss
+            labels (Iterable[Sequence]): ラベルの並び。先頭からキーの項目数だけを使う（profitなら1つ、lossなら3つ）
+        Returns:
+            list: labelsと同じ順番のItemのリスト。解決できなかったものはNone
+        """
+        labels = list(labels)
+        if counters is not None:
+            counters["label_resolve"] += len(labels)
+        if typ not in self.items[business]:
+            self.misses += len(labels)
+            return [None] * len(labels)
+        size = len(self.KEY_FIELDS[typ])
+        index = self.index[(business, typ)]
+        result = list()
+        for label in labels:
+            item = index.get(tuple(label[:size]))
+            if item is None:
+                self.misses += 1
+            result.append(item)
+        return result
+
+    def _scan(self, business: str, typ: str, kwargs: dict):
+        """キー以外の項目で問い合わせされた時のための線形探索"""
         for item in self.items[business][typ]:
             flag = False
             for k, v in kwargs.items():
@@ -0,0 +1,234 @@
+from typing import Union, Dict, Callable
+import os
+import sys
+import json
+import time
+import cProfile
+import contextlib
+import tracemalloc
+from collections import Counter
+try:
+    import resource  # 最大RSSを調べる(Windowsにはない)
+except ImportError:
+    resource = None
+
+import pldata
+from excel import utils, table
+
+# よく通る処理の回数。enable_counting()を呼んだ時だけ数える(呼ばなければ、数える処理はNoneを調べるだけ)
+# label_resolve: resolve_manyで解決した行ラベル(読み込みの行ラベルは全てresolve_manyで解決するので、LabelManager.getは数えない)、
+# merge_compare: MonthlyData.mergeで既存の行と突き合わせた行、cell_write: utils.set_style_and_valueで書いたセル、
+# sum_formula: 書き込んだSUMの式、sum_value: 式の代わりに書き込んだ計算値
+counters = Counter()  # type: Counter[str]
+COUNTERS = ["label_resolve", "merge_compare", "cell_write", "sum_formula", "sum_value"]
+
+
+def enable_counting():
+    """数える処理のあるモジュールにcountersを入れて、回数を数え始める"""
+    pldata.counters = counters
+    utils.counters = counters
+    table.counters = counters
+
+
+MB = 1024 * 1024
+
+
+class MemoryTracker:
+    """tracemallocとRSSで、処理ごと(ワークブックごと)に使ったメモリを調べる
+    tracemallocはPythonのメモリ確保を全て記録するので遅くなる。--memoryまたは--memory-budgetを指定した時だけ使う
+    budget(MB)を渡すと、最大RSS(resourceがなければPythonで確保した量の最大)がそれを超えた処理の後で、
+    多く確保している箇所を表示して終了する
+    """
+
+    def __init__(self, budget: Union[float, None] = None, top=10):
+        self.budget = budget
+        self.top = top
+
+    def start(self):
+        """tracemallocを始める(プロセスプールの中でも呼ぶので、始まっていれば何もしない)"""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def begin(self) -> dict:
+        """処理の前に呼ぶ。tracemallocの最大値を今の値に戻し、その時の最大RSSを覚えておく"""
+        tracemalloc.reset_peak()
+        return {"peak_rss": _peak_rss()}
+
+    def end(self, before: dict, sites=True) -> dict:
+        """処理の後に呼ぶ。その処理の間のメモリの使用量(MB)と、多く確保している箇所を返す"""
+        current, peak = tracemalloc.get_traced_memory()
+        result = {"traced": current / MB, "traced_peak": peak / MB, "rss": _current_rss(), "peak_rss": _peak_rss()}
+        if result["peak_rss"] is not None and before["peak_rss"] is not None:
+            result["peak_rss_growth"] = result["peak_rss"] - before["peak_rss"]  # この処理で最大RSSが増えた分
+        if sites:
+            result["top_sites"] = self.top_sites()
+        return result
+
+    def top_sites(self) -> list[dict]:
+        """今確保されているメモリが多い箇所(ファイル名:行番号)"""
+        snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+        return [{"site": f"{s.traceback[0].filename}:{s.traceback[0].lineno}", "size": s.size / MB, "count": s.count}
+                for s in snapshot.statistics("lineno")[:self.top]]
+
+    def check(self, name: str, usage: dict):
+        """メモリの使用量が上限を超えていたら、どこで超えたかと多く確保している箇所を表示して終了する"""
+        if self.budget is None:
+            return
+        used = usage["peak_rss"] if usage["peak_rss"] is not None else usage["traced_peak"]
+        if used <= self.budget:
+            return
+        print(f"XXX メモリの使用量が上限を超えました: {name}の後で{used:.1f}MB (上限 {self.budget:.1f}MB)")
+        print(f"XXX   Pythonで確保した量: 処理中の最大 {usage['traced_peak']:.1f}MB, 処理の後 {usage['traced']:.1f}MB")
+        if "peak_rss_growth" in usage:
+            print(f"XXX   この処理で最大RSSが{usage['peak_rss_growth']:.1f}MB増えました")
+        for s in usage.get("top_sites") or self.top_sites():
+            print(f"XXX   {s['size']:8.1f}MB {s['count']:8d}個  {s['site']}")
+        print("XXX   期間を短くする(-s/-e, --lazy)、--write-onlyで書き出す、-jを減らすなどを試してください")
+        sys.exit(1)
+
+
+def _current_rss() -> Union[float, None]:
+    """今のRSS(MB)。/procがなければNone"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / MB
+    except (OSError, ValueError):
+        return None
+
+
+def _peak_rss() -> Union[float, None]:
+    """プロセスが始まってからの最大RSS(MB)。ru_maxrssはLinuxではKB、macOSではバイト"""
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / MB if sys.platform == "darwin" else maxrss / 1024
+
+
+def measure(memory: Union[MemoryTracker, None], count: bool, name: str, func: Callable, *args) -> dict:
+    """func(*args)(nameを作る処理)を実行し、かかった時間(実時間とCPU時間)と、その間に数えた回数を返す
+    memoryを渡すと、その間に使ったメモリも調べ、上限を超えていたら終了する
+    countがTrueなら回数を数える(プロセスプールの中では、呼び出し元で数え始めていても引き継がれないことがある)
+    プロセスプールの中でも使えるように、結果は辞書で返す(CPU時間とメモリはそのプロセスのもの)
+    """
+    if count:
+        enable_counting()
+    if memory is not None:
+        memory.start()
+        mem = memory.begin()
+    before = counters.copy()
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    func(*args)
+    result = {"wall": time.perf_counter() - wall, "cpu": time.process_time() - cpu, "counts": dict(counters - before)}
+    if memory is not None:
+        # ワークブックは保存した後に捨てているので、確保している箇所は調べない(上限を超えた時だけ表示する)
+        result["memory"] = memory.end(mem, sites=False)
+        memory.check(name, result["memory"])
+    return result
+
+
+class Profiler:
+    """処理(フェーズ)ごと、ワークブックごとの実時間とCPU時間、よく通る処理の回数を記録する
+    cprofileにファイル名を渡すと、このプロセスのcProfileの統計をそのファイルに書き出す(別のプロセスで作ったワークブックは含まない)
+    memoryを渡すと、処理ごと、ワークブックごとに使ったメモリも記録する
+    countがFalseなら回数は数えない(時間だけを記録する)
+    """
+
+    def __init__(self, cprofile: Union[str, None] = None, memory: Union[MemoryTracker, None] = None, count=True):
+        self.phases = []  # type: list[dict]  # 記録した順
+        self.books = []   # type: list[dict]  # 書き出し終わった順
+        self.cprofile = cprofile
+        self.memory = memory
+        self.count = count
+        if self.count:
+            enable_counting()
+        if self.memory is not None:
+            self.memory.start()
+        self._profile = cProfile.Profile() if cprofile is not None else None
+        self._start = (time.perf_counter(), time.process_time(), counters.copy())
+        if self._profile is not None:
+            self._profile.enable()
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        """with profiler.phase("名前"): の中の処理を一つのフェーズとして記録する(メモリが上限を超えていたら、記録した後で終了する)"""
+        mem = self.memory.begin() if self.memory is not None else None
+        before = counters.copy()
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            phase = {"name": name, "wall": time.perf_counter() - wall, "cpu": time.process_time() - cpu, "counts": dict(counters - before)}
+            if self.memory is not None:
+                phase["memory"] = self.memory.end(mem)
+            self.phases.append(phase)
+        if self.memory is not None:
+            self.memory.check(name, phase["memory"])
+
+    def add_book(self, file_name: str, stats: dict, parallel=False):
+        """measure()の結果をワークブックの記録として追加する
+        別のプロセスで数えた回数は、このプロセスの回数に足しておく(フェーズと全体の回数に含める)
+        """
+        self.books.append({"file": file_name, "parallel": parallel, **stats})
+        if parallel:
+            counters.update(stats["counts"])
+
+    def stop(self):
+        if self._profile is not None:
+            self._profile.disable()
+            self._profile.dump_stats(self.cprofile)
+            self._profile = None
+
+    def report(self) -> dict:
+        wall, cpu, before = self._start
+        return {
+            "pid": os.getpid(),
+            "wall": time.perf_counter() - wall,
+            "cpu": time.process_time() - cpu,
+            "counts": {name: (counters - before).get(name, 0) for name in COUNTERS},
+            "phases": self.phases,
+            "books": self.books,
+            "cprofile": self.cprofile,
+            "memory_budget": self.memory.budget if self.memory is not None else None,
+        }
+
+    def save(self, path: str) -> dict:
+        """レポートをJSONで書き出す"""
+        result = self.report()
+        with open(path, "w") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        return result
+
+
+def summarize(result: dict, top=5) -> list[str]:
+    """レポートを数行の要約(コンソールに出す文字列のリスト)にする"""
+    total = result["wall"] if result["wall"] > 0 else 1
+    lines = [f"合計 {result['wall']:.3f}秒 (CPU {result['cpu']:.3f}秒)"]
+    for p in sorted(result["phases"], key=lambda x: x["wall"], reverse=True):
+        lines.append(f"  {p['name']:<24} {p['wall']:8.3f}秒 {p['wall'] / total * 100:5.1f}%  (CPU {p['cpu']:.3f}秒){_memory_text(p)}")
+    books = sorted(result["books"], key=lambda x: x["wall"], reverse=True)
+    if len(books) > 0:
+        lines.append(f"ワークブック {len(books)}件 (時間のかかったもの{min(top, len(books))}件)")
+        for b in books[:top]:
+            lines.append(f"  {b['file']:<24} {b['wall']:8.3f}秒  (CPU {b['cpu']:.3f}秒, セル {b['counts'].get('cell_write', 0)}){_memory_text(b)}")
+    lines.append("回数 " + ", ".join(f"{name}={count}" for name, count in result["counts"].items()))
+
+    # Pythonで確保した量が一番多かった処理の後で、多く確保している箇所
+    phases = [p for p in result["phases"] if "memory" in p]
+    if len(phases) > 0:
+        p = max(phases, key=lambda x: x["memory"]["traced_peak"])
+        lines.append(f"メモリを多く確保している箇所 ({p['name']}の後)")
+        for s in p["memory"]["top_sites"][:top]:
+            lines.append(f"  {s['size']:8.1f}MB {s['count']:8d}個  {s['site']}")
+    return lines
+
+
+def _memory_text(record: dict) -> str:
+    if "memory" not in record:
+        return ""
+    mem = record["memory"]
+    text = f" 確保の最大 {mem['traced_peak']:.1f}MB"
+    if mem["peak_rss"] is not None:
+        text += f", 最大RSS {mem['peak_rss']:.1f}MB"
+    return text
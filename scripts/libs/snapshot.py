@@ -0,0 +1,209 @@
+from typing import Union, Tuple, Dict
+import os
+import json
+import mmap
+import struct
+
+from pldata import LabelManager, convert_proc
+from storage import JsonStorage, PeriodFunc, decode_data_store, write_json_atomically, as_v1, STORE_FILE
+from common import write_atomically
+from columnar import SCENARIOS
+
+
+SNAPSHOT_FILE = "store.plsnap"
+MAGIC = b"PLSNAP\x00\x01"
+
+# ファイルの先頭: マジック、索引(JSON)の位置と長さ
+HEADER = struct.Struct("<8sQQ")
+# 1行分: ラベル番号、値の型、rest_valueの型、値、rest_value
+ROW = struct.Struct("<IBBxxdd")
+
+# 値の型
+NONE = 0    # None
+FLOAT = 1   # float
+INT = 2     # int(doubleで正確に表せる範囲)
+OBJECT = 3  # 文字列などそれ以外の値。索引のobjectsの番号を値に入れる
+ABSENT = 4  # rest_valueのキーがない行(売上と利益)
+
+MAX_EXACT_INT = 2 ** 53
+
+
+class SnapshotBlock:
+    """スナップショット内の一月分の行。中身は読み出された時に初めてmmapから取り出す
+    JSONの行のリストと同じように列挙でき、convert_procでJSONに書き出せる
+    """
+
+    def __init__(self, snapshot: 'Snapshot', offset: int, count: int):
+        self.snapshot = snapshot
+        self.offset = offset
+        self.count = count
+
+    def __iter__(self):
+        return iter(self.list_monthly_data())
+
+    def __len__(self) -> int:
+        return self.count
+
+    def list_monthly_data(self) -> list[dict]:
+        return self.snapshot.read_rows(self.offset, self.count)
+
+
+class Snapshot:
+    """スナップショットファイルをmmapで開いたもの
+    ファイルの構成は、ヘッダ、値のブロック(一月分の行を固定長で並べたもの)、索引(JSON)の順
+    索引にはconfig、definition、ラベルの辞書、文字列などの値、ブロックの位置が入る
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, index_offset, index_size = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            print(f"XXX {path}はスナップショットファイルではありません")
+            self.map.close()
+            raise ValueError(path)
+        self.index = json.loads(self.map[index_offset:index_offset+index_size].decode("utf-8"))
+        self.labels = self.index["labels"]
+        self.objects = self.index["objects"]
+
+    def read_rows(self, offset: int, count: int) -> list[dict]:
+        result = list()
+        # mmapをコピーせずに読む(読み終わったらビューを解放しないと、closeでBufferErrorになる)
+        with memoryview(self.map) as view, view[offset:offset+count*ROW.size] as block:
+            for label_id, value_type, rest_type, value, rest_value in ROW.iter_unpack(block):
+                row = {"label": self.labels[label_id], "value": self._value(value_type, value)}
+                if rest_type != ABSENT:
+                    row["rest_value"] = self._value(rest_type, rest_value)
+                result.append(row)
+        return result
+
+    def _value(self, typ: int, value: float) -> any:
+        if typ == FLOAT:
+            return value
+        elif typ == INT:
+            return int(value)
+        elif typ == OBJECT:
+            return self.objects[int(value)]
+        return None
+
+    def raw(self) -> dict:
+        """store.jsonをjson.loadしたのと同じ形の辞書を作る(月の行はSnapshotBlockのまま)"""
+        result = dict()
+        for key in self.index["keys"]:
+            if key not in SCENARIOS:
+                result[key] = self.index["store"][key]
+                continue
+            result[key] = dict()
+            for business, kinds in self.index["layout"][key].items():
+                result[key][business] = {kind: {yyyymm: SnapshotBlock(self, offset, count) for yyyymm, offset, count in blocks}
+                                         for kind, blocks in kinds.items()}
+        return result
+
+    def close(self):
+        if not self.map.closed:
+            self.map.close()
+
+
+class SnapshotStorage(JsonStorage):
+    """データストアをバイナリのスナップショット(store.plsnap)に保存する
+    読み込みはmmapで行い、月ごとの値は読み出されるまで取り出さない(--lazyと合わせると期間外の月は変換もしない)
+    store.plsnapがなくstore.jsonがあるときは、store.jsonから読み込む（次の保存でstore.plsnapが作られる）
+    """
+
+    def __init__(self, directory: str):
+        super().__init__(directory)
+        self.snapshot_path = os.path.join(directory, SNAPSHOT_FILE)
+        self.snapshot = None  # type: Union[Snapshot, None]
+
+    def load(self, period: PeriodFunc = None) -> Tuple[dict, LabelManager]:
+        if not os.path.exists(self.snapshot_path):
+            return super().load(period)
+        self.snapshot = Snapshot(self.snapshot_path)
+        raw = self.snapshot.raw()
+        if "definition" not in raw:
+            return {}, LabelManager()
+        return decode_data_store(raw, period)
+
+    def save(self, data_store: dict):
+        write_snapshot(self.snapshot_path, data_store, self.snapshot)
+        self.snapshot = None
+
+
+def write_snapshot(path: str, data_store: dict, opened: Union[Snapshot, None] = None):
+    """データストアをスナップショットに書き出す
+    月の行はMonthlyData、JSONの行のリスト、SnapshotBlockのどれでもよい
+    openedに同じファイルを開いたSnapshotを渡すと、書き出した後に閉じてから置き換える
+    """
+    labels = list()
+    label_ids = dict()   # key = ラベルのJSON文字列
+    objects = list()
+    index = {"keys": list(data_store.keys()), "store": {}, "layout": {}}
+
+    def pack(value: any) -> Tuple[int, float]:
+        if value is None:
+            return NONE, 0.0
+        if type(value) is float:
+            return FLOAT, value
+        if type(value) is int and -MAX_EXACT_INT <= value <= MAX_EXACT_INT:
+            return INT, float(value)
+        objects.append(value)
+        return OBJECT, float(len(objects) - 1)
+
+    def write(tmp_path: str):
+        with open(tmp_path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, 0, 0))
+            offset = HEADER.size
+            for key, value in data_store.items():
+                if key not in SCENARIOS:
+                    index["store"][key] = value
+                    continue
+                layout = index["layout"][key] = dict()
+                for business, kinds in value.items():
+                    layout[business] = dict()
+                    for kind, monthly in kinds.items():
+                        blocks = layout[business][kind] = list()
+                        months = monthly.all_items() if hasattr(monthly, "all_items") else monthly.items()
+                        for yyyymm, rows in months:
+                            if not isinstance(rows, list):
+                                rows = convert_proc(rows)
+                            buf = bytearray()
+                            for row in rows:
+                                label = json.dumps(row["label"], ensure_ascii=False)
+                                if label not in label_ids:
+                                    label_ids[label] = len(labels)
+                                    labels.append(row["label"])
+                                value_type, v = pack(row["value"])
+                                rest_type, rest_value = pack(row["rest_value"]) if "rest_value" in row else (ABSENT, 0.0)
+                                buf += ROW.pack(label_ids[label], value_type, rest_type, v, rest_value)
+                            f.write(buf)
+                            blocks.append([yyyymm, offset, len(rows)])
+                            offset += len(buf)
+
+            index["labels"] = labels
+            index["objects"] = objects
+            body = json.dumps(index, default=convert_proc, ensure_ascii=False).encode("utf-8")
+            f.write(body)
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, offset, len(body)))
+
+        # mmapで開いたままだと置き換えられない環境があるので、読み出し終わってから閉じる
+        if opened is not None:
+            opened.close()
+
+    write_atomically(path, write)
+
+
+def json_to_snapshot(directory: str):
+    """store.jsonをstore.plsnapに変換する"""
+    with open(os.path.join(directory, STORE_FILE)) as f:
+        write_snapshot(os.path.join(directory, SNAPSHOT_FILE), as_v1(json.load(f)))
+
+
+def snapshot_to_json(directory: str):
+    """store.plsnapをstore.jsonに変換する"""
+    snapshot = Snapshot(os.path.join(directory, SNAPSHOT_FILE))
+    try:
+        write_json_atomically(os.path.join(directory, STORE_FILE), snapshot.raw())
+    finally:
+        snapshot.close()
@@ -0,0 +1,265 @@
+from typing import Union, Tuple, Dict
+import os
+import json
+import sqlite3
+
+from pldata import LabelManager, ProfitDataItem, LossDataItem
+from columnar import ColumnarStore
+from aggregate import Aggregation
+from storage import STORE_FILE, PeriodFunc, decode_data_store
+import journal
+
+
+DB_FILE = "store.sqlite3"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS businesses (
+    business TEXT PRIMARY KEY,
+    position INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS labels (
+    label_id INTEGER PRIMARY KEY,
+    business TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    in_definition INTEGER NOT NULL,
+    name TEXT, grp TEXT, account TEXT, category TEXT, fixval TEXT, ratio, memo TEXT,
+    UNIQUE (business, kind, key)
+);
+CREATE TABLE IF NOT EXISTS months (
+    scenario TEXT NOT NULL,
+    business TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    yyyymm TEXT NOT NULL,
+    ym INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (scenario, business, kind, yyyymm)
+);
+CREATE TABLE IF NOT EXISTS cells (
+    scenario TEXT NOT NULL,
+    business TEXT NOT NULL,
+    yyyymm TEXT NOT NULL,
+    ym INTEGER NOT NULL,
+    label_id INTEGER NOT NULL REFERENCES labels (label_id),
+    position INTEGER NOT NULL,
+    value,
+    rest_value,
+    PRIMARY KEY (scenario, business, yyyymm, label_id)
+);
+CREATE INDEX IF NOT EXISTS cells_range ON cells (scenario, business, ym, label_id);
+"""
+
+
+def to_ym(yyyymm: str) -> int:
+    """"2024/4"や"2024/04"のような年月を、範囲検索用の整数(202404)にする"""
+    y, m = yyyymm.split("/")
+    return int(y) * 100 + int(m)
+
+
+class SqliteStorage:
+    """データストアをSQLite(store.sqlite3)に保存する
+    保存は読み込んだ時点からの変更分だけを一つのトランザクションで書き込む
+    store.sqlite3がなくstore.jsonがあるときは、store.jsonから読み込む（次の保存でstore.sqlite3が作られる）
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.path = os.path.join(directory, DB_FILE)
+        self.json_path = os.path.join(directory, STORE_FILE)
+        self.conn = None      # type: Union[sqlite3.Connection, None]
+        self.baseline = None  # type: Union[ColumnarStore, None]  # 読み込んだ時点の値
+
+    def connect(self) -> sqlite3.Connection:
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.path)
+            self.conn.executescript(SCHEMA)
+        return self.conn
+
+    def load(self, period: PeriodFunc = None) -> Tuple[dict, LabelManager]:
+        exists = os.path.exists(self.path)
+        if exists:
+            raw = self.read_raw()
+        elif os.path.exists(self.json_path):
+            with open(self.json_path) as f:
+                raw = json.load(f)
+        else:
+            raw = {}
+
+        if "definition" not in raw:
+            data_store, mgr = {}, LabelManager()
+        else:
+            # store.jsonから移す時は、最初の保存で全ての月を書き込むので、--lazyでも全ての月を読み込む
+            # (JSONのままの月はjournal.diffで変更に含まれず、store.sqlite3に入らなくなってしまう)
+            data_store, mgr = decode_data_store(raw, period if exists else None)
+        # store.sqlite3がまだなければ、最初の保存で全ての値を書き込む
+        self.baseline = ColumnarStore.from_data_store(data_store) if exists else ColumnarStore()
+        return data_store, mgr
+
+    def read_raw(self) -> dict:
+        """store.jsonをjson.loadしたのと同じ形の辞書を作る"""
+        conn = self.connect()
+        raw = {}
+        row = conn.execute("SELECT value FROM meta WHERE key = 'config'").fetchone()
+        if row is not None:
+            raw["config"] = json.loads(row[0])
+
+        businesses = [r[0] for r in conn.execute("SELECT business FROM businesses ORDER BY position")]
+        if len(businesses) == 0:
+            return raw
+        raw["definition"] = {business: {"profit": [], "loss": []} for business in businesses}
+        labels = dict()  # key = label_id
+        for label_id, business, kind, key, in_definition, name, grp, account, category, fixval, ratio, memo in conn.execute(
+                "SELECT label_id, business, kind, key, in_definition, name, grp, account, category, fixval, ratio, memo FROM labels ORDER BY business, kind, position"):
+            labels[label_id] = (kind, json.loads(key))
+            if not in_definition:
+                continue
+            definition = raw["definition"].setdefault(business, {"profit": [], "loss": []})
+            if kind == "profit":
+                definition["profit"].append(ProfitDataItem(name, memo).obj())
+            elif kind == "loss":
+                definition["loss"].append(LossDataItem(grp, account, category, fixval, ratio, memo).obj())
+
+        # 事業は表定義の順に並べる(aggregateで利益を足す順番と同じにする)
+        for scenario, business, kind, yyyymm in conn.execute(
+                """SELECT m.scenario, m.business, m.kind, m.yyyymm FROM months m LEFT JOIN businesses b ON m.business = b.business
+                   ORDER BY m.scenario, b.position IS NULL, b.position, m.business, m.kind, m.position"""):
+            raw.setdefault(scenario, {}).setdefault(business, {}).setdefault(kind, {})[yyyymm] = []
+        for scenario, business, yyyymm, label_id, value, rest_value in conn.execute(
+                "SELECT scenario, business, yyyymm, label_id, value, rest_value FROM cells ORDER BY scenario, business, yyyymm, position"):
+            kind, key = labels[label_id]
+            row = {"label": key, "value": value}
+            if kind == "loss":
+                row["rest_value"] = rest_value
+            raw[scenario][business][kind][yyyymm].append(row)
+        return raw
+
+    def save(self, data_store: dict):
+        conn = self.connect()
+        with conn:  # 一つのトランザクションで書き込む(途中で失敗したら何も書き込まれない)
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('config', ?)", (json.dumps(data_store.get("config", {})),))
+            self._save_definition(conn, data_store.get("definition", {}))
+            changes = journal.diff(self.baseline if self.baseline is not None else ColumnarStore(), data_store)
+            self._apply_changes(conn, changes)
+        self.baseline = ColumnarStore.from_data_store(data_store)
+
+    def _save_definition(self, conn: sqlite3.Connection, definition: dict):
+        conn.execute("DELETE FROM businesses")
+        conn.executemany("INSERT INTO businesses (business, position) VALUES (?, ?)", map(lambda x: (x[1], x[0]), enumerate(definition.keys())))
+        conn.execute("UPDATE labels SET in_definition = 0")
+        for business, conf in definition.items():
+            for kind in ["profit", "loss"]:
+                for position, item in enumerate(conf.get(kind, [])):
+                    values = _label_columns(kind, item.tuple())
+                    values.update({"fixval": getattr(item, "fixval", None), "ratio": getattr(item, "ratio", None), "memo": item.memo})
+                    conn.execute("""INSERT INTO labels (business, kind, key, position, in_definition, name, grp, account, category, fixval, ratio, memo)
+                                    VALUES (:business, :kind, :key, :position, 1, :name, :grp, :account, :category, :fixval, :ratio, :memo)
+                                    ON CONFLICT (business, kind, key) DO UPDATE SET
+                                        position = excluded.position, in_definition = 1, fixval = excluded.fixval, ratio = excluded.ratio, memo = excluded.memo""",
+                                 dict(values, business=business, kind=kind, key=json.dumps(list(item.tuple())), position=position))
+
+    def _label_id(self, conn: sqlite3.Connection, cache: dict, business: str, kind: str, label: list) -> int:
+        key = json.dumps(label)
+        if (business, kind, key) not in cache:
+            row = conn.execute("SELECT label_id FROM labels WHERE business = ? AND kind = ? AND key = ?", (business, kind, key)).fetchone()
+            if row is None:
+                # 表定義にない行ラベル(利益など)
+                values = _label_columns(kind, label)
+                cur = conn.execute("""INSERT INTO labels (business, kind, key, position, in_definition, name, grp, account, category)
+                                      VALUES (?, ?, ?, 0, 0, ?, ?, ?, ?)""", (business, kind, key, values["name"], values["grp"], values["account"], values["category"]))
+                cache[(business, kind, key)] = cur.lastrowid
+            else:
+                cache[(business, kind, key)] = row[0]
+        return cache[(business, kind, key)]
+
+    def _apply_changes(self, conn: sqlite3.Connection, changes: list[list]):
+        """journal.diffで作った変更の操作を、SQLで適用する"""
+        cache = dict()
+        for change in changes:
+            op, scenario, business, kind, yyyymm = change[:5]
+            month = (scenario, business, kind, yyyymm)
+            if op == "drop":
+                conn.execute("DELETE FROM cells WHERE scenario = ? AND business = ? AND yyyymm = ? AND label_id IN (SELECT label_id FROM labels WHERE kind = ?)",
+                             (scenario, business, yyyymm, kind))
+                conn.execute("DELETE FROM months WHERE scenario = ? AND business = ? AND kind = ? AND yyyymm = ?", month)
+                continue
+            if op == "month":
+                conn.execute("""INSERT OR IGNORE INTO months (scenario, business, kind, yyyymm, ym, position)
+                                VALUES (?, ?, ?, ?, ?, (SELECT COUNT(*) FROM months WHERE scenario = ? AND business = ? AND kind = ?))""",
+                             month + (to_ym(yyyymm), scenario, business, kind))
+                continue
+
+            label_id = self._label_id(conn, cache, business, kind, change[5])
+            if op == "del":
+                conn.execute("DELETE FROM cells WHERE scenario = ? AND business = ? AND yyyymm = ? AND label_id = ?", (scenario, business, yyyymm, label_id))
+            elif op == "set":
+                conn.execute("""INSERT INTO cells (scenario, business, yyyymm, ym, label_id, position, value, rest_value)
+                                VALUES (?, ?, ?, ?, ?, (SELECT COUNT(*) FROM cells WHERE scenario = ? AND business = ? AND yyyymm = ?), ?, ?)
+                                ON CONFLICT (scenario, business, yyyymm, label_id) DO UPDATE SET value = excluded.value, rest_value = excluded.rest_value""",
+                             (scenario, business, yyyymm, to_ym(yyyymm), label_id, scenario, business, yyyymm, change[6], change[7]))
+
+    def query_values(self, scenario: str, business: str, start: str, end: str, kind: Union[str, None] = None) -> Dict[str, list[dict]]:
+        """指定した期間(start〜endの年月を含む)の値を、全体を読み込まずに取り出す
+        Returns:
+            Dict[str, list[dict]]: key = yyyymm, value = [{"kind": ..., "label": [...], "value": ..., "rest_value": ...}, ...]
+        """
+        conn = self.connect()
+        sql = """SELECT c.yyyymm, l.kind, l.key, c.value, c.rest_value FROM cells c JOIN labels l ON c.label_id = l.label_id
+                 WHERE c.scenario = ? AND c.business = ? AND c.ym BETWEEN ? AND ?"""
+        params = [scenario, business, to_ym(start), to_ym(end)]
+        if kind is not None:
+            sql += " AND l.kind = ?"
+            params.append(kind)
+        result = dict()
+        for yyyymm, kind, key, value, rest_value in conn.execute(sql + " ORDER BY c.ym, c.position", params):
+            result.setdefault(yyyymm, []).append({"kind": kind, "label": json.loads(key), "value": value, "rest_value": rest_value})
+        return result
+
+    def aggregate(self, header_row: list[str]) -> Aggregation:
+        """表に出す集計値をSQLのGROUP BYで計算する(保存した後に呼ぶこと)"""
+        conn = self.connect()
+        result = Aggregation(None, header_row)
+        yms = list(map(to_ym, result.months))
+        if len(yms) == 0:
+            return result
+        where = "c.ym IN ({}) AND c.value IS NOT NULL AND typeof(c.value) IN ('integer', 'real')".format(",".join(map(str, yms)))
+        base = "FROM cells c JOIN labels l ON c.label_id = l.label_id WHERE " + where
+
+        for typ, business, yyyymm, total in conn.execute(f"SELECT c.scenario, c.business, c.yyyymm, SUM(c.value) {base} AND l.kind = 'profit' GROUP BY 1, 2, 3"):
+            result.sales.setdefault(typ, {}).setdefault(business, {})[yyyymm] = total
+        for typ, yyyymm, name, total in conn.execute(f"SELECT c.scenario, c.yyyymm, l.name, SUM(c.value) {base} AND l.kind = 'profit' GROUP BY 1, 2, 3"):
+            result.profit.setdefault(typ, {}).setdefault(yyyymm, {})[name] = total
+        for typ, business, yyyymm, fixval, total in conn.execute(f"SELECT c.scenario, c.business, c.yyyymm, l.fixval, SUM(c.value) {base} AND l.kind = 'loss' GROUP BY 1, 2, 3, 4"):
+            result.fixval.setdefault(typ, {}).setdefault(business, {}).setdefault(yyyymm, {})[fixval] = total
+        for typ, business, yyyymm, category, total in conn.execute(f"SELECT c.scenario, c.business, c.yyyymm, l.category, SUM(c.value) {base} AND l.kind = 'loss' GROUP BY 1, 2, 3, 4"):
+            result.category.setdefault(typ, {}).setdefault(business, {}).setdefault(yyyymm, {})[category] = total
+        for typ, yyyymm, grp, total in conn.execute(f"SELECT c.scenario, c.yyyymm, l.grp, SUM(COALESCE(c.rest_value, c.value)) {base} AND l.kind = 'loss' GROUP BY 1, 2, 3"):
+            result.group.setdefault(typ, {}).setdefault(yyyymm, {})[grp] = total
+
+        # 利益は、Aggregationと同じ順番(事業の順に、売上の行、経費の行の順)で符号を付けた値を一つずつ足す
+        # (売上項目ごと、経費グループごとの合計から計算すると、足す順番が変わって小数の結果がずれる)
+        signed = "CASE l.kind WHEN 'profit' THEN c.value ELSE -COALESCE(c.rest_value, c.value) END"
+        order = "c.scenario, c.ym, b.position IS NULL, b.position, c.business, l.kind = 'loss', c.position"
+        sql = f"""SELECT c.scenario, c.yyyymm, {signed} FROM cells c JOIN labels l ON c.label_id = l.label_id LEFT JOIN businesses b ON c.business = b.business
+                  WHERE {where} AND l.kind IN ('profit', 'loss') ORDER BY {order}"""
+        for typ, yyyymm, value in conn.execute(sql):
+            earnings = result.earnings.setdefault(typ, {})
+            earnings[yyyymm] = earnings.get(yyyymm, 0) + value
+        result.calculate_variable_ratio()
+        return result
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+def _label_columns(kind: str, label: Union[list, tuple]) -> dict:
+    """行ラベルのタプルを、labelsテーブルの列の値にする"""
+    if kind == "loss":
+        return {"name": None, "grp": label[0], "account": label[1], "category": label[2]}
+    return {"name": label[0], "grp": None, "account": None, "category": None}
@@ -0,0 +1,302 @@
+from typing import Union, Tuple, Callable
+import os
+import json
+import datetime
+
+from pldata import ProfitData, LossData, ProfitDataItem, LossDataItem, MonthlyData, LabelManager, LazyMonths, convert_proc
+from common import convert_from_yyyymm, write_atomically
+from columnar import SCENARIOS, KINDS
+
+
+STORE_FILE = "store.json"
+STORE_VERSION = 2  # 書き出すstore.jsonの形式。versionがないものは1として読み込む
+
+# 読み込む期間を決める関数(configを受け取り、期初と期末のdatetimeを返す)。Noneなら全ての月を読み込む
+PeriodFunc = Union[Callable[[dict], Tuple[datetime.datetime, datetime.datetime]], None]
+
+
+class JsonStorage:
+    """データストアをstore.jsonに丸ごと読み書きする
+    読み込みは形式(version)を見分けて行い、書き出しは常にSTORE_VERSIONの形式で行う(v1のファイルは次の保存でv2になる)
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.path = os.path.join(directory, STORE_FILE)
+
+    def load(self, period: PeriodFunc = None) -> Tuple[dict, LabelManager]:
+        """
+        Args:
+            period (PeriodFunc): 指定すると、その期間の外の月はアクセスされるまでJSONのままにしておく
+        """
+        if not os.path.exists(self.path):
+            return {}, LabelManager()
+        with open(self.path) as f:
+            raw = json.load(f)
+        return decode_data_store(raw, period)
+
+    def save(self, data_store: dict):
+        write_json_atomically(self.path, data_store)
+
+
+def read_data_store(directory: str) -> Tuple[dict, LabelManager]:
+    return JsonStorage(directory).load()
+
+
+def decode_data_store(data_store: dict, period: PeriodFunc = None) -> Tuple[dict, LabelManager]:
+    """JSONから読み込んだままのデータストアの中身を、クラスオブジェクトに変換する
+    v1(月ごとに行ラベル付きの行のリスト)とv2(行ラベルの表と、月ごとの値の並び)のどちらでもよい
+    periodを指定すると、期間外の月はLazyMonthsの中にJSONのまま残しておく(v2の月はMonthVectorにしておく)
+    """
+    version = data_store.pop("version", 1)
+    tables = data_store.pop("labels", {}) if version >= 2 else None
+    mgr = LabelManager()
+    loaded = None
+    if period is not None:
+        start_dt, end_dt = period(data_store.get("config", {}))
+        loaded = lambda yyyymm: start_dt <= convert_from_yyyymm(yyyymm) <= end_dt
+
+    # JSONデータ内の表定義の情報をクラスオブジェクトに変更する
+    for business, conf in data_store["definition"].items():
+        for i in range(len(conf["profit"])):
+            conf["profit"][i] = ProfitDataItem(**conf["profit"][i])
+            mgr.add(business, "profit", conf["profit"][i])
+        for i in range(len(conf["loss"])):
+            conf["loss"][i] = LossDataItem(**conf["loss"][i])
+            mgr.add(business, "loss", conf["loss"][i])
+
+    if tables is not None:
+        return _decode_vectors(data_store, tables, mgr, loaded), mgr
+
+    # JSONデータ内の計画情報/実績情報を月毎のMonthlyDataオブジェクトに変更する
+    for typ in SCENARIOS:
+        if typ not in data_store: continue
+        for business, data in data_store[typ].items():
+            for kind in KINDS:
+                # 利益はdata.updateで計算し直すが、前回保存した値と比べられるようにオブジェクトにしておく
+                if kind == "earnings" and kind not in data: continue
+                decoder = _make_decoder(business, kind, mgr)
+                if loaded is None:
+                    data[kind] = {yyyymm: decoder(yyyymm, monthly_data) for yyyymm, monthly_data in data.get(kind, {}).items()}
+                else:
+                    data[kind] = LazyMonths(decoder, data.get(kind, {}), loaded)
+    return data_store, mgr
+
+
+def _make_decoder(business: str, kind: str, mgr: LabelManager) -> Callable[[str, list[dict]], MonthlyData]:
+    return lambda yyyymm, monthly_data: decode_monthly_data(business, kind, yyyymm, monthly_data, mgr)
+
+
+def _decode_vectors(data_store: dict, tables: dict, mgr: LabelManager, loaded: Union[Callable[[str], bool], None]) -> dict:
+    """v2の月ごとの値の並びをMonthlyDataに変換する。行ラベルは事業、種類ごとの表で一度だけ解決する"""
+    items = dict()  # key = (事業, 種類), value = 行ラベルの表と同じ並びのItem(解決できなかったものはNone)
+    for typ in SCENARIOS:
+        if typ not in data_store: continue
+        for business, data in data_store[typ].items():
+            for kind in KINDS:
+                if kind == "earnings" and kind not in data: continue
+                labels = tables.get(business, {}).get(kind, [])
+                if (business, kind) not in items:
+                    if kind == "earnings":
+                        items[(business, kind)] = [mgr.intern(business, kind, ProfitDataItem(label[0])) for label in labels]
+                    else:
+                        items[(business, kind)] = mgr.resolve_many(business, kind, labels)
+                decoder = _make_vector_decoder(kind, items[(business, kind)])
+                months = data.get(kind, {})
+                if loaded is None:
+                    data[kind] = {yyyymm: decoder(yyyymm, entry) for yyyymm, entry in months.items()}
+                else:
+                    data[kind] = LazyMonths(decoder, {yyyymm: MonthVector(kind, labels, entry) for yyyymm, entry in months.items()}, loaded)
+    return data_store
+
+
+def _make_vector_decoder(kind: str, items: list) -> Callable[[str, any], MonthlyData]:
+    return lambda yyyymm, entry: decode_month_vector(kind, yyyymm, entry.entry if isinstance(entry, MonthVector) else entry, items)
+
+
+def decode_month_vector(kind: str, yyyymm: str, entry: Union[list, dict], items: list) -> MonthlyData:
+    """v2の一月分の値の並びをMonthlyDataに変換する
+    entryはリスト(行ラベルの表の先頭から順に並んだ値)か、{"values": 値, "ids": 行ラベルの番号, "rest": 按分した残り}
+    (idsがなければ表の先頭から順、restがなければ全てNone)
+    """
+    values, ids, rests = _unpack_vector(entry)
+    if kind != "loss":
+        return MonthlyData(yyyymm, [ProfitData(items[i], value) for i, value in zip(ids, values)])
+    rows = [LossData(items[i], value) for i, value in zip(ids, values)]
+    if rests is not None:
+        for d, rest_value in zip(rows, rests):
+            if rest_value is not None:
+                d.rest_value = rest_value
+    return MonthlyData(yyyymm, rows)
+
+
+def _unpack_vector(entry: Union[list, dict]) -> Tuple[list, Union[list, range], Union[list, None]]:
+    """v2の一月分の値の並びを(値, 行ラベルの番号, 按分した残り)にする"""
+    if isinstance(entry, list):
+        return entry, range(len(entry)), None
+    values = entry["values"]
+    return values, entry.get("ids", range(len(values))), entry.get("rest")
+
+
+class MonthVector:
+    """v2のstore.jsonから読み込んだままの一月分の値(--lazyで期間外の月として残しておくもの)
+    行ラベルの表を持っているので、v1の行のリストと同じように列挙でき、convert_procでv1の形で書き出せる
+    v2で書き出す時は、同じ表を使っていればそのまま書き出す
+    """
+    __slots__ = ("kind", "labels", "entry")
+
+    def __init__(self, kind: str, labels: list[list], entry: Union[list, dict]):
+        self.kind = kind
+        self.labels = labels
+        self.entry = entry
+
+    def __iter__(self):
+        return iter(self.list_monthly_data())
+
+    def __len__(self) -> int:
+        return len(self.entry if isinstance(self.entry, list) else self.entry["values"])
+
+    def list_monthly_data(self) -> list[dict]:
+        return vector_to_rows(self.kind, self.labels, self.entry)
+
+
+def vector_to_rows(kind: str, labels: list[list], entry: Union[list, dict]) -> list[dict]:
+    """v2の一月分の値の並びを、v1の行のリストにする"""
+    values, ids, rests = _unpack_vector(entry)
+    if kind != "loss":
+        return [{"label": labels[i], "value": value} for i, value in zip(ids, values)]
+    rests = rests if rests is not None else [None] * len(values)
+    return [{"label": labels[i], "value": value, "rest_value": rest_value} for i, value, rest_value in zip(ids, values, rests)]
+
+
+def encode_data_store(data_store: dict) -> dict:
+    """v1の形でjson.dumpに渡せるようにする(LazyMonthsのJSONのままの月も含めて書き出すため、普通の辞書に置き換える)"""
+    result = dict(data_store)
+    for typ in SCENARIOS:
+        if typ not in data_store: continue
+        result[typ] = dict()
+        for business, data in data_store[typ].items():
+            result[typ][business] = {kind: dict(months.all_items()) if hasattr(months, "all_items") else months for kind, months in data.items()}
+    return result
+
+
+def encode_data_store_v2(data_store: dict) -> dict:
+    """v2の形でjson.dumpに渡せるようにする
+    行ラベルは事業、種類ごとの表(計画と実績で共通)に一度だけ書き、月ごとには表の番号の順に値だけを書く
+    月の行はMonthlyData、v1の行のリスト、SnapshotBlock、MonthVectorのどれでもよい
+    """
+    result = {"version": STORE_VERSION}
+    result.update((key, value) for key, value in data_store.items() if key not in SCENARIOS)
+    tables = result["labels"] = dict()
+    scenarios = [typ for typ in data_store.keys() if typ in SCENARIOS]
+    for typ in scenarios:
+        result[typ] = {business: dict() for business in data_store[typ].keys()}
+
+    businesses = list(dict.fromkeys(business for typ in scenarios for business in data_store[typ].keys()))
+    for business in businesses:
+        kinds = list(dict.fromkeys(kind for typ in scenarios for kind in data_store[typ].get(business, {}).keys()))
+        for kind in kinds:
+            months = [(typ, data_store[typ][business][kind]) for typ in scenarios if kind in data_store[typ].get(business, {})]
+            months = [(typ, m.all_items() if hasattr(m, "all_items") else list(m.items())) for typ, m in months]
+            table = _LabelTable(next((rows.labels for _, items in months for _, rows in items if isinstance(rows, MonthVector)), []))
+            for typ, items in months:
+                result[typ][business][kind] = {yyyymm: table.encode(kind, rows) for yyyymm, rows in items}
+            tables.setdefault(business, {})[kind] = table.labels
+    return result
+
+
+class _LabelTable:
+    """v2で書き出す、一つの事業、種類の行ラベルの表。新しい行ラベルは後ろに足していく"""
+
+    def __init__(self, labels: list[list]):
+        # 読み込んだままの月(MonthVector)は読み込んだ時の表の番号で書かれているので、その表から始める
+        self.source = labels
+        self.labels = list(labels)
+        self.ids = dict()  # key = 行ラベルのタプル, value = 番号
+        for i, label in enumerate(self.labels):
+            self.ids.setdefault(tuple(label), i)
+
+    def id(self, label: Union[tuple, list]) -> int:
+        key = tuple(label)
+        i = self.ids.get(key)
+        if i is None:
+            i = self.ids[key] = len(self.labels)
+            self.labels.append(list(key))
+        return i
+
+    def encode(self, kind: str, rows: any) -> Union[list, dict]:
+        if isinstance(rows, MonthVector) and rows.labels is self.source:
+            return rows.entry
+        ids, values, rests = list(), list(), list()
+        if hasattr(rows, "rows"):
+            for r in rows.rows:
+                if r.label is None:
+                    continue
+                ids.append(self.id(r.label.tuple()))
+                values.append(r.value)
+                rests.append(getattr(r, "rest_value", None))
+        else:
+            for r in (rows if isinstance(rows, list) else convert_proc(rows)):
+                ids.append(self.id(r["label"]))
+                values.append(r["value"])
+                rests.append(r.get("rest_value"))
+
+        # 表の先頭から順に並んでいて按分した残りがなければ、値のリストだけを書く
+        if ids == list(range(len(ids))) and all(rest_value is None for rest_value in rests):
+            return values
+        entry = {"values": values}
+        if ids != list(range(len(ids))):
+            entry["ids"] = ids
+        if kind == "loss" and any(rest_value is not None for rest_value in rests):
+            entry["rest"] = rests
+        return entry
+
+
+def as_v1(raw: dict) -> dict:
+    """JSONから読み込んだままのデータストアを、v1の形(月ごとに行ラベル付きの行のリスト)にする。v1ならそのまま返す"""
+    if raw.get("version", 1) < 2:
+        return raw
+    tables = raw.get("labels", {})
+    result = {key: value for key, value in raw.items() if key not in ["version", "labels"]}
+    for typ in SCENARIOS:
+        if typ not in raw: continue
+        result[typ] = {business: {kind: {yyyymm: vector_to_rows(kind, tables.get(business, {}).get(kind, []), entry) for yyyymm, entry in months.items()}
+                                  for kind, months in data.items()}
+                       for business, data in raw[typ].items()}
+    return result
+
+
+def decode_monthly_data(business: str, kind: str, yyyymm: str, monthly_data: list[dict], mgr: LabelManager) -> MonthlyData:
+    """JSONの一月分の行のリストをMonthlyDataに変換する"""
+    if hasattr(monthly_data, "list_monthly_data"):
+        # SnapshotBlockやMonthVectorは列挙するたびに行を作るので、一度だけ取り出す
+        monthly_data = monthly_data.list_monthly_data()
+    if kind == "earnings":
+        return MonthlyData(yyyymm, list(map(lambda x: ProfitData(mgr.intern(business, kind, ProfitDataItem(x["label"][0])), x["value"]), monthly_data)))
+    labels = mgr.resolve_many(business, kind, map(lambda x: x["label"], monthly_data))
+    if kind == "profit":
+        return MonthlyData(yyyymm, list(map(lambda x, label: ProfitData(label, x["value"]), monthly_data, labels)))
+    return MonthlyData(yyyymm, list(map(_make_loss_data, monthly_data, labels)))
+
+
+def _make_loss_data(x: dict, label: LossDataItem) -> LossData:
+    d = LossData(label, x["value"])
+    if "rest_value" in x and x["rest_value"] is not None:
+        d.rest_value = x["rest_value"]
+    return d
+
+
+def write_json_atomically(path: str, data_store: dict, version=STORE_VERSION):
+    """一時ファイルに書き出してから置き換える（途中で失敗しても元のファイルを壊さない）"""
+    def write(tmp_path: str):
+        with open(tmp_path, "w") as f:
+            json.dump(encode_data_store_v2(data_store) if version >= 2 else encode_data_store(data_store), f, default=convert_proc)
+    write_atomically(path, write)
+
+
+def convert_store(directory: str, version: int):
+    """store.jsonを指定した形式で書き直す(v1に戻すのは、古いバージョンのツールで読むため)"""
+    path = os.path.join(directory, STORE_FILE)
+    with open(path) as f:
+        raw = json.load(f)
+    write_json_atomically(path, as_v1(raw), version)
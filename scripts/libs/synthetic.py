@@ -0,0 +1,131 @@
+from typing import Union
+import os
+import json
+import random
+import datetime
+import openpyxl
+from dateutil.relativedelta import relativedelta
+
+from . import common, config, data, build_table
+from pldata import ProfitData, LossData, MonthlyData, LabelManager
+from storage import JsonStorage
+
+
+DATASET_FILE = "dataset.json"  # 生成したときのパラメータ(ベンチマークの結果に含める)
+SETTLEMENT_MONTH = 3
+COMMON = "全社共通"
+
+GROUPS = ["販管費", "売上原価"]
+ACCOUNTS = ["人件費", "出張費", "外注費", "家賃", "通信費", "物品費", "広告宣伝費", "設備費", "サーバ費", "開発費", "その他"]
+CATEGORIES = ["営業マーケ", "研究開発", "バックオフィス", "システム", "カスタマーサクセス"]
+FIXVALS = ["固定費", "変動費"]
+
+
+def generate_dataset(directory: str, businesses=10, profit_labels=5, loss_labels=20, years=3, common_share=0.5,
+                     end: Union[str, None] = None, seed=0) -> dict:
+    """ベンチマーク用のデータ(設定.xlsx、事業別ファイル、全社共通ファイル、store.json)を作る
+
+    Args:
+        directory (str): 書き出すディレクトリ(なければ作る)
+        businesses (int): 事業の数(全社共通は別)
+        profit_labels (int): 事業ごとの売上項目の数
+        loss_labels (int): 事業ごと(と全社共通)の経費項目の数。按分する勘定科目の項目は必ず含めるので、それより多くなることがある
+        years (int): 値を入れる期の数(endの期から遡る)
+        common_share (float): 全社共通の勘定科目のうち、各事業に按分するものの割合(0〜1)
+        end (Union[str, None]): 最後の期に含まれる年月(YYYYMM)。Noneなら今月
+        seed (int): 乱数のシード。同じパラメータとシードなら同じデータになる
+    Returns:
+        生成したデータのパラメータ(dataset.jsonに書き出したもの)
+    """
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+
+    end_dt = common.get_term_end_month(common.convert_from_yyyymm(end) if end is not None else datetime.datetime.today(), SETTLEMENT_MONTH)
+    start_dt = end_dt - relativedelta(months=12*years-1)
+
+    # 設定.xlsxを書き出して、いつも通りに読み込む
+    names = [f"事業{i+1:03d}" for i in range(businesses)]
+    _write_config_file(os.path.join(directory, "設定.xlsx"), names, profit_labels, loss_labels, common_share, rng)
+    store = dict()
+    label_mgr = LabelManager()
+    config.read_config_file(os.path.join(directory, "設定.xlsx"), store, label_mgr)
+
+    # 全ての月に値を入れる
+    months = list(filter(lambda x: "決算" not in x, common.create_header_labels(start_dt, end_dt, SETTLEMENT_MONTH)))
+    for typ in ["plan", "performance"]:
+        for business, definitions in store["definition"].items():
+            profit = [item for item in definitions["profit"] if item.name is not None]
+            loss = [item for item in definitions["loss"] if item.account is not None]
+            store.setdefault(typ, {})[business] = {
+                "profit": {yyyymm: MonthlyData(yyyymm, [ProfitData(item, rng.randint(1, 1000) * 1000) for item in profit]) for yyyymm in months},
+                "loss": {yyyymm: MonthlyData(yyyymm, [LossData(item, rng.randint(1, 500) * 1000) for item in loss]) for yyyymm in months},
+            }
+
+    # 按分して保存し、全ての期間の事業別ファイルと全社統合版を書き出す
+    data.update(store)
+    JsonStorage(directory).save(store)
+    build_table.build_business_books(directory, store, start_dt, end_dt)
+    build_table.create_pl_book(directory, store, start_dt, end_dt)
+
+    manifest = {"businesses": businesses, "profit_labels": profit_labels, "loss_labels": loss_labels, "years": years,
+                "common_share": common_share, "seed": seed, "start": months[0], "end": months[-1], "months": len(months)}
+    with open(os.path.join(directory, DATASET_FILE), "w") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+
+def _write_config_file(path: str, names: list[str], profit_labels: int, loss_labels: int, common_share: float, rng: random.Random):
+    """設定.xlsxを書き出す(シートの形はsamples/設定.xlsxと同じ)"""
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "設定"
+    ws.append(["設定項目", "値"])
+    ws.append(["決算月", SETTLEMENT_MONTH])
+
+    # 全社共通の勘定科目のうち、common_shareの割合を各事業に按分する
+    common_loss = _make_loss_items(loss_labels, [], rng)
+    accounts = list(dict.fromkeys(item[1] for item in common_loss))
+    divided = accounts[:round(len(accounts) * common_share)] if len(names) > 0 else []
+    _append_item_sheet(wb, COMMON, [["その他", "雑収入"]], [item + [None] for item in common_loss])
+
+    # 按分率は事業の数で等分し、端数は最後の事業に寄せる(合計がちょうど1になるようにする)
+    ratio = round(1 / len(names), 4) if len(names) > 0 else 0
+    for i, name in enumerate(names):
+        r = ratio if i < len(names) - 1 else round(1 - ratio * (len(names) - 1), 10)
+        shared = [["販管費", account, "バックオフィス", "固定費", r] for account in divided]
+        loss = shared + [item + [None] for item in _make_loss_items(loss_labels - len(shared), divided, rng)]
+        profit = [[f"{name}サービス{k+1}", None] for k in range(profit_labels)]
+        _append_item_sheet(wb, name, profit, loss)
+    wb.save(path)
+
+
+def _make_loss_items(count: int, excluded_accounts: list[str], rng: random.Random) -> list[list]:
+    """重複しない[経費グループ, 勘定科目, カテゴリ, 固定費/変動費]をcount個作る(excluded_accountsの勘定科目は使わない)"""
+    accounts = [a for a in ACCOUNTS if a not in excluded_accounts]
+    candidates = [[g, a, c] for g in GROUPS for a in accounts for c in CATEGORIES]
+    rng.shuffle(candidates)
+    k = 0
+    while len(candidates) < count:
+        # 組み合わせが足りなければ勘定科目を増やす
+        candidates.extend([g, f"経費{k:03d}", c] for g in GROUPS for c in CATEGORIES)
+        k += 1
+    return [item + [rng.choice(FIXVALS)] for item in candidates[:max(count, 0)]]
+
+
+def _append_item_sheet(wb: any, name: str, profit: list[list], loss: list[list]):
+    """売上項目と経費項目のシートを追加する。列は 売上項目,備考,(空),(空),経費グループ,勘定科目,カテゴリ,固定費/変動費,按分率,備考"""
+    ws = wb.create_sheet(name)
+    ws.append(["売上項目", "備考", None, None, "経費グループ", "勘定科目", "カテゴリ", "固定費/変動費", "事業全体に対する按分率", "備考"])
+    for i in range(max(len(profit), len(loss))):
+        p = profit[i] if i < len(profit) else [None, None]
+        l = loss[i] if i < len(loss) else [None] * 5
+        ws.append(p + [None, None] + l + [None])
+
+
+def read_manifest(directory: str) -> Union[dict, None]:
+    path = os.path.join(directory, DATASET_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
@@ -7,7 +7,17 @@ import datetime
 from argparse import ArgumentParser
 
 sys.path.append("./libs")
-from libs import config, data, build_table, pldata, common
+from libs import config, data, build_table, pldata, common, storage, journal, sqlite_storage, snapshot, parse_cache, book_state
+from excel import table
+import profiler  # 回数はlibs/の下のモジュールと同じprofilerで数えるので、libs.profilerとしては読み込まない
+
+# データストアの保存方式
+STORAGES = {
+    "json": storage.JsonStorage,        # store.jsonを毎回丸ごと書き直す
+    "journal": journal.JournalStorage,  # 変更分だけをstore.journalに追記し、ときどきstore.jsonにまとめる
+    "sqlite": sqlite_storage.SqliteStorage,  # store.sqlite3に変更分だけを書き込む
+    "snapshot": snapshot.SnapshotStorage,  # store.plsnap(バイナリ)をmmapで読み込む
+}
 
 
 def _parser():
@@ -17,6 +27,22 @@ def _parser():
     argparser.add_argument('-c', '--create', action="store_true", default=False, help='create/update profit/loss excel files')
     argparser.add_argument('-s', '--start', type=str, help='start month (YYYYMM)')
     argparser.add_argument('-e', '--end', type=str, help='end month (YYYYMM)')
+    argparser.add_argument('--reparse', action="store_true", default=False, help='parse all excel files again even if they have not changed')
+    argparser.add_argument('--rebuild', action="store_true", default=False, help='rewrite all excel files even if their contents have not changed')
+    argparser.add_argument('--write-only', action="store_true", default=False, help='write excel files in streaming (write-only) mode to save memory')
+    argparser.add_argument('-j', '--jobs', type=int, default=1, help='number of processes to read and write excel files in parallel')
+    argparser.add_argument('--totals', type=str, choices=table.TOTALS, default=table.TOTALS_FORMULA,
+                           help='write totals as SUM formulas, computed values, or both (formulas with cached values)')
+    argparser.add_argument('--storage', type=str, choices=STORAGES.keys(), default="json", help='how to save the data store')
+    argparser.add_argument('--lazy', action="store_true", default=False, help='decode only the months in the period (-s/-e) from the data store')
+    argparser.add_argument('--profile', type=str, nargs="?", const="", default=None,
+                           help='record time and counts per phase and per workbook to a JSON file (default: DIRECTORY/profile.json)')
+    argparser.add_argument('--memory', action="store_true", default=False,
+                           help='also record memory usage (tracemalloc and peak RSS) per phase and per workbook to the --profile report')
+    argparser.add_argument('--memory-budget', type=float, default=None,
+                           help='stop with a report of the top allocation sites when the peak RSS exceeds this size (MB)')
+    argparser.add_argument('--cprofile', type=str, default=None, help='dump cProfile stats of the main process to this file (with --profile)')
+    argparser.add_argument('--compact', action="store_true", default=False, help='compact the journal into store.json (with --storage journal)')
     return argparser.parse_args()
 
 
@@ -40,44 +66,6 @@ def calc_period(start: str, end: str, data_store: dict):
     return start_dt, end_dt
 
 
-def read_data_store(directory: str) -> tuple[dict, pldata.LabelManager]:
-    mgr = pldata.LabelManager()
-    file_path = os.path.join(directory, "store.json")
-    if not os.path.exists(file_path):
-        return {}, mgr
-
-    # JSONデータ内の表定義の情報をクラスオブジェクトに変更する
-    with open(file_path) as f:
-        data_store = json.load(f)
-
-    for business, conf in data_store["definition"].items():
-        for i in range(len(conf["profit"])):
-            conf["profit"][i] = pldata.ProfitDataItem(**conf["profit"][i])
-            mgr.add(business, "profit", conf["profit"][i])
-        for i in range(len(conf["loss"])):
-            conf["loss"][i] = pldata.LossDataItem(**conf["loss"][i])
-            mgr.add(business, "loss", conf["loss"][i])
-
-    # JSONデータ内の計画情報/実績情報を月毎のMonthlyDataオブジェクトに変更する
-    for typ in ["plan", "performance"]:
-        if typ not in data_store: continue
-        for business, data in data_store[typ].items():
-            for yyyymm, monthly_data in data["profit"].items():
-                monthly_data_list = list(map(lambda x: pldata.ProfitData(mgr.get(business, "profit", name=x["label"][0]), x["value"]), monthly_data))
-                data["profit"][yyyymm] = pldata.MonthlyData(yyyymm, monthly_data_list)
-            for yyyymm, monthly_data in data["loss"].items():
-                monthly_data_list = list(map(lambda x: _make_loss_data(business, mgr, x), monthly_data))
-                data["loss"][yyyymm] = pldata.MonthlyData(yyyymm, monthly_data_list)
-    return data_store, mgr
-
-
-def _make_loss_data(business: str, mgr: pldata.LabelManager, x: dict) -> pldata.LossData:
-    d = pldata.LossData(mgr.get(business, "loss", group=x["label"][0], account=x["label"][1], category=x["label"][2]), x["value"])
-    if "rest_value" in x and x["rest_value"] is not None:
-        d.rest_value = x["rest_value"]
-    return d
-
-
 def get_file_paths(directory: str, data_store: dict) -> Union[str, list[str]]:
     """事業別ファイルと全社共通ファイルを読み込む"""
     result = list()
@@ -105,17 +93,45 @@ if __name__ == '__main__':
         print("XXX no such directory:", args.directory)
         sys.exit(-1)
     print("*** データディレクトリ：", args.directory)
+    if args.jobs < 1:
+        print("XXX --jobs must be 1 or more:", args.jobs)
+        sys.exit(-1)
+
+    if args.memory_budget is not None and args.memory_budget <= 0:
+        print("XXX --memory-budget must be more than 0:", args.memory_budget)
+        sys.exit(-1)
+
+    # --profileなら、処理ごとにかかった時間と回数を記録する(指定がなくても時間は計測するが、書き出さない。回数は数えない)
+    # --memoryか--memory-budgetなら、使ったメモリも調べる(--memoryは--profileも指定したことにする)
+    profiling = args.profile is not None or args.memory
+    memory = profiler.MemoryTracker(args.memory_budget) if args.memory or args.memory_budget is not None else None
+    prof = profiler.Profiler(args.cprofile if profiling else None, memory, count=profiling)
 
     # データストアファイル（過去の入力情報）を読み込む
-    store, label_mgr = read_data_store(args.directory)
+    with prof.phase("load_store"):
+        if args.storage == "journal":
+            backend = journal.JournalStorage(args.directory, compact=args.compact)
+        else:
+            backend = STORAGES[args.storage](args.directory)
+        if args.lazy:
+            # 集計期間の外の月は、アクセスされるまでJSONのままにしておく
+            store, label_mgr = backend.load(lambda conf: calc_period(args.start, args.end, {"config": conf}))
+        else:
+            store, label_mgr = backend.load()
+
+    # 前回から変わっていないエクセルファイルは、前回読み込んだ結果を使う
+    cache = parse_cache.ParseCache(args.directory, force=args.reparse)
 
     # 設定ファイルを読み込む
-    config.read_config_file(os.path.join(args.directory, "設定.xlsx"), store, label_mgr)
+    with prof.phase("read_config_file"):
+        config.read_config_file(os.path.join(args.directory, "設定.xlsx"), store, label_mgr, cache)
 
     # 事業別ファイル、全社共通ファイルを読み込む
-    files = get_file_paths(args.directory, store)
-    for fp in files:
-        start_dt, end_dt = data.read_data_file(fp, store, label_mgr)  # 戻り値はエクセルに含まれているデータの期間
+    # --jobsが2以上なら、複数のプロセスで同時に読み込む
+    with prof.phase("read_data_files"):
+        files = get_file_paths(args.directory, store)
+        start_dt, end_dt = data.read_data_files(files, store, label_mgr, cache, args.jobs)  # 戻り値は全てのエクセルに含まれているデータの期間
+        cache.save()
 
     # 集計期間を期初からにする。引数で与えられていたら、そちらの設定を優先する
     if args.start is not None or args.end is not None or start_dt is None or end_dt is None:
@@ -123,15 +139,40 @@ if __name__ == '__main__':
         print(">>>>>>>>", start_dt, end_dt)
 
     # 共通シートに記載された経費を按分して各事業に振り分ける
-    data.update(store)
+    with prof.phase("update"):
+        data.update(store)
 
     # データをJSONで保存する（過去の分も結合して保存する）
-    with open(os.path.join(args.directory, "store.json"), "w") as f:
-        json.dump(store, f, default=pldata.convert_proc)
+    with prof.phase("save_store"):
+        backend.save(store)
+
+    # 表に出す集計値を一度だけ計算して、事業別ファイルと全社統合版の両方で使う
+    with prof.phase("aggregate"):
+        header_row = common.create_header_labels(start_dt, end_dt, store["config"].get("決算月", 3))
+        if hasattr(backend, "aggregate"):
+            aggregation = backend.aggregate(header_row)  # 保存先のDBで集計する
+        else:
+            aggregation = data.aggregate(store, header_row)
 
     # 全社共通、事業別ファイルを生成または更新する
     # データストアファイル（jsonファイル）があり、入力済みデータがあるならそれもprofit,lossファイルに書き込む
-    build_table.build_business_books(args.directory, store, start_dt, end_dt)
+    # 前回書き出した時から内容が変わっていないファイルは書き直さない
+    # --jobsが2以上なら、事業別ファイルと全社統合版を別々のプロセスで同時に作る
+    state = book_state.BookState(args.directory, force=args.rebuild)
+    writer = build_table.BookWriter(state, args.jobs, prof if profiling or memory is not None else None)
+    with prof.phase("build_business_books"):
+        build_table.build_business_books(args.directory, store, start_dt, end_dt, aggregation, state, args.write_only, writer, args.totals)
 
     # 集計して一つの情報に統合し、全社統合版PL表エクセルを書き出す
-    build_table.create_pl_book(args.directory, store, start_dt, end_dt)
+    with prof.phase("create_pl_book"):
+        build_table.create_pl_book(args.directory, store, start_dt, end_dt, aggregation, state, args.write_only, writer, args.totals)
+    with prof.phase("wait_books"):
+        writer.wait()
+    state.save()
+
+    if profiling:
+        prof.stop()
+        path = args.profile if args.profile else os.path.join(args.directory, "profile.json")
+        print("*** プロファイル：", path)
+        for line in profiler.summarize(prof.save(path)):
+            print(line)
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# コマンドと同じく、libsの下のモジュールを直接importできるようにする
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SCRIPTS_DIR)
+sys.path.insert(0, os.path.join(SCRIPTS_DIR, "libs"))
@@ -0,0 +1,58 @@
+import os
+import datetime
+
+from dateutil.relativedelta import relativedelta
+
+from pldata import ProfitDataItem, LossDataItem, ProfitData, LossData, MonthlyData
+from libs import build_table
+import common
+
+
+def month_labels(start: str, count: int) -> list[str]:
+    """start(YYYYMM)から続くcount個の月のキー(YYYY/MM)"""
+    dt = datetime.datetime.strptime(start, "%Y%m")
+    return [(dt + relativedelta(months=i)).strftime("%Y/%m") for i in range(count)]
+
+
+def period(start: str, end: str):
+    """decode_data_storeなどに渡す、start〜end(YYYYMM)を読み込む期間の関数"""
+    return lambda config: (datetime.datetime.strptime(start, "%Y%m"), datetime.datetime.strptime(end, "%Y%m"))
+
+
+def make_store(months: list[str], businesses=("事業A", "全社共通")) -> dict:
+    """テスト用のデータストア。値には整数と小数の両方、全社共通の経費には按分した残りを入れる"""
+    store = {"config": {"決算月": 3}, "definition": {}, "plan": {}, "performance": {}}
+    for b, business in enumerate(businesses):
+        profit = [ProfitDataItem(f"{business}売上{i}", "") for i in range(2)]
+        loss = [LossDataItem("販管費", account, "営業", "固定費", None, None) for account in ["人件費", "家賃", "通信費"]]
+        store["definition"][business] = {"profit": profit, "loss": loss}
+        for t, typ in enumerate(["plan", "performance"]):
+            data = store[typ][business] = {"profit": {}, "loss": {}, "earnings": {}}
+            for m, yyyymm in enumerate(months):
+                data["profit"][yyyymm] = MonthlyData(yyyymm, [ProfitData(item, 1000 * (b + t + m + i + 1)) for i, item in enumerate(profit)])
+                rows = [LossData(item, 100.5 * (b + m + i + 1) if i == 1 else 100 * (t + m + i + 1)) for i, item in enumerate(loss)]
+                if business == "全社共通":
+                    rows[0].rest_value = 0
+                data["loss"][yyyymm] = MonthlyData(yyyymm, rows)
+                data["earnings"][yyyymm] = MonthlyData(yyyymm, [ProfitData(ProfitDataItem("利益"), 500 * (m + 1))])
+    return store
+
+
+def dump(data_store: dict) -> dict:
+    """比べるために、データストアの月の値を{(計画/実績, 事業, 種類, 月): [(行ラベル, 値, 按分した残り), ...]}にする"""
+    result = dict()
+    for typ in ["plan", "performance"]:
+        for business, data in data_store.get(typ, {}).items():
+            for kind, monthly in data.items():
+                for yyyymm in list(monthly.keys()) + list(getattr(monthly, "raw", {}).keys()):
+                    rows = monthly[yyyymm].rows
+                    result[(typ, business, kind, yyyymm)] = [(r.label.tuple(), r.value, getattr(r, "rest_value", None)) for r in rows if r.label is not None]
+    return result
+
+
+def make_books(directory: str, totals: str, write_only: bool):
+    """make_storeのデータで2024/04〜2025/03の事業ごとのブックをdirectoryに作る"""
+    start_dt, end_dt = datetime.datetime(2024, 4, 1), datetime.datetime(2025, 3, 1)
+    months = [m for m in common.create_header_labels(start_dt, end_dt, 3) if "決算" not in m]
+    os.makedirs(directory)
+    build_table.build_business_books(directory, make_store(months), start_dt, end_dt, write_only=write_only, totals=totals)
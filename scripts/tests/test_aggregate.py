@@ -0,0 +1,39 @@
+from aggregate import Aggregation
+
+from helpers import make_store, month_labels
+
+
+def test_aggregation_adds_rows_in_order():
+    months = month_labels("202404", 3)
+    data_store = make_store(months)
+    header_row = months + ["2025/3決算"]
+    result = Aggregation(data_store, header_row)
+
+    for typ in ["plan", "performance"]:
+        # 事業の順に、売上の行、経費の行(按分した残りがあればその値)の順に一つずつ足した値と同じになる
+        expected = dict()
+        for yyyymm in months:
+            earnings = 0
+            for data in data_store[typ].values():
+                for r in data["profit"][yyyymm].rows:
+                    earnings += r.value
+                for r in data["loss"][yyyymm].rows:
+                    earnings -= r.value if r.rest_value is None else r.rest_value
+            expected[yyyymm] = earnings
+        assert result.get_earnings(typ) == expected
+        assert result.get_fixval(typ, "事業A")["2024/04"] == {"固定費": sum(r.value for r in data_store[typ]["事業A"]["loss"]["2024/04"].rows)}
+        assert list(result.get_profit(typ)["2024/04"].keys()) == ["事業A売上0", "事業A売上1", "全社共通売上0", "全社共通売上1"]
+
+    # 整数だけの合計は整数のまま
+    assert all(isinstance(v, int) for v in result.get_profit("plan")["2024/04"].values())
+
+
+def test_aggregation_skips_empty_values_and_other_months():
+    months = month_labels("202404", 3)
+    data_store = make_store(months)
+    data_store["plan"]["事業A"]["profit"]["2024/04"].rows[0].value = None
+    result = Aggregation(data_store, months[1:] + ["2025/3決算"])
+    assert "2024/04" not in result.get_earnings("plan")
+    result = Aggregation(data_store, months + ["2025/3決算"])
+    assert "事業A売上0" not in result.get_profit("plan")["2024/04"]
+    assert result.get_profit("plan")["2024/04"]["事業A売上1"] == 2000
@@ -0,0 +1,33 @@
+import openpyxl
+import pytest
+
+from excel import table
+
+from helpers import make_books
+
+SIDES = ["left", "right", "top", "bottom"]
+
+
+def dump_sheet(ws) -> dict:
+    """セルごとの値、スタイル、表示形式、罫線と、結合、固定する位置、列の幅"""
+    cells = dict()
+    for row in ws.iter_rows():
+        for cell in row:
+            key = (cell.value, cell.style, cell.number_format, tuple(getattr(cell.border, side).style for side in SIDES))
+            if key != (None, "Normal", "General", (None,) * 4):
+                cells[cell.coordinate] = key
+    widths = {k: dim.width for k, dim in ws.column_dimensions.items() if dim.width}
+    return {"cells": cells, "merged": sorted(str(r) for r in ws.merged_cells.ranges), "freeze": ws.freeze_panes, "widths": widths}
+
+
+@pytest.mark.parametrize("totals", [table.TOTALS_FORMULA, table.TOTALS_VALUES])
+def test_write_only_books_match_normal_books(tmp_path, totals):
+    make_books(str(tmp_path / "normal"), totals, False)
+    make_books(str(tmp_path / "write_only"), totals, True)
+
+    for file_name in ["事業A.xlsx", "全社共通.xlsx"]:
+        normal = openpyxl.load_workbook(str(tmp_path / "normal" / file_name))
+        write_only = openpyxl.load_workbook(str(tmp_path / "write_only" / file_name))
+        assert write_only.sheetnames == normal.sheetnames
+        for ws in normal:
+            assert dump_sheet(write_only[ws.title]) == dump_sheet(ws)
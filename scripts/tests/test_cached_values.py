@@ -0,0 +1,43 @@
+import os
+
+import openpyxl
+import pytest
+
+from excel import table
+from excel.cached_values import inject_cached_values
+
+from helpers import make_books
+
+
+@pytest.mark.parametrize("write_only", [False, True])
+def test_totals_both_writes_cached_values(tmp_path, write_only):
+    make_books(str(tmp_path / "both"), table.TOTALS_BOTH, write_only)
+    make_books(str(tmp_path / "values"), table.TOTALS_VALUES, write_only)
+
+    count = 0
+    for file_name in ["事業A.xlsx", "全社共通.xlsx"]:
+        formulas = openpyxl.load_workbook(str(tmp_path / "both" / file_name))
+        cached = openpyxl.load_workbook(str(tmp_path / "both" / file_name), data_only=True)
+        values = openpyxl.load_workbook(str(tmp_path / "values" / file_name))
+        for ws in formulas:
+            for row in ws.iter_rows():
+                for cell in row:
+                    if not (isinstance(cell.value, str) and cell.value.startswith("=SUM(")):
+                        continue
+                    # 式はそのままで、キャッシュ値は--totals valuesで書き込む値と同じ
+                    assert cached[ws.title][cell.coordinate].value == values[ws.title][cell.coordinate].value
+                    count += 1
+    assert count > 0
+
+
+def test_missing_formula_cell_raises(tmp_path):
+    make_books(str(tmp_path / "both"), table.TOTALS_FORMULA, False)
+    path = str(tmp_path / "both" / "事業A.xlsx")
+    with open(path, "rb") as f:
+        before = f.read()
+    # A1は式のセルではない
+    with pytest.raises(ValueError):
+        inject_cached_values(path, {"計画": {(1, 1): 1}})
+    with open(path, "rb") as f:
+        assert f.read() == before
+    assert sorted(os.listdir(str(tmp_path / "both"))) == ["事業A.xlsx", "全社共通.xlsx"]
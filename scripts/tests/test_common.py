@@ -0,0 +1,35 @@
+import os
+
+import pytest
+
+from common import write_atomically
+
+
+def write_text(text: str):
+    def write(path: str):
+        with open(path, "w") as f:
+            f.write(text)
+    return write
+
+
+def test_write_atomically_replaces_the_file(tmp_path):
+    path = str(tmp_path / "a.json")
+    write_atomically(path, write_text("1"))
+    write_atomically(path, write_text("2"))
+    with open(path) as f:
+        assert f.read() == "2"
+    assert os.listdir(str(tmp_path)) == ["a.json"]
+
+
+def test_failed_write_keeps_the_file_and_removes_the_temporary_file(tmp_path):
+    path = str(tmp_path / "a.json")
+    write_atomically(path, write_text("1"))
+
+    def fail(tmp: str):
+        write_text("途中まで")(tmp)
+        raise ValueError("失敗")
+    with pytest.raises(ValueError):
+        write_atomically(path, fail)
+    with open(path) as f:
+        assert f.read() == "1"
+    assert os.listdir(str(tmp_path)) == ["a.json"]
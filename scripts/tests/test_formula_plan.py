@@ -0,0 +1,78 @@
+import openpyxl
+import pytest
+
+from excel.table import FormulaPlan, TOTALS_FORMULA, TOTALS_VALUES, TOTALS_BOTH
+
+# 1行目から3行目が値、4行目と4列目に合計を置く
+MATRIX = [
+    [1, 2.5, None],
+    [10, "x", 3],
+    [100, True, 0.5],
+]
+
+
+def cell_value(row: int, column: int):
+    if row <= len(MATRIX) and column <= len(MATRIX[0]):
+        return MATRIX[row-1][column-1]
+    return None
+
+
+def make_plan() -> FormulaPlan:
+    plan = FormulaPlan()
+    for column in range(1, 4):
+        plan.add_sum(4, column, (1, column), (3, column), None)
+    for row in range(1, 5):
+        plan.add_sum(row, 4, (row, 1), (row, 3), None)
+    return plan
+
+
+def test_add_sum_keeps_one_formula_per_cell():
+    plan = make_plan()
+    assert len(plan) == 7
+    assert plan.formula_at(4, 1) == "=SUM(A1:A3)"
+    assert plan.formula_at(2, 4) == "=SUM(A2:C2)"
+    plan.add_sum(4, 1, (2, 1), (3, 1), None)
+    assert len(plan) == 7
+    assert plan.formula_at(4, 1) == "=SUM(A2:A3)"
+    assert plan.formula_at(5, 5) is None
+
+
+def test_evaluate_sums_numbers_and_other_formulas():
+    values = make_plan().evaluate(cell_value)
+    # 文字列、真偽値、空のセルは足さない
+    assert values[(4, 1)] == 111
+    assert values[(4, 2)] == 2.5
+    assert values[(4, 3)] == 3.5
+    assert values[(1, 4)] == 3.5
+    assert values[(2, 4)] == 13
+    # 合計行の合計は、先に計算した合計の式の値を足す
+    assert values[(4, 4)] == 111 + 2.5 + 3.5
+    assert isinstance(values[(4, 1)], int)
+
+
+def test_evaluate_detects_cycles():
+    plan = FormulaPlan()
+    plan.add_sum(1, 1, (1, 2), (1, 2), None)
+    plan.add_sum(1, 2, (1, 1), (1, 1), None)
+    with pytest.raises(ValueError):
+        plan.evaluate(cell_value)
+
+
+@pytest.mark.parametrize("totals", [TOTALS_FORMULA, TOTALS_VALUES, TOTALS_BOTH])
+def test_write(totals):
+    ws = openpyxl.Workbook().active
+    for row, values in enumerate(MATRIX, start=1):
+        for column, value in enumerate(values, start=1):
+            ws.cell(row=row, column=column, value=value)
+    plan = make_plan()
+    expected = plan.evaluate(cell_value)
+
+    result = plan.write(ws, totals)
+    assert len(plan) == 0
+    assert result == (expected if totals == TOTALS_BOTH else {})
+    for (row, column), value in expected.items():
+        if totals == TOTALS_VALUES:
+            assert ws.cell(row=row, column=column).value == value
+        else:
+            assert ws.cell(row=row, column=column).value.startswith("=SUM(")
+    assert ws.cell(row=2, column=2).value == "x"
@@ -0,0 +1,142 @@
+import os
+import json
+import datetime
+
+from pldata import ProfitData, MonthlyData
+from storage import JsonStorage
+from journal import JournalStorage, JOURNAL_FILE, COMPACT_RECORDS
+
+from helpers import make_store, month_labels, dump
+
+MONTHS = month_labels("202404", 36)
+
+
+def setup_store(directory: str):
+    JsonStorage(directory).save(make_store(MONTHS))
+
+
+def reload(directory: str, **kwargs) -> dict:
+    data_store, _ = JournalStorage(directory, **kwargs).load()
+    return data_store
+
+
+def journal_lines(directory: str) -> list[str]:
+    path = os.path.join(directory, JOURNAL_FILE)
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return f.readlines()
+
+
+def test_round_trip_with_all_operations(tmp_path):
+    directory = str(tmp_path)
+    setup_store(directory)
+    backend = JournalStorage(directory)
+    data_store, _ = backend.load()
+
+    business = data_store["plan"]["事業A"]
+    business["profit"]["2024/04"].rows[0].value = 1.25                      # set(値の変更)
+    del business["loss"]["2024/05"].rows[1]                                  # del
+    business["loss"].pop("2024/06")                                          # drop
+    item = business["profit"]["2024/04"].rows[1].label
+    business["profit"]["2027/04"] = MonthlyData("2027/04", [ProfitData(item, 7)])  # month + set
+    business["profit"]["2027/05"] = MonthlyData("2027/05", [])              # 行のない月
+    data_store["performance"]["全社共通"]["loss"]["2024/04"].rows[0].rest_value = 10
+    backend.save(data_store)
+
+    lines = journal_lines(directory)
+    assert len(lines) == 1
+    ops = {change[0] for change in json.loads(lines[0])["changes"]}
+    assert ops == {"set", "del", "drop", "month"}
+
+    loaded = reload(directory)
+    assert dump(loaded) == dump(data_store)
+    assert "2024/06" not in loaded["plan"]["事業A"]["loss"]
+    assert loaded["plan"]["事業A"]["profit"]["2027/05"].rows == []
+    assert type(loaded["plan"]["事業A"]["profit"]["2024/04"].rows[0].value) is float
+    assert type(loaded["plan"]["事業A"]["profit"]["2027/04"].rows[0].value) is int
+
+    # 変更がなければ何も追記しない
+    backend = JournalStorage(directory)
+    backend.save(backend.load()[0])
+    assert len(journal_lines(directory)) == 1
+
+
+def save_value(directory: str, value: any, **kwargs):
+    backend = JournalStorage(directory, **kwargs)
+    data_store, _ = backend.load()
+    data_store["plan"]["事業A"]["profit"]["2024/04"].rows[0].value = value
+    backend.save(data_store)
+
+
+def test_truncated_last_line_is_ignored(tmp_path, capsys):
+    directory = str(tmp_path)
+    setup_store(directory)
+    save_value(directory, 1)
+    save_value(directory, 2)
+    path = os.path.join(directory, JOURNAL_FILE)
+    with open(path, "rb+") as f:
+        f.truncate(os.path.getsize(path) - 10)
+
+    loaded = reload(directory)
+    assert loaded["plan"]["事業A"]["profit"]["2024/04"].rows[0].value == 1
+    assert "壊れた記録" in capsys.readouterr().out
+
+
+def test_until_applies_records_up_to_the_time(tmp_path):
+    directory = str(tmp_path)
+    setup_store(directory)
+    for value in [1, 2, 3]:
+        save_value(directory, value)
+    # 記録の時刻を1日ずつずらす
+    lines = journal_lines(directory)
+    with open(os.path.join(directory, JOURNAL_FILE), "w") as f:
+        for i, line in enumerate(lines):
+            record = json.loads(line)
+            record["time"] = f"2026-01-0{i+1}T12:00:00"
+            f.write(json.dumps(record) + "\n")
+
+    assert reload(directory, until=datetime.datetime(2025, 12, 31))["plan"]["事業A"]["profit"]["2024/04"].rows[0].value == 1000
+    assert reload(directory, until=datetime.datetime(2026, 1, 2, 12))["plan"]["事業A"]["profit"]["2024/04"].rows[0].value == 2
+    assert reload(directory)["plan"]["事業A"]["profit"]["2024/04"].rows[0].value == 3
+
+
+def test_compact_after_record_limit(tmp_path):
+    directory = str(tmp_path)
+    setup_store(directory)
+    for value in range(1, COMPACT_RECORDS):
+        save_value(directory, value)
+    assert len(journal_lines(directory)) == COMPACT_RECORDS - 1
+
+    save_value(directory, 100)
+    assert journal_lines(directory) == []
+    expected, _ = JsonStorage(directory).load()
+    assert expected["plan"]["事業A"]["profit"]["2024/04"].rows[0].value == 100
+    assert dump(reload(directory)) == dump(expected)
+
+
+def test_compact_when_journal_is_larger_than_snapshot(tmp_path):
+    directory = str(tmp_path)
+    setup_store(directory)
+    backend = JournalStorage(directory)
+    data_store, _ = backend.load()
+    for typ in ["plan", "performance"]:
+        for data in data_store[typ].values():
+            for kind in ["profit", "loss"]:
+                for monthly in data[kind].values():
+                    for r in monthly.rows:
+                        r.value += 0.5
+    backend.save(data_store)
+    # 全ての行を書き換えた記録は、まとめたstore.jsonより大きい
+    assert journal_lines(directory) == []
+    assert dump(JsonStorage(directory).load()[0]) == dump(data_store)
+
+
+def test_compact_option(tmp_path):
+    directory = str(tmp_path)
+    setup_store(directory)
+    save_value(directory, 1)
+    assert len(journal_lines(directory)) == 1
+    save_value(directory, 2, compact=True)
+    assert journal_lines(directory) == []
+    assert JsonStorage(directory).load()[0]["plan"]["事業A"]["profit"]["2024/04"].rows[0].value == 2
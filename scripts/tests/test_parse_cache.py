@@ -0,0 +1,39 @@
+import os
+import datetime
+
+from parse_cache import ParseCache
+
+
+def make_file(directory, name: str, text: str) -> str:
+    path = os.path.join(str(directory), name)
+    with open(path, "w") as f:
+        f.write(text)
+    return path
+
+
+def test_put_save_and_get(tmp_path):
+    path = make_file(tmp_path, "事業A.xlsx", "a")
+    data = [{"name": "計画", "headers": ["2024/4"], "sales": {"labels": [["売上", None, None]], "values": {"2024/4": [1.5]}}}]
+    cache = ParseCache(str(tmp_path))
+    cache.put(path, [1, 2], data)
+    cache.save()
+
+    cache = ParseCache(str(tmp_path))
+    assert cache.get(path, [1, 2]) == data
+    assert cache.get(path, [1, 3]) is None  # 表の行数が変わった
+    make_file(tmp_path, "事業A.xlsx", "b")
+    assert cache.get(path, [1, 2]) is None  # 内容が変わった
+
+
+def test_entries_that_are_not_json_are_not_saved(tmp_path):
+    a = make_file(tmp_path, "事業A.xlsx", "a")
+    b = make_file(tmp_path, "事業B.xlsx", "b")
+    cache = ParseCache(str(tmp_path))
+    cache.put(a, [], [{"values": [datetime.datetime(2024, 4, 1)]}])
+    cache.put(b, [], [{"values": [1]}])
+    cache.save()
+
+    cache = ParseCache(str(tmp_path))
+    assert cache.get(a, []) is None
+    assert cache.get(b, []) == [{"values": [1]}]
+    assert not os.path.exists(os.path.join(str(tmp_path), "parse_cache.json.tmp"))
@@ -0,0 +1,21 @@
+import pldata
+import profiler
+from excel import utils, table
+
+from helpers import make_store, month_labels
+
+
+def test_counting_only_after_enable(monkeypatch):
+    for module in [pldata, utils, table]:
+        assert module.counters is None
+    months = month_labels("202404", 2)
+    data_store = make_store(months)
+    rows = data_store["plan"]["事業A"]["profit"]["2024/04"].rows
+    data_store["plan"]["事業A"]["profit"]["2024/04"].merge(rows)
+    assert sum(profiler.counters.values()) == 0
+
+    for module in [pldata, utils, table]:
+        monkeypatch.setattr(module, "counters", None)
+    monkeypatch.setattr(profiler, "counters", profiler.counters.copy())
+    stats = profiler.measure(None, True, "test", data_store["plan"]["事業A"]["profit"]["2024/04"].merge, rows)
+    assert stats["counts"] == {"merge_compare": len(rows)}
@@ -0,0 +1,38 @@
+import os
+
+from storage import JsonStorage
+from snapshot import SnapshotStorage, Snapshot, SNAPSHOT_FILE
+
+from helpers import make_store, month_labels, period, dump
+
+
+def test_snapshot_round_trip(tmp_path):
+    months = month_labels("202404", 24)
+    JsonStorage(str(tmp_path)).save(make_store(months))
+    expected, _ = JsonStorage(str(tmp_path)).load()
+
+    backend = SnapshotStorage(str(tmp_path))
+    backend.save(backend.load()[0])
+    loaded, _ = SnapshotStorage(str(tmp_path)).load()
+    assert dump(loaded) == dump(expected)
+
+    # --lazyで期間外に残した月も、もう一度保存すればそのまま書き出される
+    backend = SnapshotStorage(str(tmp_path))
+    data_store, _ = backend.load(period("202504", "202603"))
+    backend.save(data_store)
+    loaded, _ = SnapshotStorage(str(tmp_path)).load()
+    assert dump(loaded) == dump(expected)
+
+
+def test_blocks_can_be_read_twice_and_closed(tmp_path):
+    months = month_labels("202404", 2)
+    SnapshotStorage(str(tmp_path)).save(make_store(months))
+    snapshot = Snapshot(os.path.join(str(tmp_path), SNAPSHOT_FILE))
+    block = snapshot.raw()["plan"]["全社共通"]["loss"]["2024/04"]
+    rows = list(block)
+    assert list(block) == rows
+    assert rows[0] == {"label": ["販管費", "人件費", "営業"], "value": 100, "rest_value": 0}
+    assert type(rows[1]["value"]) is float and rows[1]["rest_value"] is None
+    assert "rest_value" not in snapshot.raw()["plan"]["全社共通"]["profit"]["2024/04"].list_monthly_data()[0]
+    # 読み出した後でも、mmapを閉じられる
+    snapshot.close()
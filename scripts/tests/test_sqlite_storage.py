@@ -0,0 +1,75 @@
+import random
+
+from storage import JsonStorage
+from sqlite_storage import SqliteStorage
+from aggregate import Aggregation
+
+from helpers import make_store, month_labels, period, dump
+
+
+def test_lazy_migration_from_json_keeps_all_months(tmp_path):
+    months = month_labels("202404", 36)
+    JsonStorage(str(tmp_path)).save(make_store(months))
+
+    # --lazyで期間を絞っていても、store.jsonから移す時は全ての月をstore.sqlite3に書き込む
+    backend = SqliteStorage(str(tmp_path))
+    data_store, _ = backend.load(period("202604", "202703"))
+    backend.save(data_store)
+    yms = [r[0] for r in backend.connect().execute("SELECT DISTINCT yyyymm FROM cells ORDER BY ym")]
+    backend.close()
+    assert yms == months
+
+    expected, _ = JsonStorage(str(tmp_path)).load()
+    backend = SqliteStorage(str(tmp_path))
+    loaded, _ = backend.load()
+    backend.close()
+    assert dump(loaded) == dump(expected)
+
+
+def test_lazy_load_from_db_saves_only_changes(tmp_path):
+    months = month_labels("202404", 24)
+    JsonStorage(str(tmp_path)).save(make_store(months))
+    backend = SqliteStorage(str(tmp_path))
+    backend.save(backend.load()[0])
+    backend.close()
+
+    # store.sqlite3があれば、期間外の月は読み込まずにそのまま残す
+    backend = SqliteStorage(str(tmp_path))
+    data_store, _ = backend.load(period("202504", "202603"))
+    data_store["plan"]["事業A"]["profit"]["2025/04"].rows[0].value = 1
+    backend.save(data_store)
+    backend.close()
+
+    backend = SqliteStorage(str(tmp_path))
+    loaded, _ = backend.load()
+    backend.close()
+    assert len([key for key in dump(loaded) if key[2] == "profit"]) == 2 * 2 * 24
+    assert loaded["plan"]["事業A"]["profit"]["2025/04"].rows[0].value == 1
+    assert loaded["plan"]["事業A"]["profit"]["2024/04"].rows[0].value == 1000
+
+
+def test_aggregate_matches_python_aggregation(tmp_path):
+    months = month_labels("202404", 12)
+    data_store = make_store(months, businesses=("事業A", "事業B", "全社共通"))
+    # 足す順番で結果が変わる小数(売上項目ごと、経費グループごとにまとめてから足すと、一つずつ足した結果とずれる)
+    rnd = random.Random(0)
+    for business in data_store["plan"]:
+        for kind in ["profit", "loss"]:
+            for monthly in data_store["plan"][business][kind].values():
+                for row in monthly.rows:
+                    row.value = round(rnd.uniform(0, 100000), 1)
+    header_row = months + ["2025/3決算"]
+
+    backend = SqliteStorage(str(tmp_path))
+    backend.save(data_store)
+    result = backend.aggregate(header_row)
+    loaded, _ = backend.load()
+    backend.close()
+
+    expected = Aggregation(data_store, header_row)
+    assert list(loaded["plan"].keys()) == list(data_store["plan"].keys())
+    for typ in ["plan", "performance"]:
+        assert result.get_earnings(typ) == expected.get_earnings(typ)
+        assert Aggregation(loaded, header_row).get_earnings(typ) == expected.get_earnings(typ)
+        assert result.get_profit(typ) == expected.get_profit(typ)
+        assert result.get_group(typ) == expected.get_group(typ)
@@ -0,0 +1,84 @@
+import os
+import json
+
+import pytest
+
+from storage import JsonStorage, STORE_FILE, write_json_atomically, convert_store
+
+from helpers import make_store, month_labels, period, dump
+
+
+def make_values_store() -> dict:
+    """整数、小数、整数値の小数、None、文字列の値を含むデータストア"""
+    data_store = make_store(month_labels("202404", 6))
+    rows = data_store["plan"]["事業A"]["profit"]["2024/04"].rows
+    rows[0].value = 2.0
+    rows[1].value = None
+    rows = data_store["plan"]["事業A"]["loss"]["2024/05"].rows
+    rows[0].value = "未定"
+    rows[2].value = 3
+    rows[2].rest_value = 1.0
+    return data_store
+
+
+def read(directory: str) -> dict:
+    with open(os.path.join(directory, STORE_FILE)) as f:
+        return json.load(f)
+
+
+def test_save_and_load(tmp_path):
+    directory = str(tmp_path)
+    data_store = make_values_store()
+    JsonStorage(directory).save(data_store)
+    assert read(directory)["version"] == 2
+    assert not os.path.exists(os.path.join(directory, STORE_FILE + ".tmp"))
+
+    loaded, _ = JsonStorage(directory).load()
+    assert dump(loaded) == dump(data_store)
+    assert type(loaded["plan"]["事業A"]["profit"]["2024/04"].rows[0].value) is float
+    assert type(loaded["plan"]["事業A"]["loss"]["2024/05"].rows[2].value) is int
+    assert type(loaded["plan"]["事業A"]["loss"]["2024/05"].rows[2].rest_value) is float
+
+
+def test_v1_v2_v1_is_lossless(tmp_path):
+    directory = str(tmp_path)
+    path = os.path.join(directory, STORE_FILE)
+    write_json_atomically(path, make_values_store(), version=1)
+    with open(path, "rb") as f:
+        original = f.read()
+    assert "version" not in json.loads(original)
+
+    convert_store(directory, 2)
+    assert read(directory)["version"] == 2
+    convert_store(directory, 1)
+    with open(path, "rb") as f:
+        assert f.read() == original
+
+
+def test_v1_and_v2_load_the_same(tmp_path):
+    data_store = make_values_store()
+    write_json_atomically(os.path.join(str(tmp_path), STORE_FILE), data_store, version=1)
+    from_v1, _ = JsonStorage(str(tmp_path)).load()
+    JsonStorage(str(tmp_path)).save(from_v1)
+    from_v2, _ = JsonStorage(str(tmp_path)).load()
+    assert dump(from_v1) == dump(data_store)
+    assert dump(from_v2) == dump(data_store)
+
+    # --lazyで期間外の月をv2のまま残しても、保存し直した結果は変わらない
+    lazy, _ = JsonStorage(str(tmp_path)).load(period("202406", "202407"))
+    JsonStorage(str(tmp_path)).save(lazy)
+    loaded, _ = JsonStorage(str(tmp_path)).load()
+    assert dump(loaded) == dump(data_store)
+
+
+def test_failed_save_keeps_the_previous_file(tmp_path):
+    directory = str(tmp_path)
+    JsonStorage(directory).save(make_values_store())
+    before = read(directory)
+
+    data_store = make_values_store()
+    data_store["config"]["壊れた値"] = object()  # JSONにできない
+    with pytest.raises(TypeError):
+        JsonStorage(directory).save(data_store)
+    assert read(directory) == before
+    assert not os.path.exists(os.path.join(directory, STORE_FILE + ".tmp"))